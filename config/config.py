@@ -13,7 +13,7 @@ import os
 # SERIAL PORT CONFIGURATION
 # ============================================================================
 
-# Serial port device path
+# Serial port device path (tried first when scanning for the adapter)
 SERIAL_PORT = os.getenv('SSM2_SERIAL_PORT', '/dev/ttyUSB0')
 
 # Serial baud rate (SSM2 standard is 4800)
@@ -22,6 +22,28 @@ SERIAL_BAUDRATE = int(os.getenv('SSM2_BAUDRATE', '4800'))
 # Serial timeout in seconds
 SERIAL_TIMEOUT = int(os.getenv('SSM2_TIMEOUT', '2'))
 
+# Record all raw serial traffic to a capture file in the log directory
+SERIAL_CAPTURE = os.getenv('SSM2_CAPTURE', 'false').lower() == 'true'
+
+# Replay a capture file instead of opening a serial port (empty = use the adapter)
+SERIAL_REPLAY_FILE = os.getenv('SSM2_REPLAY', '')
+
+# Replay with the recorded timing (true) or as fast as possible (false)
+SERIAL_REPLAY_REALTIME = os.getenv('SSM2_REPLAY_REALTIME', 'true').lower() == 'true'
+
+# ECU response delay for one-shot requests in seconds (used by the request planner cost model)
+SERIAL_RESPONSE_DELAY = float(os.getenv('SSM2_RESPONSE_DELAY', '0.025'))
+
+# SSM2 address of the transmission control unit (only used if logger.py TCU_PARAMETERS is not empty)
+TCU_ADDRESS = int(os.getenv('SSM2_TCU_ADDRESS', '0x18'), 0)
+
+# Seconds each control unit streams before the line is handed to the other one
+ECU_SLICE_TIME = float(os.getenv('SSM2_ECU_SLICE', '2.0'))
+TCU_SLICE_TIME = float(os.getenv('SSM2_TCU_SLICE', '0.5'))
+
+# Seconds between checks for a lost USB adapter coming back (also the adapter rescan interval)
+RECONNECT_POLL_INTERVAL = float(os.getenv('SSM2_RECONNECT_POLL', '0.5'))
+
 
 # ============================================================================
 # DISPLAY CONFIGURATION
@@ -50,6 +72,24 @@ FONT_PATH = os.getenv('SSM2_FONT_PATH', os.path.join('/','etc', 'pySSM2', 'asset
 # Directory for CSV log files
 LOG_DIRECTORY = os.getenv('SSM2_LOG_DIR', '/var/log/subaru/')
 
+# Directory for state kept across restarts (last adapter, ECU init cache)
+STATE_DIRECTORY = os.getenv('SSM2_STATE_DIR', '/var/lib/pySSM2/')
+
+# Last successful K-line adapter (USB VID/PID/serial number), tried first when scanning
+LAST_ADAPTER_FILE = os.path.join(STATE_DIRECTORY, 'last_adapter.json')
+
+# ECU init response, capabilities and request plans keyed by ECU ID (skips the full init on restart)
+ECU_CACHE_FILE = os.path.join(STATE_DIRECTORY, 'ecu_cache.json')
+
+# RomRaider logger definitions, and their compiled cache (rebuilt whenever the XML changes)
+DEFINITIONS_FILE = os.getenv('SSM2_DEFINITIONS', os.path.join('/', 'etc', 'pySSM2', 'logger.xml'))
+DEFINITIONS_CACHE_FILE = os.path.join(STATE_DIRECTORY, 'definitions.bin')
+
+# Add every parameter the ECU reports as supported (capability bits + logger.xml)
+# to the configured ones, as many as still stream at AUTO_SELECT_RATE samples/s
+AUTO_SELECT_PARAMETERS = os.getenv('SSM2_AUTO_SELECT', 'false').lower() == 'true'
+AUTO_SELECT_RATE = float(os.getenv('SSM2_AUTO_SELECT_RATE', '10'))
+
 
 # ============================================================================
 # LOGGING CONFIGURATION
@@ -61,6 +101,26 @@ ENABLE_CSV_LOGGING = os.getenv('SSM2_ENABLE_CSV', 'true').lower() == 'true'
 # CSV filename format (uses strftime format)
 CSV_FILENAME_FORMAT = os.getenv('SSM2_CSV_FORMAT', '%Y%m%d-%H%M%S-SubaruLog.csv')
 
+# Log file format: 'csv' (text), or 'binary' (fixed-size records, see binary_log.py;
+# the file name keeps CSV_FILENAME_FORMAT with a .ssm2log extension)
+LOG_FORMAT = os.getenv('SSM2_LOG_FORMAT', 'csv').lower()
+
+# Compress the log on the fly: 'none', 'gzip', 'lzma' or 'zstd' (needs the zstandard
+# package). Compressed logs get a .ssz extension, see log_segments.py
+LOG_COMPRESSION = os.getenv('SSM2_LOG_COMPRESSION', 'none').lower()
+
+# Seconds of logging per compressed segment (a power cut loses at most the open one)
+LOG_SEGMENT_SECONDS = float(os.getenv('SSM2_LOG_SEGMENT', '5'))
+
+# Start a new log file (in the current date's directory) once the current one reaches
+# this size (MB) or age (hours), and at local midnight; 0 disables a limit
+LOG_ROTATE_SIZE_MB = float(os.getenv('SSM2_LOG_ROTATE_MB', '32'))
+LOG_ROTATE_HOURS = float(os.getenv('SSM2_LOG_ROTATE_HOURS', '1'))
+LOG_ROTATE_MIDNIGHT = os.getenv('SSM2_LOG_ROTATE_MIDNIGHT', 'true').lower() == 'true'
+
+# Reserve LOG_ROTATE_SIZE_MB on disk for each new log file (trimmed when it is closed)
+LOG_PREALLOCATE = os.getenv('SSM2_LOG_PREALLOCATE', 'true').lower() == 'true'
+
 # Enable debug output
 DEBUG_MODE = os.getenv('SSM2_DEBUG', 'false').lower() == 'true'
 
@@ -79,6 +139,12 @@ LOG_FILE_MAX_BYTES = int(os.getenv('SSM2_LOG_MAX_BYTES', str(10 * 1024 * 1024)))
 # Number of backup log files to keep
 LOG_FILE_BACKUP_COUNT = int(os.getenv('SSM2_LOG_BACKUP_COUNT', '5'))
 
+# Record raw serial TX/RX bytes in an in-memory ring buffer (dumped on error or SIGUSR1)
+ENABLE_PROTOCOL_TRACE = os.getenv('SSM2_TRACE', 'false').lower() == 'true'
+
+# Number of trace ring buffer slots (each holds up to 256 bytes of one read or write)
+PROTOCOL_TRACE_SLOTS = int(os.getenv('SSM2_TRACE_SLOTS', '2048'))
+
 
 # ============================================================================
 # PERFORMANCE TUNING
@@ -87,8 +153,18 @@ LOG_FILE_BACKUP_COUNT = int(os.getenv('SSM2_LOG_BACKUP_COUNT', '5'))
 # Sleep interval in main logger loop (seconds)
 LOGGER_SLEEP_INTERVAL = float(os.getenv('SSM2_LOGGER_SLEEP', '0.001'))
 
-# Sleep interval in CSV writer loop (seconds)
-CSV_WRITER_SLEEP_INTERVAL = float(os.getenv('SSM2_CSV_SLEEP', '0.001'))
+# The CSV writer thread commits (one write and flush) once this many samples are waiting...
+CSV_COMMIT_ROWS = int(os.getenv('SSM2_CSV_COMMIT_ROWS', '100'))
+
+# ...or this long (seconds) after the previous commit, whichever comes first
+CSV_COMMIT_INTERVAL = float(os.getenv('SSM2_CSV_COMMIT_INTERVAL', '1.0'))
+
+# fsync the CSV file after a commit at most this often (seconds), 0 leaves it to the OS
+CSV_FSYNC_INTERVAL = float(os.getenv('SSM2_CSV_FSYNC', '0'))
+
+# Samples kept in memory (the display and CSV writer read them from this ring;
+# 8 bytes per parameter per sample, 6000 is 10 minutes at 10 samples/s)
+SAMPLE_BUFFER_ROWS = int(os.getenv('SSM2_SAMPLE_BUFFER', '6000'))
 
 
 # ============================================================================
@@ -115,6 +191,30 @@ def validate_config():
         print(f"WARNING: Font file not found: {FONT_PATH}")
         print("Dashboard will fall back to system font.")
 
+    if SERIAL_REPLAY_FILE and not os.path.exists(SERIAL_REPLAY_FILE):
+        raise ValueError(f"Replay capture file does not exist: {SERIAL_REPLAY_FILE}")
+
+    if LOG_FORMAT not in ('csv', 'binary'):
+        raise ValueError(f"Invalid log format: {LOG_FORMAT} (must be csv or binary)")
+
+    if LOG_COMPRESSION not in ('none', 'gzip', 'lzma', 'zstd'):
+        raise ValueError(f"Invalid log compression: {LOG_COMPRESSION} (must be none, gzip, lzma or zstd)")
+
+    if LOG_COMPRESSION == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("zstd log compression needs the zstandard package (pip install zstandard)")
+
+    if LOG_ROTATE_SIZE_MB < 0 or LOG_ROTATE_HOURS < 0:
+        raise ValueError(f"Invalid log rotation: {LOG_ROTATE_SIZE_MB} MB, {LOG_ROTATE_HOURS} hours")
+
+    if CSV_COMMIT_ROWS < 1 or CSV_COMMIT_INTERVAL <= 0:
+        raise ValueError(f"Invalid CSV commit window: {CSV_COMMIT_ROWS} samples, {CSV_COMMIT_INTERVAL} s")
+
+    if SAMPLE_BUFFER_ROWS < 1:
+        raise ValueError(f"Invalid sample buffer size: {SAMPLE_BUFFER_ROWS} (must be at least 1)")
+
     # Validate display settings
     if DISPLAY_WIDTH < 320 or DISPLAY_HEIGHT < 240:
         raise ValueError(f"Display resolution too small: {DISPLAY_WIDTH}x{DISPLAY_HEIGHT} (minimum 320x240)")
@@ -131,7 +231,7 @@ def validate_config():
 
 def get_log_file_path():
     """
-    Generate the full path for the current CSV log file.
+    Generate the full path for the current CSV (or binary) log file.
     Creates a hierarchical directory structure: YYYY/Month/DD/
     Example: /var/log/subaru/2025/October/24/20251024-143022-SubaruLog.csv
     """
@@ -152,6 +252,10 @@ def get_log_file_path():
 
     # Generate filename using configured format
     filename = time.strftime(CSV_FILENAME_FORMAT)
+    if LOG_FORMAT == 'binary':
+        filename = os.path.splitext(filename)[0] + '.ssm2log'
+    if LOG_COMPRESSION != 'none':
+        filename += '.ssz'
 
     return os.path.join(log_dir, filename)
 
@@ -197,6 +301,25 @@ def get_python_log_paths():
     }
 
 
+def get_capture_file_path():
+    """
+    Generate the full path for a raw serial capture, next to the CSV logs.
+    Example: /var/log/subaru/2025/October/24/20251024-143022-capture.bin
+    """
+    return os.path.splitext(get_log_file_path())[0] + '-capture.bin'
+
+
+def get_trace_file_path():
+    """
+    Generate the full path for a protocol trace dump.
+    Trace dumps go next to the Python application logs for the current date.
+    Example: /var/log/subaru/python/2025/October/24/20251024-143022-trace.bin
+    """
+    import time
+
+    return os.path.join(get_python_log_directory(), time.strftime('%Y%m%d-%H%M%S-trace.bin'))
+
+
 def get_log_files_tree():
     """
     Get a nested dictionary representing the log directory structure.
@@ -207,6 +330,8 @@ def get_log_files_tree():
     from collections import defaultdict
 
     tree = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
+    extensions = ('.csv', '.ssm2log', '.ssz')
+    extensions += tuple(extension + '.part' for extension in extensions)
 
     if not os.path.exists(LOG_DIRECTORY):
         return {}
@@ -227,8 +352,9 @@ def get_log_files_tree():
                 if not os.path.isdir(day_path):
                     continue
 
-                # Get all CSV files in this day directory
-                files = [f for f in os.listdir(day_path) if f.endswith('.csv')]
+                # Get all CSV and binary log files (compressed or not, finished or
+                # still being written) in this day directory
+                files = [f for f in os.listdir(day_path) if f.endswith(extensions)]
                 if files:
                     tree[year_dir][month_dir][day_dir] = sorted(files)
 
@@ -244,14 +370,30 @@ def print_config():
     print("=" * 70)
     print(f"Serial Port:        {SERIAL_PORT}")
     print(f"Baud Rate:          {SERIAL_BAUDRATE}")
+    if SERIAL_REPLAY_FILE:
+        print(f"Replaying Capture:  {SERIAL_REPLAY_FILE} ({'real time' if SERIAL_REPLAY_REALTIME else 'fast'})")
+    print(f"Serial Capture:     {'Enabled' if SERIAL_CAPTURE else 'Disabled'}")
+    print(f"Reconnect Poll:     {RECONNECT_POLL_INTERVAL} s")
+    print(f"Bus Slices:         ECU {ECU_SLICE_TIME} s, TCU (0x{TCU_ADDRESS:02X}) {TCU_SLICE_TIME} s")
+    print(f"Auto-Select:        {f'Enabled ({AUTO_SELECT_RATE} samples/s)' if AUTO_SELECT_PARAMETERS else 'Disabled'}")
     print(f"Display:            {DISPLAY_WIDTH}x{DISPLAY_HEIGHT} @ {DISPLAY_FPS}fps")
     print(f"Fullscreen:         {'Yes' if DISPLAY_FULLSCREEN else 'No'}")
+    print(f"Sample Buffer:      {SAMPLE_BUFFER_ROWS} samples")
     print(f"CSV Logging:        {'Enabled' if ENABLE_CSV_LOGGING else 'Disabled'}")
     if ENABLE_CSV_LOGGING:
+        print(f"Log Format:         {LOG_FORMAT}"
+              f"{f', {LOG_COMPRESSION} compressed in {LOG_SEGMENT_SECONDS} s segments' if LOG_COMPRESSION != 'none' else ''}")
         print(f"Log Directory:      {LOG_DIRECTORY}")
+        rotation = [f'{LOG_ROTATE_SIZE_MB:g} MB' if LOG_ROTATE_SIZE_MB else None,
+                    f'{LOG_ROTATE_HOURS:g} h' if LOG_ROTATE_HOURS else None,
+                    'midnight' if LOG_ROTATE_MIDNIGHT else None]
+        print(f"Log Rotation:       {', '.join(filter(None, rotation)) or 'Disabled'}")
         print(f"Current Log File:   {get_log_file_path()}")
         print(f"Log Structure:      YYYY/MonthName/DD/")
+        print(f"CSV Commits:        every {CSV_COMMIT_ROWS} samples or {CSV_COMMIT_INTERVAL} s, "
+              f"{f'fsync every {CSV_FSYNC_INTERVAL} s' if CSV_FSYNC_INTERVAL else 'no fsync'}")
     print(f"Debug Mode:         {'Enabled' if DEBUG_MODE else 'Disabled'}")
+    print(f"Protocol Trace:     {'Enabled' if ENABLE_PROTOCOL_TRACE else 'Disabled'}")
     print(f"Log Level:          {LOG_LEVEL}")
     print("=" * 70)
 
@@ -9,6 +9,7 @@ set -euo pipefail
 INSTALL_DIR="/etc/pySSM2"
 LOG_DIR="/var/log/subaru"
 PYTHON_LOG_DIR="/var/log/subaru/python"
+STATE_DIR="/var/lib/pySSM2"
 SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
 
 # Detect current user and Wayland environment
@@ -117,15 +118,37 @@ cmd_update() {
     mkdir -p "$INSTALL_DIR/assets/fonts"
     mkdir -p "$LOG_DIR"
     mkdir -p "$PYTHON_LOG_DIR"
+    mkdir -p "$STATE_DIR"
 
     # Source files
     cp "$SCRIPT_DIR/src/logger.py"           "$INSTALL_DIR/logger.py"
     cp "$SCRIPT_DIR/src/PySSM2.py"           "$INSTALL_DIR/PySSM2.py"
     cp "$SCRIPT_DIR/src/ecu_capabilities.py" "$INSTALL_DIR/ecu_capabilities.py"
+    cp "$SCRIPT_DIR/src/frame_parser.py"     "$INSTALL_DIR/frame_parser.py"
+    cp "$SCRIPT_DIR/src/async_transport.py"  "$INSTALL_DIR/async_transport.py"
+    cp "$SCRIPT_DIR/src/request_planner.py"  "$INSTALL_DIR/request_planner.py"
+    cp "$SCRIPT_DIR/src/poll_scheduler.py"   "$INSTALL_DIR/poll_scheduler.py"
+    cp "$SCRIPT_DIR/src/protocol_trace.py"   "$INSTALL_DIR/protocol_trace.py"
+    cp "$SCRIPT_DIR/src/serial_capture.py"   "$INSTALL_DIR/serial_capture.py"
+    cp "$SCRIPT_DIR/src/ecu_cache.py"        "$INSTALL_DIR/ecu_cache.py"
+    cp "$SCRIPT_DIR/src/bus_scheduler.py"    "$INSTALL_DIR/bus_scheduler.py"
+    cp "$SCRIPT_DIR/src/memory_dump.py"      "$INSTALL_DIR/memory_dump.py"
+    cp "$SCRIPT_DIR/src/definitions.py"      "$INSTALL_DIR/definitions.py"
+    cp "$SCRIPT_DIR/src/expressions.py"      "$INSTALL_DIR/expressions.py"
+    cp "$SCRIPT_DIR/src/derived.py"          "$INSTALL_DIR/derived.py"
+    cp "$SCRIPT_DIR/src/switches.py"         "$INSTALL_DIR/switches.py"
+    cp "$SCRIPT_DIR/src/frame_decoder.py"    "$INSTALL_DIR/frame_decoder.py"
+    cp "$SCRIPT_DIR/src/sample_ring.py"      "$INSTALL_DIR/sample_ring.py"
+    cp "$SCRIPT_DIR/src/csv_writer.py"       "$INSTALL_DIR/csv_writer.py"
+    cp "$SCRIPT_DIR/src/binary_log.py"       "$INSTALL_DIR/binary_log.py"
+    cp "$SCRIPT_DIR/src/log_segments.py"     "$INSTALL_DIR/log_segments.py"
 
     # Config
     cp "$SCRIPT_DIR/config/config.py"        "$INSTALL_DIR/config.py"
 
+    # Parameter definitions (RomRaider logger.xml)
+    cp "$SCRIPT_DIR/logger.xml"              "$INSTALL_DIR/logger.xml"
+
     # GUI
     cp "$SCRIPT_DIR/src/gui/__init__.py"     "$INSTALL_DIR/gui/__init__.py"
     cp "$SCRIPT_DIR/src/gui/app.py"          "$INSTALL_DIR/gui/app.py"
@@ -139,6 +162,7 @@ cmd_update() {
     # Permissions
     chmod +x "$INSTALL_DIR/logger.py"
     chown -R "$CURRENT_USER:$CURRENT_USER" "$INSTALL_DIR"
+    chown -R "$CURRENT_USER:$CURRENT_USER" "$STATE_DIR"
     chmod 755 "$LOG_DIR"
 
     info "Files deployed."
@@ -157,6 +181,7 @@ cmd_uninstall() {
     systemctl daemon-reload
 
     rm -rf "$INSTALL_DIR"
+    rm -rf "$STATE_DIR"
 
     info "Uninstall done."
     echo ""
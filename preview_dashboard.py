@@ -14,6 +14,7 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
 
 import pygame
 from gui.dashboard import Dashboard, GAUGE_CONFIG
+from sample_ring import SampleRing
 
 WIDTH = 800
 HEIGHT = 480
@@ -37,6 +38,8 @@ def main():
     pygame.display.set_caption("pySSM2 Dashboard Preview")
 
     dash = Dashboard(WIDTH, HEIGHT)
+    # The dashboard reads the logger's sample ring
+    samples = SampleRing(fake_data(0).keys(), capacity=100)
     clock = pygame.time.Clock()
     start = time.time()
     last = start
@@ -58,7 +61,8 @@ def main():
                 screen = pygame.display.set_mode((event.w, event.h), pygame.RESIZABLE)
                 dash = Dashboard(event.w, event.h)
 
-        dash.update(fake_data(t))
+        samples.append(now, fake_data(t).values())
+        dash.update({'_samples': samples})
         dash.draw(screen, t, dt)
         pygame.display.flip()
         clock.tick(30)
@@ -1,20 +1,43 @@
+import os
+import json
 import serial
 import serial.tools.list_ports
 import struct
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from ecu_capabilities import parse_ecu_capabilities
+from frame_parser import FrameParser
+from protocol_trace import TX, RX
 
 class PySSM2:
-    def __init__(self, port, baudrate=4800, timeout=2):
+    def __init__(self, port, baudrate=4800, timeout=2, ser=None, destination=0x10):
         """
         Initialize the SSM2Protocol class with the default serial communication settings.
+        An already open serial-like object (e.g. a capture replay) can be passed as ser.
+        destination selects the control unit: 0x10 engine ECU, 0x18 TCU.
         """
         self.port = port
         self.baudrate = baudrate
         self.timeout = timeout
         self.source = 0xF0  # Default source address (Diagnostic Tool)
-        self.destination = 0x10  # Destination address (Subaru ECU)
-        self.ser = serial.Serial(port, baudrate=baudrate, timeout=timeout)  # Initialize serial connection
+        self.destination = destination  # Destination address (Subaru ECU)
+        if ser is None:
+            ser = serial.Serial(port, baudrate=baudrate, timeout=timeout)  # Initialize serial connection
+        self.ser = ser
+        # Streaming parser for continuous reads, only keeps frames from the destination addressed to us
+        self.parser = FrameParser(destination=self.source, checksum=self.calculate_checksum,
+                                  source=self.destination)
+        # Optional protocol_trace.ProtocolTrace, records raw TX/RX bytes when set
+        self.trace = None
+
+    def set_destination(self, destination):
+        """
+        Address subsequent requests to another control unit on the same K-line.
+        Stop any continuous read on the current unit first.
+        """
+        self.destination = destination
+        self.parser.source = destination
+        self.parser.reset()
 
     def calculate_checksum(self, packet):
         """
@@ -22,15 +45,38 @@ class PySSM2:
         """
         return sum(packet) & 0xFF
 
+    def write(self, packet):
+        """
+        Write raw bytes to the serial port (recorded in the trace if enabled).
+        """
+        if self.trace is not None:
+            self.trace.record(TX, packet)
+        return self.ser.write(packet)
+
+    def read(self, size):
+        """
+        Read raw bytes from the serial port (recorded in the trace if enabled).
+        """
+        data = self.ser.read(size)
+        if self.trace is not None and data:
+            self.trace.record(RX, data)
+        return data
+
+    def build_packet(self, data):
+        """
+        Construct a packet with a header (0x80, destination, source, data length), data, and checksum.
+        """
+        packet = [0x80, self.destination, self.source, len(data)] + list(data)
+        packet.append(self.calculate_checksum(packet))  # Append the calculated checksum
+        return bytearray(packet)
+
     def send_packet(self, data, responseLength=1024):
         """
         Send a packet constructed using the SSM2 protocol. It includes the header, data, and checksum.
         """
-        # Construct the packet with a header (0x80, destination, source, data length), data, and checksum
-        packet = [0x80, self.destination, self.source,  len(data)] + data
-        packet.append(self.calculate_checksum(packet))  # Append the calculated checksum
+        packet = self.build_packet(data)
         # Send the packet via the serial port
-        self.ser.write(bytearray(packet))   
+        self.write(packet)
         response = self.receive_packet(len(packet) + responseLength)
         response = response[len(packet):]
         if not response:
@@ -38,32 +84,32 @@ class PySSM2:
         return response
     
     def receive_packet(self, responseLength):
-        response = self.ser.read(responseLength)
-        # DEBUG
-        print("---")
-        print("Packet Read:")
-        print(response[1])
-        print(f"Returned Number of Bytes: {len(response)}")
-        print(f"Expected Returned Number of Bytes: {responseLength}")
-        print(f"Full Hex String: {' '.join(hex(n) for n in response)}")
-        print(f"Start Byte: {hex(response[0])}")
-        print(f"Destination Byte: {hex(response[1])}")
-        print(f"Source Byte: {hex(response[2])}")
-        print(f"Data Size Byte: {hex(response[3])}")
-        print(f"Data Size Int: {response[3]}")
-        datalen = int(response[3])
-        print(f"Data Bytes Hex: {' '.join(hex(n) for n in response[4:4 + datalen])}")
-        print(f"Data Bytes Int: {list(response[4:4 + datalen])}")
-        print(f"Expected Checksum: {hex(self.calculate_checksum(response[:4 + datalen]))}")
-        print(f"Returned Checksum: {response[4 + datalen: 5 + datalen].hex()}")
-        # DEBUG
+        response = self.read(responseLength)
         if not response:
             raise Exception("No response received from ECU.")
         return list(response)
 
+    def receive_frame(self):
+        """
+        Return the data section of the next valid frame from the ECU.
+
+        Reads whatever the port has buffered (at least one byte) and feeds it to the
+        streaming parser, so dropped or corrupt bytes only cost the frame they were
+        in. data[0] is the response code, data[1:] the payload. The returned
+        memoryview is only valid until the next call.
+        """
+        deadline = time.monotonic() + self.timeout
+        while True:
+            for data in self.parser.frames():
+                return data
+            chunk = self.read(self.ser.in_waiting or 1)
+            if chunk:
+                self.parser.feed(chunk)
+            elif time.monotonic() >= deadline:
+                raise TimeoutError("No response received from ECU.")
 
     def receive_packets_continuously(self, responseLength):
-        response = self.ser.read(responseLength)
+        response = self.read(responseLength)
 
         if not response:
             raise TimeoutError("No response received from ECU.")
@@ -82,6 +128,27 @@ class PySSM2:
             print("Error Reading from the ECU, ERROR:")
             print(e)
 
+    def read_block(self, address, byte_count):
+        """
+        One-shot 0xA0 block read of 1-254 bytes, for dumps.
+
+        Unlike read_memory() errors are raised, not printed: TimeoutError if no
+        valid frame arrives, ValueError if the reply is not the block asked for.
+        Returns the payload as a memoryview into the parser buffer (valid until
+        the next read). Frames with a bad checksum are dropped by the parser, so a
+        corrupted reply surfaces as a TimeoutError.
+        """
+        if not 1 <= byte_count <= 0xFE:
+            raise ValueError(f"Block read size must be 1-254 bytes, got {byte_count}")
+        self.parser.reset()
+        self.parser.data_size = byte_count + 1
+        self.write(self.build_packet([0xA0, 0x00] + list(struct.pack('>I', address)[1:]) + [byte_count - 1]))
+        data = self.receive_frame()
+        if data[0] != 0xE0 or len(data) != byte_count + 1:
+            raise ValueError(f"Unexpected reply 0x{data[0]:02X} ({len(data)} bytes) to block read "
+                             f"of {byte_count} bytes at 0x{address:06X}")
+        return data[1:]
+
     def read_single_address(self, addresses):
         """
         Read values from one or more specific addresses.
@@ -100,20 +167,46 @@ class PySSM2:
 
     def read_single_address_continuously(self, addresses):
         """
-        Read values from one or more specific addresses.
-        Each address should be a 3-byte value.
+        Start a continuous read of one or more specific addresses.
+        Each address should be a 3-byte value. Read the frames with receive_frame().
         """
-        # Calculate How long our response should be, Each address asked for should return 1 byte, add 6 bytes for all other packet data
-        responseLength = len(addresses) + 6
         # Construct the command for reading single addresses using 0xA8.
         # Each address is packed as 3 bytes.
         data = [0xA8, 0x01]  # Byte for reading single address + continious read mode byte 
         for address in addresses:
             # Pack each address as a 3-byte integer (use the last 3 bytes of a 4-byte integer)
             data += list(struct.pack('>I', address)[1:])  # Exclude the first byte (since we're only using 3 bytes)
-        # print("Read Single Address:")
-        return self.send_packet(data, responseLength)
-    
+        # Every frame of the stream carries the response code plus one byte per address
+        self.start_continuous(data, len(addresses) + 1)
+
+    def start_continuous(self, data, data_size):
+        """
+        Send a continuous read request without waiting for the reply.
+
+        The ECU streams frames of data_size data bytes until it receives another
+        command. The frame parser is primed with that size and starts from an
+        empty buffer, so receive_frame() skips the request echo and resyncs
+        on damaged frames.
+        """
+        self.parser.reset()
+        self.parser.data_size = data_size
+        self.write(self.build_packet(data))
+
+    def send_request(self, request, continuous=False):
+        """
+        Send a planned read request (see request_planner.ReadRequest).
+
+        A one-shot request returns the reply. A continuous request returns
+        straight away: the ECU streams frames until it receives another command,
+        read them with receive_frame().
+        """
+        if continuous:
+            self.start_continuous(request.data(continuous=True), request.response_size)
+            return None
+        self.parser.reset()
+        self.parser.data_size = None
+        return self.send_packet(request.data(), request.response_length)
+
     def write_memory(self, address, values):
         """
         Write a block of memory starting from the given address.
@@ -164,6 +257,37 @@ class PySSM2:
             'raw_capability_bytes': capability_bytes
         }
 
+    def request_init(self, data=(0xBF,)):
+        """
+        Send an ECU init request and return the full response packet (header included).
+
+        The reply is picked out of the stream by the frame parser, so it returns as soon
+        as the last byte arrives (each Subaru answers with a different length) and is not
+        thrown off by leftovers of an adapter probe or an earlier continuous read.
+        """
+        self.parser.reset()
+        self.parser.data_size = None
+        self.write(self.build_packet(data))
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            frame = self.receive_frame()
+            if frame[0] == 0xFF:
+                return [0x80, self.source, self.destination, len(frame)] + list(frame)
+        raise TimeoutError("No init response received from ECU.")
+
+    def verify_ecu_id(self, expected_id):
+        """
+        Single init handshake that only checks the ECU ID against a cached one.
+
+        Unlike ecu_init() there is no retry loop and the capability flags are not
+        decoded. Returns False on a timeout or a different ECU ID.
+        """
+        try:
+            response = self.request_init()
+        except TimeoutError:
+            return False
+        return list(response[8:13]) == list(expected_id)
+
     def ecu_init(self):
         """
         Send an ECU initialization request and return the response.
@@ -174,7 +298,7 @@ class PySSM2:
         self.ser.flush()
         while not initialized:
             try:
-                response = self.send_packet(data) # We're not going to bother asking for the amount of bytes as each subaru is different
+                response = self.request_init(data)
                 # Parse the ECU init response
                 ecu_info = self.parse_ecu_init(response)
                 print(f"ECU Initialized, ECU ID is: {ecu_info['ecu_id_hex']}")
@@ -187,6 +311,9 @@ class PySSM2:
 
                 initialized = True
                 return ecu_info
+            except serial.SerialException:
+                # Port lost, retrying on it is pointless
+                raise
             except Exception as e:
                 print("Could not initalize ECU, trying again in 3 seconds")
                 print(e)
@@ -199,15 +326,74 @@ class PySSM2:
         self.ser.close()
 
     @staticmethod
-    def scan_for_adapter(baudrate=4800, timeout=2, scan_interval=3, status=None):
+    def probe_port(port, baudrate=4800, timeout=2):
+        """
+        Send an ECU init request on a port and check for an ECU reply.
+        Returns True as soon as the reply header arrives (does not wait for the whole
+        init response or the timeout).
+        """
+        ser = serial.Serial(port, baudrate=baudrate, timeout=timeout)
+        try:
+            ser.flush()
+            # Send ECU init command: header + dest + source + data_len + 0xBF + checksum
+            packet = [0x80, 0x10, 0xF0, 0x01, 0xBF]
+            checksum = sum(packet) & 0xFF
+            packet.append(checksum)
+            ser.write(bytearray(packet))
+            # Read back our echo (6 bytes) plus the first bytes of the ECU response header
+            response = ser.read(len(packet) + 3)
+        finally:
+            ser.close()
+        # A valid ECU response starts with 0x80, addressed to us from the ECU, after the echo
+        return response[len(packet):] == bytes([0x80, 0xF0, 0x10])
+
+    @staticmethod
+    def load_last_adapter(cache_file):
+        """Return the last successful adapter dict saved by save_last_adapter(), or None."""
+        if not cache_file:
+            return None
+        try:
+            with open(cache_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def save_last_adapter(cache_file, port, port_info=None):
+        """Remember the adapter by USB VID/PID/serial number (and device path)."""
+        if not cache_file:
+            return
+        adapter = {
+            'device': port,
+            'vid': getattr(port_info, 'vid', None),
+            'pid': getattr(port_info, 'pid', None),
+            'serial_number': getattr(port_info, 'serial_number', None),
+        }
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            with open(cache_file, 'w') as f:
+                json.dump(adapter, f)
+        except OSError as e:
+            print(f"Could not save last adapter to {cache_file}: {e}")
+
+    @staticmethod
+    def scan_for_adapter(baudrate=4800, timeout=2, scan_interval=3, status=None, extra_ports=None,
+                         cache_file=None):
         """
-        Loop through available serial ports and attempt an ECU init on each one.
-        Returns the port string of the first adapter that responds.
+        Probe available serial ports with an ECU init and return the first port that answers.
         Keeps scanning until an adapter is found.
 
+        The adapter that answered last time (matched by USB VID/PID/serial number, so it
+        is found again even if it enumerates as a different ttyUSB) is tried on its own
+        first. Otherwise every port is probed at the same time and the first valid reply
+        wins, so a GPS dongle or modem that never answers no longer delays the scan.
+
         Args:
             status: Optional shared dict. If provided, sets status['_status']
                     with {'title': ..., 'message': ...} for UI display.
+            extra_ports: Optional device paths tried first if they exist, for ports
+                         comports() does not list (e.g. the pty of ecu_simulator.py).
+            cache_file: Optional JSON file remembering the last successful adapter.
         """
         def set_status(message):
             print(message)
@@ -218,60 +404,64 @@ class PySSM2:
             if status is not None:
                 status.pop('_status', None)
 
+        def probe(port):
+            try:
+                if PySSM2.probe_port(port, baudrate, timeout):
+                    return True
+                print(f"  {port}: no ECU response")
+            except serial.SerialException as e:
+                print(f"  {port}: {e}")
+            except Exception as e:
+                print(f"  {port}: {e}")
+            return False
+
+        def found(port, port_info):
+            set_status(f"Found adapter on {port}")
+            PySSM2.save_last_adapter(cache_file, port, port_info)
+            clear_status()
+            return port
+
+        last_adapter = PySSM2.load_last_adapter(cache_file)
+
         while True:
-            ports = serial.tools.list_ports.comports()
+            port_infos = {port_info.device: port_info for port_info in serial.tools.list_ports.comports()}
+            ports = list(port_infos)
+            for extra_port in reversed(extra_ports or []):
+                if extra_port not in ports and os.path.exists(extra_port):
+                    ports.insert(0, extra_port)
             if not ports:
                 set_status("No serial ports found")
                 time.sleep(scan_interval)
                 continue
 
+            # Fast path: the adapter that worked last time
+            if last_adapter:
+                known = [
+                    port for port, info in port_infos.items()
+                    if last_adapter.get('vid') is not None
+                    and (info.vid, info.pid, info.serial_number) == (
+                        last_adapter.get('vid'), last_adapter.get('pid'), last_adapter.get('serial_number'))
+                ]
+                if not known and last_adapter.get('device') in ports:
+                    known = [last_adapter['device']]
+                for port in known:
+                    set_status(f"Trying last adapter {port}...")
+                    if probe(port):
+                        return found(port, port_infos.get(port))
+                    ports.remove(port)
+
             set_status(f"Scanning {len(ports)} port(s)...")
-            for port_info in ports:
-                port = port_info.device
-                set_status(f"Trying {port}...")
+            if ports:
+                pool = ThreadPoolExecutor(max_workers=len(ports), thread_name_prefix="probe")
+                futures = {pool.submit(probe, port): port for port in ports}
                 try:
-                    ser = serial.Serial(port, baudrate=baudrate, timeout=timeout)
-                    ser.flush()
-                    # Send ECU init command: header + dest + source + data_len + 0xBF + checksum
-                    packet = [0x80, 0x10, 0xF0, 0x01, 0xBF]
-                    checksum = sum(packet) & 0xFF
-                    packet.append(checksum)
-                    ser.write(bytearray(packet))
-                    # Read back echo + response (at least the echo of 6 bytes + some response)
-                    response = ser.read(128)
-                    ser.close()
-                    # We expect to get back our echo (6 bytes) plus an ECU response
-                    # A valid ECU response starts with 0x80 after the echo
-                    if len(response) > len(packet) and response[len(packet)] == 0x80:
-                        set_status(f"Found adapter on {port}")
-                        time.sleep(1)
-                        clear_status()
-                        return port
-                    else:
-                        print(f"  {port}: no ECU response")
-                except serial.SerialException as e:
-                    print(f"  {port}: {e}")
-                except Exception as e:
-                    print(f"  {port}: {e}")
+                    for future in as_completed(futures):
+                        if future.result():
+                            port = futures[future]
+                            return found(port, port_infos.get(port))
+                finally:
+                    # Don't wait for probes of ports that will never answer
+                    pool.shutdown(wait=False)
 
             set_status("No adapter found, retrying...")
             time.sleep(scan_interval)
-
-
-
-# print("---")
-# print("Packet Read:")
-# print(f"Returned Number of Bytes: {len(response)}")
-# print(f"Expected Returned Number of Bytes: {responseLength}")
-# print(" ".join(hex(n) for n in response))
-# print(f"Start Byte: {hex(response[0])}")
-# print(f"Destination Byte: {hex(response[1])}")
-# print(f"Source Byte: {hex(response[2])}")
-# print(f"Data Size Byte: {hex(response[3])}")
-# print(f"Data Size Int: {response[3]}")
-# datalen = int(response[3])
-# print(f"Data Bytes Hex: {" ".join(hex(n) for n in response[4:4 + datalen])}")
-# print(f"Data Bytes Int: {list(response[4:4 + datalen])}")
-# print(f"Calculated Checksum: {hex(self.calculate_checksum(response[:4 + datalen]))}")
-# print(f"Returned Checksum: {response[4 + datalen: 5 + datalen].hex()}")
-# DEBUG
\ No newline at end of file
@@ -0,0 +1,167 @@
+"""
+Asyncio transport for PySSM2.
+
+Waits for serial data with loop.add_reader() on the port's file descriptor, so
+a coroutine waiting for the next ECU frame never blocks the event loop (and
+with it the pygame display and the CSV writer). Ports without a file descriptor
+(a capture replay, or event loops without add_reader, e.g. the Windows proactor
+loop) fall back to polling in_waiting until the timeout.
+"""
+
+import asyncio
+import time
+
+# How often ports without a file descriptor are polled (seconds)
+POLL_INTERVAL = 0.005
+
+
+class AsyncSSM2Transport:
+    """
+    Deliver frames from a PySSM2 connection to coroutines.
+
+    Usage:
+        transport = AsyncSSM2Transport(ssm2)
+        await transport.run(ssm2.ecu_init)
+        ssm2.read_single_address_continuously(addresses)   # Only sends the request
+        async for data in transport:
+            ...  # data[0] is the response code, data[1:] the payload
+
+    Frames are memoryviews into the PySSM2 frame parser buffer and are only valid
+    until the next frame is requested.
+    """
+
+    def __init__(self, ssm2, loop=None):
+        self.ssm2 = ssm2
+        self.loop = loop or asyncio.get_event_loop()
+        self.timeout = ssm2.timeout
+
+        try:
+            self._fd = ssm2.ser.fileno()
+        except (AttributeError, OSError, ValueError):
+            self._fd = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.receive_frame()
+
+    async def run(self, func, *args):
+        """Run a blocking PySSM2 call (init, one-shot request...) in the executor."""
+        return await self.loop.run_in_executor(None, func, *args)
+
+    def send(self, data):
+        """
+        Write an SSM2 packet without waiting for the reply.
+
+        Requests are a few bytes long, so the write completes straight away into
+        the OS buffer.
+        """
+        self.ssm2.write(self.ssm2.build_packet(data))
+
+    def start_continuous(self, request):
+        """
+        Start a continuous read (see request_planner.ReadRequest) without waiting.
+
+        The ECU streams the response until it receives another command; read the
+        frames with receive_frame() or async iteration.
+        """
+        self.ssm2.start_continuous(request.data(continuous=True), request.response_size)
+
+    async def request(self, data, data_size=None):
+        """
+        Send a one-shot request and return the data section of the ECU reply.
+
+        Args:
+            data: Command bytes
+            data_size: Expected response data size byte, if known
+        """
+        parser = self.ssm2.parser
+        parser.reset()
+        parser.data_size = data_size
+        self.send(data)
+        return await self.receive_frame()
+
+    async def drain(self, quiet_time, timeout=None):
+        """
+        Discard incoming bytes until the line has been quiet for quiet_time seconds.
+        Returns the number of bytes discarded.
+
+        Raises TimeoutError if the line is still busy after timeout seconds
+        (e.g. an ECU that keeps streaming).
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        discarded = 0
+        while True:
+            chunk = await self._read(quiet_time)
+            if not chunk:
+                self.ssm2.parser.reset()
+                return discarded
+            discarded += len(chunk)
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError("Line did not go quiet.")
+
+    async def receive_frame(self):
+        """
+        Return the data section of the next valid frame from the ECU.
+
+        Raises TimeoutError if no bytes arrive within the serial timeout.
+        """
+        parser = self.ssm2.parser
+        deadline = time.monotonic() + self.timeout
+        while True:
+            for data in parser.frames():
+                return data
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("No response received from ECU.")
+
+            chunk = await self._read(remaining)
+            if chunk:
+                parser.feed(chunk)
+
+    async def _read(self, timeout):
+        """Wait up to timeout seconds for the port to become readable and read it."""
+        ssm2 = self.ssm2
+        ser = ssm2.ser
+        if self._fd is None:
+            return await self._poll(timeout)
+
+        waiting = ser.in_waiting
+        if waiting:
+            return ssm2.read(waiting)
+
+        readable = self.loop.create_future()
+        try:
+            self.loop.add_reader(self._fd, self._set_readable, readable)
+        except NotImplementedError:
+            # Event loop cannot watch file descriptors, use the executor from now on
+            self._fd = None
+            return await self._read(timeout)
+
+        try:
+            await asyncio.wait_for(readable, timeout)
+        except asyncio.TimeoutError:
+            return b''
+        finally:
+            self.loop.remove_reader(self._fd)
+
+        return ssm2.read(ser.in_waiting or 1)
+
+    async def _poll(self, timeout):
+        """Read what the port has buffered once it has any, or b'' after timeout seconds."""
+        deadline = time.monotonic() + timeout
+        while True:
+            waiting = self.ssm2.ser.in_waiting
+            if waiting:
+                return self.ssm2.read(waiting)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return b''
+            await asyncio.sleep(min(POLL_INTERVAL, remaining))
+
+    @staticmethod
+    def _set_readable(future):
+        if not future.done():
+            future.set_result(None)
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Binary session log, an alternative to the CSV log.
+
+A session file is a self-describing header followed by fixed-size
+little-endian records, one per sample:
+
+    FILE_HEADER     magic, header length, offset of the first record
+    JSON header     channels (name, unit, format, dtype), ECU ID, start time,
+                    record size, sync interval
+    records         Time ('<f8') and one '<f4' or '<f8' value per channel
+
+Values of up to 16 raw bits (and 4-byte floats) are stored as float32, which
+holds any conversion of them exactly enough; wider values and derived
+parameters as float64. Missing values are NaN. A record is a few hundred bytes
+at most against a formatted CSV line, and nothing is formatted while logging.
+
+Every SYNC_INTERVAL records the writer inserts a sync record of the same size:
+SYNC_MAGIC in place of the timestamp (a NaN bit pattern no real timestamp has)
+and the number of samples written before it. The file is therefore still an
+array of equal records that numpy.memmap() reads as is (open_log()), and after a
+crash or power cut read_log() drops a torn last record and skips damaged
+stretches (zeroed or garbage timestamps) up to the next sync record.
+Compressed logs (log_segments) are read the same way, from memory.
+
+Usage:
+    writer = BinaryLogWriter(path, channels, samples, ecu_id='0xa2 0x10 ...')
+    writer.start()                          # see csv_writer.SampleWriter
+    header, records, skipped = read_log(path)
+    records['Engine Speed']                 # NumPy column
+
+Show a log's header, or convert it to CSV:
+    python3 binary_log.py 20251024-143022-SubaruLog.ssm2log [out.csv]
+"""
+
+import io
+import json
+import struct
+import time
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, only needed for reading logs
+    np = None
+
+from csv_writer import SampleWriter
+from log_segments import decompress, is_segmented
+
+FILE_MAGIC = b'SSM2LOG1'
+FILE_HEADER = struct.Struct('<8sII')     # magic, JSON header length, first record offset
+SYNC_MAGIC = b'SSM2SY\xf8\x7f'           # A quiet NaN as a little-endian double
+SYNC_RECORD = struct.Struct('<8sQ')      # magic, samples written before it
+SYNC_INTERVAL = 100                      # Samples between sync records
+
+# Struct codes of the record dtypes
+DTYPE_CODES = {'<f4': 'f', '<f8': 'd'}
+
+
+def channel_dtype(param):
+    """
+    Record dtype of a parameter: float32 for values from at most 16 raw bits
+    or a 4-byte float, float64 for wider values, derived and custom ones.
+    """
+    address = param.get('address')
+    if address is None:
+        return '<f8'
+    length = len(address) if isinstance(address, list) else 1
+    if param.get('storagetype') == 'float' or (length <= 2 and 'expr' in param):
+        return '<f4'
+    return '<f8'
+
+
+def describe_channels(parameters, derived_parameters):
+    """
+    Channel descriptions for the header, in build_csv_headers() order after
+    Time: parameters first (ECU and TCU), then the derived ones.
+    """
+    channels = [{'name': 'Time', 'unit': 's', 'format': None, 'dtype': '<f8'}]
+    for param in list(parameters) + list(derived_parameters):
+        channels.append({
+            'name': param['name'],
+            'unit': param.get('unit'),
+            'format': param.get('format'),
+            'dtype': channel_dtype(param),
+        })
+    return channels
+
+
+def record_struct(channels):
+    """struct.Struct of one record, padded to hold a sync record."""
+    codes = '<' + ''.join(DTYPE_CODES[channel['dtype']] for channel in channels)
+    size = struct.calcsize(codes)
+    if size < SYNC_RECORD.size:
+        codes += 'x' * (SYNC_RECORD.size - size)
+    return struct.Struct(codes)
+
+
+class BinaryLogWriter(SampleWriter):
+    """SampleWriter for binary session logs."""
+
+    def __init__(self, path, channels, samples, ecu_id=None, **options):
+        """
+        Args:
+            path: Log file to create
+            channels: describe_channels() of the ring's columns (Time first)
+            samples: SampleRing to read from
+            ecu_id: ECU ID for the header (ecu_info['ecu_id_hex'])
+            options: Commit policy, see csv_writer.SampleWriter
+        """
+        super().__init__(path, samples, **options)
+        self.channels = channels
+        self.ecu_id = ecu_id
+        self._record = record_struct(channels)
+        self._sync_padding = bytes(self._record.size - SYNC_RECORD.size)
+        self._written = 0
+
+    def _sync(self):
+        return SYNC_RECORD.pack(SYNC_MAGIC, self._written) + self._sync_padding
+
+    def _open(self):
+        self._written = 0
+        header = json.dumps({
+            'version': 1,
+            'start_time': time.time(),
+            'ecu_id': self.ecu_id,
+            'record_size': self._record.size,
+            'sync_interval': SYNC_INTERVAL,
+            'channels': self.channels,
+        }).encode()
+        # Records start on a 16-byte boundary
+        offset = -(-(FILE_HEADER.size + len(header)) // 16) * 16
+        header += b' ' * (offset - FILE_HEADER.size - len(header))
+
+        logfile = self._create()
+        logfile.write(FILE_HEADER.pack(FILE_MAGIC, len(header), offset))
+        logfile.write(header)
+        logfile.write(self._sync())
+        return logfile
+
+    def _write(self, rows):
+        pack = self._record.pack
+        chunks = []
+        for row in rows:
+            chunks.append(pack(*row))
+            self._written += 1
+            if self._written % SYNC_INTERVAL == 0:
+                chunks.append(self._sync())
+        self._file.write(b''.join(chunks))
+
+
+def read_header(path):
+    """The JSON header of a session log, plus its 'data_offset'."""
+    # The header is all in the first segment of a compressed log
+    with io.BytesIO(decompress(path, limit=1)) if is_segmented(path) else open(path, 'rb') as logfile:
+        magic, length, offset = FILE_HEADER.unpack(logfile.read(FILE_HEADER.size))
+        if magic != FILE_MAGIC:
+            raise ValueError(f"{path} is not a pySSM2 binary log")
+        header = json.loads(logfile.read(length))
+    header['data_offset'] = offset
+    return header
+
+
+def record_dtype(header):
+    """NumPy structured dtype of the records described by a header."""
+    if np is None:
+        raise ImportError("NumPy is required for reading binary logs")
+    channels = header['channels']
+    offsets = []
+    offset = 0
+    for channel in channels:
+        offsets.append(offset)
+        offset += np.dtype(channel['dtype']).itemsize
+    return np.dtype({
+        'names': [channel['name'] for channel in channels],
+        'formats': [channel['dtype'] for channel in channels],
+        'offsets': offsets,
+        'itemsize': header['record_size'],
+    })
+
+
+def open_log(path):
+    """
+    (header, records) with records a read-only numpy.memmap of every whole
+    record, sync records included (see is_sync()). Compressed logs are
+    decompressed into memory instead.
+    """
+    header = read_header(path)
+    dtype = record_dtype(header)
+    if is_segmented(path):
+        data = decompress(path)
+        count = max(0, (len(data) - header['data_offset']) // dtype.itemsize)
+        return header, np.frombuffer(data, dtype=dtype, count=count, offset=header['data_offset'])
+    with open(path, 'rb') as logfile:
+        logfile.seek(0, 2)
+        count = (logfile.tell() - header['data_offset']) // dtype.itemsize
+    if count <= 0:
+        return header, np.zeros(0, dtype=dtype)
+    return header, np.memmap(path, dtype=dtype, mode='r', offset=header['data_offset'], shape=(count,))
+
+
+def is_sync(records):
+    """Boolean mask of the sync records."""
+    return records['Time'].view('<u8') == np.frombuffer(SYNC_MAGIC, dtype='<u8')[0]
+
+
+def read_log(path):
+    """
+    (header, records, skipped): the samples of a session log as a structured
+    array, without sync records and damaged stretches. A record with a
+    timestamp that is not a positive number (a zeroed block after a power cut,
+    garbage) invalidates the records up to the next sync record; skipped counts
+    the records dropped that way.
+    """
+    header, records = open_log(path)
+    sync = is_sync(records)
+    times = records['Time']
+    with np.errstate(invalid='ignore'):
+        bad = ~sync & ~(np.isfinite(times) & (times > 0))
+
+    # Bad records counted since the last sync record, a sample is kept while it is 0
+    bad_count = np.cumsum(bad)
+    segment = np.cumsum(sync)
+    at_sync = np.concatenate(([0], bad_count[sync]))
+    keep = ~sync & (bad_count - at_sync[segment] == 0)
+    return header, records[keep], int((~sync).sum() - keep.sum())
+
+
+def export_csv(path, output):
+    """Write a session log as a CSV file like the CSV logger's."""
+    import csv
+    from frame_decoder import row_formatter
+
+    header, records, skipped = read_log(path)
+    format_row = row_formatter([channel['format'] for channel in header['channels']], nan=True)
+    with open(output, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow([channel['name'] for channel in header['channels']])
+        writer.writerows(format_row(row) for row in records.tolist())
+    return len(records), skipped
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python3 binary_log.py <log file> [CSV output]")
+        sys.exit(1)
+
+    if len(sys.argv) == 3:
+        count, skipped = export_csv(sys.argv[1], sys.argv[2])
+        print(f"{count} samples written to {sys.argv[2]}"
+              f"{f', {skipped} damaged records skipped' if skipped else ''}")
+        sys.exit(0)
+
+    header, records, skipped = read_log(sys.argv[1])
+    print(f"Started:  {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(header['start_time']))}")
+    print(f"ECU ID:   {header['ecu_id']}")
+    print(f"Samples:  {len(records)} of {header['record_size']} bytes"
+          f"{f', {skipped} damaged records skipped' if skipped else ''}")
+    if len(records):
+        print(f"Duration: {records['Time'][-1] - records['Time'][0]:.1f} s")
+    for channel in header['channels']:
+        print(f"  {channel['name']:<40} {channel['unit'] or '':<10} {channel['dtype']}")
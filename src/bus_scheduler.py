@@ -0,0 +1,188 @@
+"""
+Time-sliced multiplexing of several control units on one K-line.
+
+The engine ECU (0x10) and the TCU (0x18) share the bus, but only one of them
+can stream at a time. BusScheduler owns the serial connection and gives each
+unit a time slice: while a slice lasts, that unit's PollScheduler runs as usual
+(fast channels streaming continuously, slow channels read in the gaps). When
+the slice ends the stream is stopped, the line is left to go quiet, and the
+next unit is addressed and its stream started.
+
+Every sample is timestamped and every unit keeps its last-known values, so the
+logger sees one merged stream. The time from the end of one slice to the first
+sample of the next is the switching overhead; it is reported per unit so the
+slice lengths can be tuned (longer slices waste less time switching, shorter
+ones keep the other unit's values fresher).
+"""
+
+import time
+
+ECU_ADDRESS = 0x10
+TCU_ADDRESS = 0x18
+
+
+class BusNode:
+    """A control unit on the bus, with its own parameters and slice length."""
+
+    def __init__(self, name, destination, scheduler, slice_time=1.0, ecu_info=None):
+        """
+        Args:
+            name: Label for logs ('ECU', 'TCU')
+            destination: SSM2 address of the unit
+            scheduler: PollScheduler for the unit's parameters
+            slice_time: Seconds of bus time per turn
+            ecu_info: Init result if the unit is already initialized
+        """
+        self.name = name
+        self.destination = destination
+        self.scheduler = scheduler
+        self.slice_time = slice_time
+        self.ecu_info = ecu_info
+        self.enabled = True
+
+        # Statistics
+        self.samples = 0
+        self.slices = 0
+        self.switch_time = 0.0  # Total seconds from the end of the previous slice to our first sample
+
+    @property
+    def switch_overhead(self):
+        """Mean seconds lost per switch to this unit."""
+        return self.switch_time / self.slices if self.slices else 0.0
+
+    def stats(self, elapsed):
+        return {
+            'samples': self.samples,
+            'samples_per_second': self.samples / elapsed if elapsed else 0.0,
+            'planned_rate': self.scheduler.planned_rate,
+            'slices': self.slices,
+            'switch_overhead': self.switch_overhead,
+        }
+
+
+class BusScheduler:
+    """
+    Rotate bus time between control units and merge their samples.
+
+    Usage:
+        bus = BusScheduler([
+            BusNode('ECU', ECU_ADDRESS, PollScheduler(ECU_PARAMETERS), slice_time=2.0, ecu_info=ecu_info),
+            BusNode('TCU', TCU_ADDRESS, PollScheduler(TCU_PARAMETERS), slice_time=0.5),
+        ])
+        await bus.initialize(transport)
+        while True:
+            timestamp, node, values = await bus.next_sample(transport)
+
+    With a single enabled node it never switches and behaves like its PollScheduler.
+    """
+
+    def __init__(self, nodes, quiet_time=0.05):
+        """
+        Args:
+            nodes: BusNode list, the first one is addressed first
+            quiet_time: Seconds of silence on the line required before switching
+        """
+        self.nodes = list(nodes)
+        self.quiet_time = quiet_time
+        self._current = None
+        self._slice_start = 0.0
+        self._switch_start = None
+        self._started = time.monotonic()
+
+    @property
+    def current(self):
+        return self._current
+
+    def _enabled(self):
+        return [node for node in self.nodes if node.enabled]
+
+    async def initialize(self, transport):
+        """
+        Send an init request to every node that has no ecu_info yet.
+
+        A unit that does not answer (e.g. no TCU on a manual car) is disabled and
+        left out of the rotation. Returns the enabled nodes.
+        """
+        ssm2 = transport.ssm2
+        for node in self.nodes:
+            if node.ecu_info is not None:
+                continue
+            ssm2.set_destination(node.destination)
+            try:
+                response = await transport.run(ssm2.request_init)
+            except TimeoutError:
+                node.enabled = False
+                print(f"{node.name} (0x{node.destination:02X}) did not answer init, skipping it")
+                continue
+            node.ecu_info = ssm2.parse_ecu_init(response)
+            print(f"{node.name} initialized, ID is: {node.ecu_info['ecu_id_hex']}")
+
+        enabled = self._enabled()
+        if not enabled:
+            raise TimeoutError("No control unit answered init.")
+        self._select(transport, enabled[0])
+        self._switch_start = None
+        return enabled
+
+    def _select(self, transport, node):
+        transport.ssm2.set_destination(node.destination)
+        self._current = node
+        self._slice_start = time.monotonic()
+
+    async def _switch(self, transport):
+        """Stop the current unit's stream and hand the line to the next unit."""
+        enabled = self._enabled()
+        index = enabled.index(self._current) if self._current in enabled else -1
+        node = enabled[(index + 1) % len(enabled)]
+        if node is self._current:
+            self._slice_start = time.monotonic()
+            return
+
+        self._switch_start = time.monotonic()
+        await self._current.scheduler.stop(transport, self.quiet_time)
+        self._select(transport, node)
+
+    async def next_sample(self, transport):
+        """
+        Return (wall clock timestamp, node, values) for the next sample from any unit.
+
+        values is the node's PollScheduler buffer (last-known byte of every address
+        of that node); the other nodes' buffers keep their last values.
+        """
+        node = self._current
+        if time.monotonic() - self._slice_start >= node.slice_time:
+            await self._switch(transport)
+            node = self._current
+
+        values = await node.scheduler.next_sample(transport)
+        timestamp = time.time()
+
+        node.samples += 1
+        if self._switch_start is not None:
+            node.switch_time += time.monotonic() - self._switch_start
+            node.slices += 1
+            self._switch_start = None
+            # The slice starts with the first sample, not with the switch
+            self._slice_start = time.monotonic()
+        return timestamp, node, values
+
+    def ages(self, now=None):
+        """Seconds since each channel of every node was last read, by parameter name."""
+        now = time.monotonic() if now is None else now
+        ages = {}
+        for node in self.nodes:
+            ages.update(node.scheduler.ages(now))
+        return ages
+
+    def stats(self):
+        """Per-node sample rate and switching overhead, by node name."""
+        elapsed = time.monotonic() - self._started
+        return {node.name: node.stats(elapsed) for node in self.nodes if node.enabled}
+
+    def describe(self):
+        lines = []
+        for node in self.nodes:
+            state = f"{node.slice_time} s slices" if node.enabled else "disabled"
+            lines.append(f"{node.name} (0x{node.destination:02X}, {state}):")
+            lines.extend(f"  {line}" for line in node.scheduler.describe())
+        return lines
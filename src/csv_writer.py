@@ -0,0 +1,361 @@
+"""
+Group-commit CSV writer for the sample ring.
+
+Writing and flushing one row per sample on the event loop costs a write()
+syscall per sample and stalls the display whenever the SD card is slow.
+CSVWriter runs on its own thread instead: it reads the samples appended to the
+SampleRing since its last commit, formats them all at once and hands them to
+the file in one write and flush. A commit happens when commit_rows samples are
+waiting or commit_interval seconds have passed, whichever comes first, and
+optionally ends with an fsync (at most every fsync_interval seconds), so the
+card sees a few writes a second at most.
+
+The ring is the queue: the writer only keeps its position, so a slow card
+delays commits without holding up the logger, and only a writer a whole ring
+behind loses samples (counted in stats()). The logger keeps appending while a
+batch is read, so the batch is copied first and rows overwritten meanwhile are
+dropped rather than written out of order.
+
+SampleWriter holds the thread and commit policy, subclasses the file format:
+CSVWriter here, binary_log.BinaryLogWriter for the binary session format.
+Either can be compressed on the fly (log_segments), still on the writer thread.
+
+Long sessions are rotated into new files by size, duration or at local
+midnight, between two commits so every sample lands in exactly one file. A
+file is written as <name>.part, pre-allocated on disk, and only renamed to its
+final name (an atomic os.replace) once complete and trimmed to its length; the
+next file is already open with its header by then. .part files left by a
+crash are finished with finish_partial().
+
+Usage:
+    writer = CSVWriter(path, headers, formats, samples, commit_rows=100, commit_interval=1.0)
+    writer.start()
+    ...
+    writer.stats()   # queue depth, commit latency...
+    writer.stop()    # commits what is left and closes the file
+
+    writer = CSVWriter(path, headers, formats, samples, path_factory=config.get_log_file_path,
+                       rotate_bytes=32 << 20, rotate_seconds=3600, rotate_midnight=True)
+"""
+
+from abc import ABC, abstractmethod
+import csv
+import io
+import os
+import threading
+import time
+
+from frame_decoder import row_formatter
+from log_segments import SegmentedWriter
+
+# How often the writer thread checks the ring for a full batch (seconds)
+POLL_INTERVAL = 0.1
+
+# Suffix of a log file while it is being written
+PARTIAL_SUFFIX = '.part'
+
+
+def finish_partial(path):
+    """
+    Give a .part file left by a crash its final name, returning it. CSV files
+    are trimmed of the pre-allocated zeros after the last row; binary and
+    compressed logs keep them, their readers stop at zeroed records.
+    """
+    final = path[:-len(PARTIAL_SUFFIX)]
+    if final.endswith('.csv'):
+        with open(path, 'r+b') as logfile:
+            end = logfile.seek(0, 2)
+            while end > 0:
+                start = max(0, end - (1 << 16))
+                logfile.seek(start)
+                block = logfile.read(end - start).rstrip(b'\0')
+                if block:
+                    end = start + len(block)
+                    break
+                end = start
+            logfile.truncate(end)
+    os.replace(path, final)
+    return final
+
+
+class SampleWriter(ABC):
+    """
+    Write a SampleRing to a file in batches, on a background thread.
+    Subclasses create the file in _open() and write rows in _write().
+
+    Attributes:
+        path: Current log file path (written as path + PARTIAL_SUFFIX until closed)
+        files: Log files started, including the current one
+        position: Sequence number of the next sample to write
+        error: Exception that stopped the writer thread, None while it runs
+    """
+
+    def __init__(self, path, samples, commit_rows=100, commit_interval=1.0, fsync_interval=0,
+                 compression=None, segment_seconds=5.0, path_factory=None, rotate_bytes=0,
+                 rotate_seconds=0, rotate_midnight=False, preallocate=0):
+        """
+        Args:
+            path: Log file to create
+            samples: SampleRing to read from
+            commit_rows: Commit once this many samples are waiting
+            commit_interval: Commit at least this often (seconds) while samples are waiting
+            fsync_interval: fsync after a commit at most this often (seconds), 0 never
+            compression: None, or the log_segments codec to compress the file with
+            segment_seconds: Shortest compressed segment (seconds)
+            path_factory: Function returning the path of the next file when rotating
+                          (e.g. config.get_log_file_path), None never rotates
+            rotate_bytes: Start a new file once this many bytes are written, 0 never
+            rotate_seconds: Start a new file after this many seconds, 0 never
+            rotate_midnight: Start a new file when the local date changes
+            preallocate: Bytes to reserve on disk for each new file, 0 none
+        """
+        self.path = path
+        self.samples = samples
+        self.commit_rows = commit_rows
+        self.commit_interval = commit_interval
+        self.fsync_interval = fsync_interval
+        self.compression = compression
+        self.segment_seconds = segment_seconds
+        self.path_factory = path_factory
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.rotate_midnight = rotate_midnight
+        self.preallocate = preallocate
+        self.files = 0
+        self.position = samples.first
+        self.error = None
+
+        self._file = None
+        self._fd = None
+        self._segments = None
+        self._file_opened = 0.0
+        self._file_date = None
+        self._thread = None
+        self._stopping = threading.Event()
+        self._last_data = None
+        self._last_commit = time.monotonic()
+        self._last_fsync = time.monotonic()
+
+        # Statistics
+        self.commits = 0
+        self.rows = 0
+        self.dropped = 0
+        self.fsyncs = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+
+    @abstractmethod
+    def _open(self):
+        """Create the log file and write its header, returning the file object."""
+
+    def _create(self, text=False):
+        """Open the log file for writing, compressed in segments if configured."""
+        # The writer keeps the descriptor, to trim and rename the file once it is closed
+        self._fd = os.open(self.path + PARTIAL_SUFFIX, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+        if self.preallocate and hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(self._fd, 0, self.preallocate)
+            except OSError:
+                pass  # Not supported by the filesystem, the file grows as usual
+        self._file_opened = time.monotonic()
+        self._file_date = time.strftime('%Y%m%d')
+        self.files += 1
+
+        if self.compression is None:
+            if text:
+                self._file = open(self._fd, 'w', newline='', buffering=1 << 16, closefd=False)
+            else:
+                self._file = open(self._fd, 'wb', buffering=1 << 16, closefd=False)
+            return self._file
+        self._segments = SegmentedWriter(open(self._fd, 'wb', closefd=False), self.compression,
+                                         self.segment_seconds)
+        self._file = io.TextIOWrapper(self._segments, newline='') if text else self._segments
+        return self._file
+
+    def _close(self, logfile, fd, path):
+        """Close a log file, trim the pre-allocated space and give it its final name."""
+        logfile.close()
+        try:
+            os.ftruncate(fd, os.lseek(fd, 0, os.SEEK_CUR))
+        finally:
+            os.close(fd)
+        os.replace(path + PARTIAL_SUFFIX, path)
+
+    def _rotation_due(self):
+        if self.path_factory is None:
+            return False
+        if self.rotate_bytes and os.lseek(self._fd, 0, os.SEEK_CUR) >= self.rotate_bytes:
+            return True
+        if self.rotate_seconds and time.monotonic() - self._file_opened >= self.rotate_seconds:
+            return True
+        return self.rotate_midnight and time.strftime('%Y%m%d') != self._file_date
+
+    def rotate(self):
+        """
+        Continue in a new file from path_factory(), then close the current one.
+        The current file is finished even if the new one cannot be started;
+        the error then propagates and the writer is left without a file.
+        """
+        previous = (self._file, self._fd, self.path)
+        path = self.path_factory()
+        base, extension = os.path.splitext(path)
+        number = 1
+        while path == self.path or os.path.exists(path) or os.path.exists(path + PARTIAL_SUFFIX):
+            path = f"{base}-{number}{extension}"
+            number += 1
+        self.path = path
+        self._file = None
+        try:
+            self._open()
+            self._file.flush()
+        except BaseException:
+            self._discard(previous[1])
+            raise
+        finally:
+            self._close(*previous)
+
+    def _discard(self, previous_fd):
+        """Close and delete whatever _open() created of a file it failed to start."""
+        if self._file is not None:
+            try:
+                self._file.close()
+            except (OSError, ValueError):
+                pass
+        if self._fd is not None and self._fd != previous_fd:
+            os.close(self._fd)
+            try:
+                os.remove(self.path + PARTIAL_SUFFIX)
+            except OSError:
+                pass
+        self._file = None
+        self._fd = None
+
+    @abstractmethod
+    def _write(self, rows):
+        """Write (timestamp, value, ...) rows of doubles to the file."""
+
+    @property
+    def running(self):
+        """True while the writer thread is alive."""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Create the file, write its header and start the writer thread."""
+        self._file = self._open()
+        self._file.flush()
+        self._thread = threading.Thread(target=self._run, name="CSV Writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Commit the samples still waiting, then close the file."""
+        self._stopping.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        if self._file is not None:
+            self._close(self._file, self._fd, self.path)
+            self._file = None
+
+    def _run(self):
+        try:
+            while not self._stopping.wait(min(POLL_INTERVAL, self.commit_interval)):
+                waiting = self.samples.count - self.position
+                if waiting >= self.commit_rows or (
+                        waiting and time.monotonic() - self._last_commit >= self.commit_interval):
+                    self.commit()
+                    if self._rotation_due():
+                        self.rotate()
+            self.commit()
+        except Exception as e:
+            # Disk full, card removed, a value the format cannot hold...
+            # reported by whoever watches the writer
+            self.error = e
+
+    def commit(self):
+        """Format and write every sample appended since the last commit."""
+        started = time.monotonic()
+        samples = self.samples
+        if self.position < samples.first:
+            self.dropped += samples.first - self.position
+            self.position = samples.first
+        stop = samples.count
+        rows = list(samples.rows(self.position, stop))
+        start = stop - len(rows)
+
+        # Rows the logger has overwritten while they were copied, or is
+        # overwriting now (the slot of sample count - capacity), are lost
+        valid = samples.count - samples.capacity + 1
+        overwritten = max(0, min(valid, stop) - start)
+        self.dropped += start - self.position + overwritten
+        del rows[:overwritten]
+
+        # Only write rows that have changed
+        changed = []
+        last_data = self._last_data
+        for data in rows:
+            if data != last_data:
+                changed.append(data)
+                last_data = data
+        self._last_data = last_data
+        self.position = stop
+
+        if changed:
+            self._write(changed)
+            self._file.flush()
+            if self.fsync_interval and started - self._last_fsync >= self.fsync_interval:
+                os.fsync(self._file.fileno())
+                self._last_fsync = started
+                self.fsyncs += 1
+            self.rows += len(changed)
+        self.commits += 1
+        self._last_commit = time.monotonic()
+        self.last_latency = self._last_commit - started
+        self.max_latency = max(self.max_latency, self.last_latency)
+
+    def stats(self):
+        """
+        Writer statistics: samples waiting, rows written, commit latency (seconds),
+        files started and the current one, and with compression the segments,
+        compression ratio and CPU seconds of the current file.
+        """
+        stats = {
+            'path': self.path,
+            'files': self.files,
+            'queue_depth': self.samples.count - self.position,
+            'rows': self.rows,
+            'commits': self.commits,
+            'dropped': self.dropped,
+            'fsyncs': self.fsyncs,
+            'last_commit_latency': self.last_latency,
+            'max_commit_latency': self.max_latency,
+        }
+        if self._segments is not None:
+            stats.update(self._segments.stats())
+        return stats
+
+
+class CSVWriter(SampleWriter):
+    """SampleWriter for CSV files, formatting each batch of rows at once."""
+
+    def __init__(self, path, headers, formats, samples, **options):
+        """
+        Args:
+            path: CSV file to create
+            headers: Column names ('Time' and the ring's channels)
+            formats: Format string per column, None to write the value as is
+            samples: SampleRing to read from
+            options: Commit policy, see SampleWriter
+        """
+        super().__init__(path, samples, **options)
+        self.headers = headers
+        self._format_row = row_formatter(formats, nan=True)
+        self._writer = None
+
+    def _open(self):
+        logfile = self._create(text=True)
+        self._writer = csv.writer(logfile)
+        self._writer.writerow(self.headers)
+        return logfile
+
+    def _write(self, rows):
+        self._writer.writerows(map(self._format_row, rows))
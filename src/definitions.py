@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+"""
+RomRaider logger.xml definitions, compiled once and cached.
+
+logger.xml describes the SSM parameters:
+
+- <parameter>: standard parameters at the same address on every ECU, enabled
+  by a capability bit of the init response (ecubyteindex / ecubit), or
+  calculated from other parameters (<depends>)
+- <switch>: single bits of a switch byte
+- <ecuparam>: extended parameters whose address differs per ECU, with one
+  <ecu id="..."> entry per supported ECU (over 15,000 in total)
+
+Parsing the 2 MB file takes seconds on a Raspberry Pi, so it is read once
+with a streaming iterparse and compiled into a small binary cache keyed by
+the SHA-256 of the XML. Later boots hash the XML, open the cache through mmap
+and binary-search the ECU table, so only the connected ECU's entries are
+ever decoded.
+
+Cache file layout (little-endian):
+    header:   8s magic 'SSM2DEF1', 32s XML SHA-256, I metadata length,
+              I ECU count, I entry count
+    metadata: zlib-compressed JSON with the parameters, switches and
+              ecuparams (without their per-ECU addresses)
+    ECUs:     5s ECU ID, I first entry, I entry count; sorted by ECU ID
+    entries:  H ecuparam index, I address, B length
+
+Usage:
+    definitions = load_definitions('/etc/pySSM2/logger.xml', '/var/lib/pySSM2/definitions.bin')
+    for param in definitions.for_ecu(ecu_info['ecu_id']):
+        ...  # ecuparam dict with 'address' and 'length' for this ECU
+    supported = definitions.supported(ecu_info['ecu_id'], ecu_info['raw_capability_bytes'])
+    chosen = select_parameters(supported, target_rate=10, addresses=build_address_list())
+
+Inspect a definitions file (and the entries of one ECU, and the parameters
+auto-selected for its capability bytes):
+    python3 definitions.py logger.xml [1B14400505 [73FAEB80...]]
+"""
+
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import struct
+import zlib
+import xml.etree.ElementTree as ET
+
+from ecu_capabilities import SWITCH_BITS, capability_mask, ecubyte_bit
+from expressions import compile_expression, decoder
+from request_planner import RESPONSE_DELAY, candidate_plans
+
+CACHE_MAGIC = b'SSM2DEF1'
+CACHE_HEADER = struct.Struct('<8s32sIII')
+CACHE_ECU = struct.Struct('<5sII')
+CACHE_ENTRY = struct.Struct('<HIB')
+
+
+def file_hash(path):
+    """SHA-256 of a file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            digest.update(block)
+    return digest.digest()
+
+
+def _conversions(elem):
+    conversions = []
+    for conversion in elem.iterfind('conversions/conversion'):
+        attributes = dict(conversion.attrib)
+        conversions.append({
+            'units': attributes.pop('units', ''),
+            'expr': attributes.pop('expr', 'x'),
+            'format': attributes.pop('format', None),
+            'storagetype': attributes.pop('storagetype', None),
+            **attributes,   # gauge_min, gauge_max, gauge_step
+        })
+    return conversions
+
+
+def _address(elem):
+    """(address, length) of an <address> element, or (None, 0) if absent."""
+    if elem is None:
+        return None, 0
+    return int(elem.text, 16), int(elem.get('length', '1'))
+
+
+def parse_definitions(xml_path):
+    """
+    Stream-parse logger.xml.
+
+    Returns (metadata, ecus) where metadata is a dict with 'parameters',
+    'switches' and 'ecuparams' lists, and ecus maps each 5-byte ECU ID to a list
+    of (ecuparam index, address, length).
+    """
+    parameters = []
+    switches = []
+    ecuparams = []
+    ecus = {}
+
+    for event, elem in ET.iterparse(xml_path, events=('end',)):
+        tag = elem.tag
+        if tag == 'parameter':
+            address, length = _address(elem.find('address'))
+            parameters.append({
+                'id': elem.get('id'),
+                'name': elem.get('name'),
+                'desc': elem.get('desc', ''),
+                'address': address,
+                'length': length,
+                'ecubyteindex': int(elem.get('ecubyteindex')) if elem.get('ecubyteindex') else None,
+                'ecubit': int(elem.get('ecubit')) if elem.get('ecubit') else None,
+                'depends': [ref.get('parameter') for ref in elem.iterfind('depends/ref')],
+                'conversions': _conversions(elem),
+            })
+            elem.clear()
+        elif tag == 'switch':
+            switches.append({
+                'id': elem.get('id'),
+                'name': elem.get('name'),
+                'desc': elem.get('desc', ''),
+                'byte': int(elem.get('byte'), 16),
+                'bit': int(elem.get('bit')),
+            })
+            elem.clear()
+        elif tag == 'ecuparam':
+            index = len(ecuparams)
+            ecuparams.append({
+                'id': elem.get('id'),
+                'name': elem.get('name'),
+                'desc': elem.get('desc', ''),
+                'conversions': _conversions(elem),
+            })
+            for ecu in elem.iterfind('ecu'):
+                address, length = _address(ecu.find('address'))
+                if address is None:
+                    continue
+                for ecu_id in ecu.get('id').split(','):
+                    ecus.setdefault(bytes.fromhex(ecu_id.strip()), []).append((index, address, length))
+            elem.clear()
+
+    return {'parameters': parameters, 'switches': switches, 'ecuparams': ecuparams}, ecus
+
+
+def compile_definitions(xml_path, cache_path, digest=None):
+    """Parse logger.xml and write the binary cache (atomically)."""
+    metadata, ecus = parse_definitions(xml_path)
+    blob = zlib.compress(json.dumps(metadata, separators=(',', ':')).encode())
+
+    table = bytearray()
+    entries = bytearray()
+    entry_count = 0
+    for ecu_id in sorted(ecus):
+        rows = ecus[ecu_id]
+        table += CACHE_ECU.pack(ecu_id, entry_count, len(rows))
+        for row in rows:
+            entries += CACHE_ENTRY.pack(*row)
+        entry_count += len(rows)
+
+    header = CACHE_HEADER.pack(CACHE_MAGIC, digest or file_hash(xml_path), len(blob), len(ecus), entry_count)
+    directory = os.path.dirname(cache_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = cache_path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(header)
+        f.write(blob)
+        f.write(table)
+        f.write(entries)
+    os.replace(temp_path, cache_path)
+
+
+def python_format(pattern):
+    """RomRaider number format ('0.00', '0') as a Python format spec ('.2f', '.0f')."""
+    if not pattern:
+        return None
+    decimals = len(pattern.split('.', 1)[1]) if '.' in pattern else 0
+    return f".{decimals}f"
+
+
+def to_parameter(definition, units=None):
+    """
+    ECU_PARAMETERS-style dict for a definition with an address (a standard
+    parameter, or an ecuparam from Definitions.for_ecu()).
+
+    Args:
+        units: Conversion to use (e.g. 'psi'), default the first one
+    """
+    conversions = definition['conversions']
+    conversion = next((c for c in conversions if c['units'] == units), conversions[0])
+    address, length = definition['address'], definition['length']
+    return {
+        'id': definition['id'],
+        'address': address if length == 1 else list(range(address, address + length)),
+        'name': definition['name'],
+        'expr': conversion['expr'],
+        'storagetype': conversion['storagetype'],
+        'calculation': decoder(conversion['expr'], length, conversion['storagetype']),
+        'format': python_format(conversion['format']),
+        'unit': conversion['units'],
+    }
+
+
+def to_derived(definition, parameters):
+    """
+    DERIVED_PARAMETERS-style dict for a calculated parameter (one with <depends>),
+    or None if the parameters it refers to are not being read.
+
+    Args:
+        parameters: ECU_PARAMETERS-style dicts; references are resolved by 'id',
+                    and '[P7:psi]' style references need the parameter in that unit
+    The first conversion whose references can all be resolved is used.
+    """
+    by_id = {param['id']: param for param in parameters if 'id' in param}
+    for conversion in definition['conversions']:
+        expression = compile_expression(conversion['expr'])
+        inputs = []
+        for name in expression.names:
+            parameter_id, units = expression.references[name]
+            param = by_id.get(parameter_id)
+            if param is None or (units is not None and units.lower() != (param['unit'] or '').lower()):
+                break
+            inputs.append(param['name'])
+        else:
+            function = expression.function
+            return {
+                'id': definition['id'],
+                'name': definition['name'],
+                'depends': inputs,
+                'calculation': lambda data: function(*[data[name] for name in inputs]),
+                'format': python_format(conversion['format']),
+                'unit': conversion['units'],
+            }
+    return None
+
+
+class Definitions:
+    """
+    Compiled logger.xml, backed by the mmap'd cache file.
+
+    parameters, switches and ecuparams are lists of dicts (see parse_definitions);
+    ecuparams carry no addresses, for_ecu() adds them for one ECU.
+    """
+
+    def __init__(self, cache_path):
+        self.path = cache_path
+        with open(cache_path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.digest, blob_length, self.ecu_count, self.entry_count = \
+            CACHE_HEADER.unpack_from(self._map, 0)
+        if magic != CACHE_MAGIC:
+            raise ValueError(f"{cache_path} is not a definitions cache")
+
+        offset = CACHE_HEADER.size
+        metadata = json.loads(zlib.decompress(self._map[offset:offset + blob_length]))
+        self.parameters = metadata['parameters']
+        self.switches = metadata['switches']
+        self.ecuparams = metadata['ecuparams']
+        # (capability mask bit, parameter) for the standard parameters that can be read
+        self._capability_bits = [
+            (ecubyte_bit(param['ecubyteindex'], param['ecubit']), param)
+            for param in self.parameters
+            if param['address'] is not None and param['ecubyteindex'] is not None
+        ]
+
+        self._ecu_offset = offset + blob_length
+        self._entry_offset = self._ecu_offset + self.ecu_count * CACHE_ECU.size
+        # ECU IDs only (5 bytes each) for the binary search, rows are read on demand
+        self._ecu_ids = [
+            self._map[position:position + 5]
+            for position in range(self._ecu_offset, self._entry_offset, CACHE_ECU.size)
+        ]
+
+    def close(self):
+        self._map.close()
+
+    def ecu_ids(self):
+        return list(self._ecu_ids)
+
+    def _rows(self, ecu_id):
+        ecu_id = bytes(ecu_id)
+        index = bisect.bisect_left(self._ecu_ids, ecu_id)
+        if index == len(self._ecu_ids) or self._ecu_ids[index] != ecu_id:
+            return
+        _, first, count = CACHE_ECU.unpack_from(self._map, self._ecu_offset + index * CACHE_ECU.size)
+        for position in range(first, first + count):
+            yield CACHE_ENTRY.unpack_from(self._map, self._entry_offset + position * CACHE_ENTRY.size)
+
+    def for_ecu(self, ecu_id):
+        """
+        Extended parameters available on this ECU (5-byte ID), as ecuparam dicts
+        with 'address' and 'length' filled in. Empty if the ECU is unknown.
+        """
+        return [
+            dict(self.ecuparams[index], address=address, length=length)
+            for index, address, length in self._rows(ecu_id)
+        ]
+
+    def supported(self, ecu_id, capability_bytes):
+        """
+        Every parameter this ECU can be asked for: the standard parameters whose
+        capability bit is set in its init response, then its extended parameters.
+        """
+        mask = capability_mask(capability_bytes)
+        standard = [param for bit, param in self._capability_bits if mask >> bit & 1]
+        return standard + self.for_ecu(ecu_id)
+
+    def supported_switches(self, capability_bytes):
+        """Switches whose capability bit is set in the init response (unknown ones are left out)."""
+        mask = capability_mask(capability_bytes)
+        return [switch for switch in self.switches
+                if switch['name'] in SWITCH_BITS and mask >> SWITCH_BITS[switch['name']] & 1]
+
+    def parameter(self, parameter_id):
+        """Standard or extended parameter by id ('P8', 'E1'), or None."""
+        for param in self.parameters:
+            if param['id'] == parameter_id:
+                return param
+        for param in self.ecuparams:
+            if param['id'] == parameter_id:
+                return param
+        return None
+
+
+def _addresses(definition):
+    return list(range(definition['address'], definition['address'] + definition['length']))
+
+
+def select_parameters(candidates, target_rate, addresses=(), baudrate=4800, response_delay=RESPONSE_DELAY):
+    """
+    Pick the largest set of candidates that still streams at target_rate.
+
+    Candidates are tried smallest first (one byte parameters before 2 and 4 byte
+    ones, in definition order otherwise) and each one is kept if the fastest
+    plan for every address so far still reaches target_rate samples/s.
+    Candidates reading an address that is already covered are skipped.
+
+    Args:
+        candidates: Definitions with an 'address' and 'length' (e.g. Definitions.supported())
+        target_rate: Minimum samples/s of the fast stream
+        addresses: Addresses already being read every sample (the configured parameters)
+    Returns the chosen definitions, in candidate order.
+    """
+    selected = list(addresses)
+    covered = set(selected)
+    if selected and candidate_plans(selected, baudrate, response_delay)[0].samples_per_second < target_rate:
+        return []
+
+    chosen = []
+    for definition in sorted(candidates, key=lambda definition: definition['length']):
+        extra = _addresses(definition)
+        if covered.intersection(extra):
+            continue
+        plan = candidate_plans(selected + extra, baudrate, response_delay)[0]
+        if plan.samples_per_second < target_rate:
+            continue
+        chosen.append(definition)
+        selected += extra
+        covered.update(extra)
+
+    order = {id(definition): index for index, definition in enumerate(candidates)}
+    return sorted(chosen, key=lambda definition: order[id(definition)])
+
+
+def load_definitions(xml_path, cache_path):
+    """
+    Open the definitions cache, recompiling it first if logger.xml changed
+    (or the cache is missing or unreadable).
+    """
+    digest = file_hash(xml_path)
+    try:
+        definitions = Definitions(cache_path)
+        if definitions.digest == digest:
+            return definitions
+        definitions.close()
+    except (OSError, ValueError, struct.error, zlib.error):
+        pass
+    compile_definitions(xml_path, cache_path, digest)
+    return Definitions(cache_path)
+
+
+if __name__ == "__main__":
+    import sys
+    import tempfile
+    import time
+
+    if len(sys.argv) not in (2, 3, 4):
+        print("Usage: python3 definitions.py <logger.xml> [ECU ID [capability bytes]]")
+        sys.exit(1)
+
+    cache_path = os.path.join(tempfile.gettempdir(), 'pySSM2-definitions.bin')
+    start = time.perf_counter()
+    compile_definitions(sys.argv[1], cache_path)
+    compiled = time.perf_counter()
+    definitions = load_definitions(sys.argv[1], cache_path)
+    loaded = time.perf_counter()
+
+    print(f"Parameters: {len(definitions.parameters)}")
+    print(f"Switches:   {len(definitions.switches)}")
+    print(f"Ecuparams:  {len(definitions.ecuparams)}")
+    print(f"ECUs:       {definitions.ecu_count} ({definitions.entry_count} address entries)")
+    print(f"Cache:      {os.path.getsize(cache_path)} bytes, compiled in {(compiled - start) * 1000:.0f} ms, "
+          f"loaded in {(loaded - compiled) * 1000:.1f} ms")
+
+    if len(sys.argv) >= 3:
+        ecu_id = bytes.fromhex(sys.argv[2])
+        start = time.perf_counter()
+        params = definitions.for_ecu(ecu_id)
+        elapsed = time.perf_counter() - start
+        print(f"\nECU {ecu_id.hex().upper()}: {len(params)} extended parameters ({elapsed * 1000:.2f} ms)")
+        for param in params:
+            print(f"  {param['id']:>5}  0x{param['address']:06X} ({param['length']})  {param['name']}")
+
+    if len(sys.argv) == 4:
+        supported = definitions.supported(ecu_id, bytes.fromhex(sys.argv[3]))
+        print(f"\nSupported: {len(supported)} parameters")
+        for target_rate in (5, 10, 20):
+            start = time.perf_counter()
+            chosen = select_parameters(supported, target_rate)
+            elapsed = time.perf_counter() - start
+            plan = candidate_plans([address for param in chosen for address in _addresses(param)])[0]
+            print(f"  {target_rate:>2} Hz: {len(chosen)} parameters, {plan.name} at "
+                  f"{plan.samples_per_second:.1f} samples/s ({elapsed * 1000:.0f} ms)")
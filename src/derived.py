@@ -0,0 +1,235 @@
+"""
+Dependency-graph evaluation of derived parameters.
+
+Derived parameters (boost from MAP and atmospheric pressure, fuel consumption
+from MAF, AFR and speed...) declare the parameters they read in 'depends', as
+logger.xml does with <depends><ref parameter="..."/>. The evaluator sorts them
+topologically once, so a derived parameter may use other derived ones, and on
+every frame only recomputes those with an input that changed since the previous
+frame. Slow channels and steady values therefore cost nothing most of the time.
+
+A calculation that fails (division by zero, a missing input) only marks its own
+channel invalid (value None) and, through the graph, the channels depending on
+it; the rest of the frame is kept. Parameters without 'depends' are recomputed
+every frame with the full values dict, as before.
+
+For offline processing, evaluate_batch() computes derived parameters over
+whole NumPy columns (FrameDecoder.decode_batch()) with the same definitions.
+Calculations written with where() instead of a conditional run as one vector
+op per column there, and unchanged on the live evaluator's scalars.
+
+Usage:
+    evaluator = DerivedEvaluator(DERIVED_PARAMETERS)
+    while True:
+        values = evaluator.evaluate(raw_data)   # raw_data plus derived values
+        boost = values['Boost Pressure']        # None while invalid
+"""
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, only needed for evaluate_batch()
+    np = None
+
+_MISSING = object()
+
+
+def where(condition, if_true, if_false):
+    """
+    Conditional for calculations: np.where() on NumPy columns, a plain
+    conditional on scalars. Both branches are evaluated, so guard a division
+    by choosing a safe divisor (x / where(y == 0, 1, y)) rather than the result.
+    """
+    if np is not None and isinstance(condition, np.ndarray):
+        return np.where(condition, if_true, if_false)
+    return if_true if condition else if_false
+
+
+class DerivedNode:
+    """A derived parameter in the graph."""
+
+    def __init__(self, param):
+        self.name = param['name']
+        self.calculation = param['calculation']
+        depends = param.get('depends')
+        self.depends = frozenset(depends) if depends is not None else None
+        self.dependents = ()  # Indexes of the nodes reading this one, set by DerivedEvaluator
+
+
+def sort_nodes(nodes):
+    """
+    Order nodes so that every node comes after the derived nodes it depends on
+    (list order is kept otherwise). Raises ValueError on a dependency cycle.
+    """
+    by_name = {node.name: node for node in nodes}
+    ordered = []
+    state = {}  # name -> 'visiting' / 'done'
+
+    def visit(node, path):
+        if state.get(node.name) == 'done':
+            return
+        if state.get(node.name) == 'visiting':
+            raise ValueError(f"Derived parameter cycle: {' -> '.join(path + [node.name])}")
+        state[node.name] = 'visiting'
+        for name in sorted(node.depends or ()):
+            if name in by_name:
+                visit(by_name[name], path + [node.name])
+        state[node.name] = 'done'
+        ordered.append(node)
+
+    for node in nodes:
+        visit(node, [])
+    return ordered
+
+
+class DerivedEvaluator:
+    """
+    Incrementally evaluate derived parameters from each frame's values.
+
+    Attributes:
+        values: Last values of every input and derived parameter, by name
+        invalid: Exception of every derived parameter that is currently invalid, by name
+        computed: Total calculations run (for comparing against full evaluation)
+    """
+
+    def __init__(self, parameters):
+        """
+        Args:
+            parameters: DERIVED_PARAMETERS-style list of dicts with 'name',
+                        'calculation' (taking the values dict) and optional 'depends'
+        """
+        self.nodes = sort_nodes([DerivedNode(param) for param in parameters])
+        self.values = {}
+        self.invalid = {}
+        self.computed = 0
+
+        # Reverse edges: name -> indexes (in topological order) of the nodes reading it
+        self._dependents = {}
+        for index, node in enumerate(self.nodes):
+            for name in node.depends or ():
+                self._dependents.setdefault(name, []).append(index)
+        for node in self.nodes:
+            node.dependents = tuple(self._dependents.get(node.name, ()))
+        # (name, calculation, dependents) per node, for the evaluation loop
+        self._plan = [(node.name, node.calculation, node.dependents) for node in self.nodes]
+        # Nodes without 'depends' run every frame
+        self._always = [index for index, node in enumerate(self.nodes) if node.depends is None]
+        self._dirty = bytearray(len(self.nodes))
+        self._primed = False
+
+    def _failed(self, node, error):
+        """Record why a node is invalid: its own error, or an invalid input."""
+        missing = sorted(name for name in node.depends or () if self.values.get(name) is None)
+        self.invalid[node.name] = ValueError(f"no valid value for {', '.join(missing)}") if missing else error
+
+    def evaluate(self, data):
+        """
+        Merge one frame's parameter values and recompute the derived parameters
+        affected by a change. Returns the values dict (inputs and derived values).
+        """
+        values = self.values
+        dependents = self._dependents
+        invalid = self.invalid
+
+        dirty = self._dirty
+        first = len(dirty)
+        if not self._primed:
+            dirty[:] = b'\x01' * len(dirty)
+            first = 0
+            self._primed = True
+        for index in self._always:
+            dirty[index] = 1
+            if index < first:
+                first = index
+        for name, value in data.items():
+            if values.get(name, _MISSING) != value:
+                values[name] = value
+                if name in dependents:
+                    indexes = dependents[name]
+                    for index in indexes:
+                        dirty[index] = 1
+                    if indexes[0] < first:
+                        first = indexes[0]
+
+        # Topological order: a node's inputs are always settled before it runs,
+        # and the nodes it feeds come later in the same pass
+        plan = self._plan
+        computed = 0
+        for index in range(first, len(dirty)):
+            if not dirty[index]:
+                continue
+            dirty[index] = 0
+            name, calculation, node_dependents = plan[index]
+            computed += 1
+            try:
+                value = calculation(values)
+                if invalid:
+                    invalid.pop(name, None)
+            except Exception as e:
+                # None inputs (invalid upstream) end up here too, as TypeErrors
+                value = None
+                self._failed(self.nodes[index], e)
+            if values.get(name, _MISSING) != value:
+                values[name] = value
+                for dependent in node_dependents:
+                    dirty[dependent] = 1
+        self.computed += computed
+        return values
+
+
+def _rows(node, columns, length):
+    """Evaluate a node with Python values as evaluate() would, once per distinct input row."""
+    names = sorted(node.depends) if node.depends is not None else list(columns)
+    if not names or not length:
+        return np.full(length, np.nan)
+    # Number the distinct input combinations, one column at a time
+    inputs = [np.asarray(columns[name]) for name in names]
+    key = np.zeros(length, dtype=np.int64)
+    for column in inputs:
+        _, codes = np.unique(column, return_inverse=True)
+        _, key = np.unique(key * (codes.max() + 1) + codes.reshape(-1), return_inverse=True)
+    _, first, inverse = np.unique(key, return_index=True, return_inverse=True)
+
+    results = []
+    for values in zip(*[column[first].tolist() for column in inputs]):
+        row = {name: None if value is None or value != value else value for name, value in zip(names, values)}
+        if node.depends is not None and None in row.values():
+            results.append(np.nan)
+            continue
+        try:
+            value = node.calculation(row)
+        except Exception:
+            value = None
+        results.append(np.nan if value is None else value)
+    return np.array(results, dtype=np.float64)[inverse.reshape(-1)]
+
+
+def evaluate_batch(parameters, columns):
+    """
+    Evaluate derived parameters over whole columns.
+
+    Each calculation is first applied to the NumPy columns directly, which works
+    for plain arithmetic and where() (a vector op per parameter); calculations
+    that need scalars (conditionals, float()) are evaluated row by row instead,
+    once per distinct combination of inputs. Invalid values are NaN where the live
+    evaluator gives None.
+
+    Args:
+        parameters: DERIVED_PARAMETERS-style list of dicts
+        columns: Equal-length NumPy columns of the input parameters, by name
+    Returns the columns plus one float64 column per derived parameter.
+    """
+    if np is None:
+        raise ImportError("NumPy is required for batch evaluation")
+    columns = dict(columns)
+    length = len(next(iter(columns.values()))) if columns else 0
+
+    for node in sort_nodes([DerivedNode(param) for param in parameters]):
+        try:
+            with np.errstate(all='ignore'):
+                result = node.calculation(columns)
+            result = np.array(np.broadcast_to(np.asarray(result, dtype=np.float64), (length,)))
+        except Exception:
+            result = _rows(node, columns, length)
+        result[~np.isfinite(result)] = np.nan
+        columns[node.name] = result
+    return columns
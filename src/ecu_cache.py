@@ -0,0 +1,106 @@
+"""
+Persistent ECU init cache.
+
+Stores the ECU init response, the decoded capabilities and the resolved request
+plans on disk, keyed by ECU ID. On a warm restart (service crash, power blip)
+the logger only checks that the same ECU is still connected with
+PySSM2.verify_ecu_id(), a single init request (it still waits for the whole
+init reply) without ecu_init()'s retry loop and capability decoding, and
+starts streaming straight away. A full ecu_init() only happens on the first run
+or when a different ECU answers.
+
+File layout (JSON):
+    {
+        "last": "1b14400505",
+        "ecus": {
+            "1b14400505": {
+                "ecu_info": {...},          # PySSM2.parse_ecu_init() result
+                "plans": {"<plan key>": {...}}   # RequestPlan.to_dict()
+            }
+        }
+    }
+"""
+
+import json
+import os
+
+
+class ECUInitCache:
+    """
+    Usage:
+        cache = ECUInitCache(config.ECU_CACHE_FILE)
+        ecu_info = cache.last()
+        if ecu_info is None or not ssm2.verify_ecu_id(ecu_info['ecu_id']):
+            ecu_info = ssm2.ecu_init()
+            cache.save(ecu_info)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._data = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            if isinstance(data, dict) and isinstance(data.get('ecus'), dict):
+                return data
+        except (OSError, ValueError):
+            pass
+        return {'last': None, 'ecus': {}}
+
+    def _write(self):
+        """Write atomically so a power cut never leaves a half-written cache."""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self._data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+    @staticmethod
+    def key(ecu_id):
+        return bytes(ecu_id).hex()
+
+    def last(self):
+        """ECU info of the most recently connected ECU, or None."""
+        entry = self._data['ecus'].get(self._data.get('last'))
+        return entry['ecu_info'] if entry else None
+
+    def get(self, ecu_id):
+        entry = self._data['ecus'].get(self.key(ecu_id))
+        return entry['ecu_info'] if entry else None
+
+    def save(self, ecu_info):
+        """Store an ECU init result and mark it as the last connected ECU."""
+        key = self.key(ecu_info['ecu_id'])
+        entry = self._data['ecus'].setdefault(key, {'plans': {}})
+        entry['ecu_info'] = {
+            'ecu_id': list(ecu_info['ecu_id']),
+            'ecu_id_hex': ecu_info['ecu_id_hex'],
+            'capabilities': ecu_info['capabilities'],
+            'raw_capability_bytes': list(ecu_info['raw_capability_bytes']),
+        }
+        self._data['last'] = key
+        try:
+            self._write()
+        except OSError as e:
+            print(f"Could not write ECU init cache {self.path}: {e}")
+
+    def plan(self, ecu_id, plan_key):
+        """Cached RequestPlan.to_dict() for this ECU and parameter set, or None."""
+        entry = self._data['ecus'].get(self.key(ecu_id))
+        return entry['plans'].get(plan_key) if entry else None
+
+    def save_plan(self, ecu_id, plan_key, plan):
+        entry = self._data['ecus'].get(self.key(ecu_id))
+        if entry is None or entry['plans'].get(plan_key) == plan:
+            return
+        entry['plans'][plan_key] = plan
+        try:
+            self._write()
+        except OSError as e:
+            print(f"Could not write ECU init cache {self.path}: {e}")
@@ -6,8 +6,16 @@ Based on ssm_info.txt documentation.
 
 Each capability byte contains 8 bits representing different ECU features.
 Bit 7 is MSB, Bit 0 is LSB.
+
+The bytes are decoded into a single int bitmask (capability_mask), bit
+byte_index * 8 + bit_position, so checking a capability is one shift and AND.
+RomRaider's logger.xml names the same bits with ecubyteindex/ecubit, counted
+from the start of the init response data (ecubyteindex 8 is capability byte 0).
 """
 
+# logger.xml ecubyteindex of the first capability byte
+CAPABILITY_BYTE_OFFSET = 8
+
 # Capability byte definitions
 # Format: (byte_index, bit_position, category, name)
 CAPABILITY_MAP = [
@@ -221,6 +229,30 @@ CAPABILITY_MAP = [
 ]
 
 
+def capability_mask(capability_bytes):
+    """Capability bytes as one int, bit byte_index * 8 + bit_position per capability."""
+    return int.from_bytes(bytes(capability_bytes), 'little')
+
+
+def capability_bit(byte_index, bit_position):
+    """Position of a capability in capability_mask()."""
+    return byte_index * 8 + bit_position
+
+
+# capability_mask() bit of every switch, by name (the names match logger.xml <switch>).
+# Every entry is included: logger.xml switches also cover relays and signals
+# that CAPABILITY_MAP files under 'outputs'.
+SWITCH_BITS = {
+    name: capability_bit(byte_index, bit_position)
+    for byte_index, bit_position, category, name in CAPABILITY_MAP
+}
+
+
+def ecubyte_bit(ecubyteindex, ecubit):
+    """Position in capability_mask() of a logger.xml ecubyteindex/ecubit pair."""
+    return capability_bit(ecubyteindex - CAPABILITY_BYTE_OFFSET, ecubit)
+
+
 def parse_ecu_capabilities(capability_bytes):
     """
     Parse ECU capability bytes into a structured dictionary.
@@ -237,14 +269,11 @@ def parse_ecu_capabilities(capability_bytes):
         'outputs': {}
     }
 
-    def bit_set(byte_val, bit_position):
-        """Check if a specific bit is set in a byte value."""
-        return bool(byte_val & (1 << bit_position))
+    mask = capability_mask(capability_bytes)
 
     # Parse each capability from the map
     for byte_index, bit_position, category, name in CAPABILITY_MAP:
         if byte_index < len(capability_bytes):
-            byte_val = capability_bytes[byte_index]
-            capabilities[category][name] = bit_set(byte_val, bit_position)
+            capabilities[category][name] = bool(mask >> capability_bit(byte_index, bit_position) & 1)
 
     return capabilities
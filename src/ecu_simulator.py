@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+"""
+Pseudo-terminal SSM2 ECU simulator.
+
+Opens a pty and answers like a Subaru ECU behind a K-line adapter (see
+docs/ssm_info.md):
+
+- 0xBF init: configurable ECU ID and capability bytes
+- 0xA8 address reads and 0xA0 block reads, once or continuous, from a synthetic
+  RAM image whose logger addresses (RPM, MAF, MAP, coolant...) animate over time
+- 0xB8 / 0xB0 writes into the RAM image
+- Every request is echoed back first, like a half-duplex K-line adapter
+- Optionally a TCU at 0x18 on the same line (--tcu), for bus multiplexing
+
+Bytes are paced at the configured baud rate (10 bits per byte) plus an optional
+inter-byte delay, so PySSM2, scan_for_adapter and the whole logger see realistic
+timing and can be benchmarked on a dev box:
+
+    python3 src/ecu_simulator.py --link /tmp/ttySSM2
+    SSM2_SERIAL_PORT=/tmp/ttySSM2 python3 run_logger.py
+
+    python3 src/ecu_simulator.py --bench 10     # samples/s and latency via PySSM2
+"""
+
+import math
+import os
+import select
+import struct
+import threading
+import time
+import tty
+
+from frame_parser import FrameParser
+
+ECU_ADDRESS = 0x10
+TCU_ADDRESS = 0x18
+TOOL_ADDRESS = 0xF0
+
+# ECU ID and capability bytes from the init example in docs/ssm_info.md
+DEFAULT_ECU_ID = bytes([0x1B, 0x14, 0x40, 0x05, 0x05])
+DEFAULT_CAPABILITIES = bytes([
+    0x73, 0xFA, 0xEB, 0x80, 0x2B, 0xC1, 0x02, 0xAA, 0x00, 0x10, 0x00, 0x60,
+    0xCE, 0x54, 0xF8, 0xB0, 0x60, 0x00, 0x00, 0xE0, 0x00, 0x00, 0x00, 0x00,
+    0x00, 0xDC, 0x00, 0x00, 0x55, 0x10, 0x00, 0x00, 0x02, 0x00, 0x00, 0x00,
+    0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
+])
+
+# TCU init reply (synthetic) and its animated ATF temperature address
+DEFAULT_TCU_ID = bytes([0x7E, 0x12, 0x40, 0x01, 0x02])
+TCU_ATF_TEMPERATURE_ADDRESS = 0x000010
+
+RAM_SIZE = 0x10000  # Reads above this return zeros
+COUNTER_ADDRESS = 0xFFFF  # Low byte of the response frame counter, for latency measurement
+
+# Addresses logged by default (logger.py ECU_PARAMETERS)
+BENCH_ADDRESSES = [0x1C, 0x08, 0x46, 0x0D, 0x23, 0x10, 0x13, 0x14, 0x0E, 0x0F]
+
+
+class ECUSimulator:
+    """
+    SSM2 ECU on the master side of a pty.
+
+    Usage:
+        sim = ECUSimulator(baudrate=4800)
+        port = sim.open()
+        sim.start()
+        ssm2 = PySSM2.PySSM2(port)
+        ...
+        sim.stop()
+    """
+
+    def __init__(self, ecu_id=DEFAULT_ECU_ID, capabilities=DEFAULT_CAPABILITIES,
+                 baudrate=4800, inter_byte_delay=0.0, response_delay=0.025,
+                 frame_gap=0.0, echo=True, tcu=False):
+        """
+        Args:
+            ecu_id: 5-byte ECU ID returned by 0xBF
+            capabilities: Capability flag bytes returned after the ECU ID
+            baudrate: Simulated line speed, 0 disables pacing entirely
+            inter_byte_delay: Extra seconds between response bytes
+            response_delay: Seconds between the end of a request and the reply (P2)
+            frame_gap: Seconds between frames in continuous mode
+            echo: Echo each request back like a K-line adapter
+            tcu: Also answer as a TCU at 0x18 (separate ID and RAM image)
+        """
+        self.ecu_id = bytes(ecu_id)
+        self.capabilities = bytes(capabilities)
+        self.baudrate = baudrate
+        self.inter_byte_delay = inter_byte_delay
+        self.response_delay = response_delay
+        self.frame_gap = frame_gap
+        self.echo = echo
+
+        self.ram = bytearray(RAM_SIZE)
+        self.tcu_ram = bytearray(RAM_SIZE) if tcu else None
+        self.master = None
+        self.slave = None
+        self.port = None
+        self._link = None
+        self._thread = None
+        self._running = False
+        self._start = time.monotonic()
+
+        # One parser per simulated unit, each only keeps requests addressed to it
+        self.parsers = {ECU_ADDRESS: FrameParser(destination=ECU_ADDRESS)}
+        if tcu:
+            self.parsers[TCU_ADDRESS] = FrameParser(destination=TCU_ADDRESS)
+        self._continuous = None  # Request data being repeated in continuous mode
+        self._continuous_unit = ECU_ADDRESS
+
+        # Statistics; send_log (if a list) collects the time each frame finished sending
+        self.requests = 0
+        self.frames_sent = 0
+        self.send_log = None
+        self._last_write = 0.0
+
+    # ------------------------------------------------------------------
+    # pty handling
+    # ------------------------------------------------------------------
+
+    def open(self, link=None):
+        """Create the pty and return the device path to hand to PySSM2."""
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        if link:
+            if os.path.islink(link):
+                os.unlink(link)
+            os.symlink(self.port, link)
+            self._link = link
+        return link or self.port
+
+    def start(self):
+        """Serve requests on a background thread."""
+        self._running = True
+        self._thread = threading.Thread(target=self.serve_forever, name="ECU Simulator", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread:
+            self._thread.join(timeout=2)
+        for fd in (self.master, self.slave):
+            if fd is not None:
+                os.close(fd)
+        self.master = self.slave = None
+        if self._link and os.path.islink(self._link):
+            os.unlink(self._link)
+
+    def _send(self, data):
+        """Write bytes to the line, paced at the simulated baud rate."""
+        if not self.baudrate and not self.inter_byte_delay:
+            os.write(self.master, data)
+            self._last_write = time.monotonic()
+            return
+        byte_time = (10 / self.baudrate if self.baudrate else 0.0) + self.inter_byte_delay
+        due = time.monotonic()
+        for index in range(len(data)):
+            due += byte_time
+            os.write(self.master, data[index:index + 1])
+            self._last_write = time.monotonic()
+            delay = due - self._last_write
+            if delay > 0:
+                time.sleep(delay)
+
+    def _frame(self, data, unit=ECU_ADDRESS):
+        packet = bytes([0x80, TOOL_ADDRESS, unit, len(data)]) + bytes(data)
+        return packet + bytes([sum(packet) & 0xFF])
+
+    def _respond(self, data, unit=ECU_ADDRESS):
+        self._send(self._frame(data, unit))
+        if self.send_log is not None:
+            self.send_log.append(self._last_write)
+        self.frames_sent += 1
+
+    # ------------------------------------------------------------------
+    # Synthetic RAM
+    # ------------------------------------------------------------------
+
+    def update_ram(self):
+        """Animate the addresses the logger reads by default."""
+        t = time.monotonic() - self._start
+        rpm = 2500 + 2000 * math.sin(t * 0.5)
+        maf = 5 + 60 * max(0.0, math.sin(t * 0.5))
+        ram = self.ram
+        ram[0x08] = 90 + 40                                          # Coolant 90 C
+        ram[0x0D] = int(min(255, (14.7 + 10 * max(0.0, math.sin(t * 0.5))) * 255 / 37))
+        ram[0x0E:0x10] = struct.pack('>H', int(rpm * 4))
+        ram[0x10] = int(60 + 40 * math.sin(t * 0.1))                  # Vehicle speed
+        ram[0x13:0x15] = struct.pack('>H', int(maf * 100))
+        ram[0x1C] = int((13.8 + 0.4 * math.sin(t)) / 0.08)            # Battery voltage
+        ram[0x23] = int(14.5 * 255 / 37)                              # Atmospheric
+        ram[0x46] = int((14.7 + 1.5 * math.sin(t * 0.7)) / 14.7 * 128)  # AFR
+        ram[COUNTER_ADDRESS] = self.frames_sent & 0xFF
+        if self.tcu_ram is not None:
+            self.tcu_ram[TCU_ATF_TEMPERATURE_ADDRESS] = int(80 + 10 * math.sin(t * 0.05)) + 50  # ATF 70-90 C
+            self.tcu_ram[COUNTER_ADDRESS] = self.frames_sent & 0xFF
+
+    def _read_ram(self, address, count=1, unit=ECU_ADDRESS):
+        if address >= RAM_SIZE:
+            return bytes(count)
+        ram = self.tcu_ram if unit == TCU_ADDRESS else self.ram
+        data = bytes(ram[address:address + count])
+        return data + bytes(count - len(data))
+
+    # ------------------------------------------------------------------
+    # Protocol
+    # ------------------------------------------------------------------
+
+    def handle(self, data, unit=ECU_ADDRESS):
+        """
+        Handle one request (data section) and return the response data, or None.
+        Continuous-mode reads are remembered and repeated by serve_forever().
+        Any request on the line ends a continuous read, whichever unit it is for.
+        """
+        command = data[0]
+        self.requests += 1
+        self._continuous = None
+        ram = self.tcu_ram if unit == TCU_ADDRESS else self.ram
+
+        if command == 0xBF:
+            if unit == TCU_ADDRESS:
+                return bytes([0xFF, 0xA2, 0x10, 0x0F]) + DEFAULT_TCU_ID + bytes(len(self.capabilities))
+            return bytes([0xFF, 0xA2, 0x10, 0x0F]) + self.ecu_id + self.capabilities
+
+        if command in (0xA8, 0xA0):
+            if data[1] == 0x01:
+                self._continuous = bytes(data)
+                self._continuous_unit = unit
+            return self.read_response(data, unit)
+
+        if command == 0xB8 and len(data) == 5:
+            address = int.from_bytes(data[1:4], 'big')
+            if address < RAM_SIZE:
+                ram[address] = data[4]
+            return bytes([0xF8, data[4]])
+
+        if command == 0xB0 and len(data) > 4:
+            address = int.from_bytes(data[1:4], 'big')
+            values = bytes(data[4:])
+            end = min(RAM_SIZE, address + len(values))
+            if address < RAM_SIZE:
+                ram[address:end] = values[:end - address]
+            return bytes([0xF0]) + values
+
+        return None
+
+    def read_response(self, data, unit=ECU_ADDRESS):
+        """Response data for an 0xA8 address read or 0xA0 block read request."""
+        self.update_ram()
+        if data[0] == 0xA0:
+            address = int.from_bytes(data[2:5], 'big')
+            return bytes([0xE0]) + self._read_ram(address, data[5] + 1, unit)
+        response = bytearray([0xE8])
+        for index in range(2, len(data) - 2, 3):
+            response += self._read_ram(int.from_bytes(data[index:index + 3], 'big'), 1, unit)
+        return bytes(response)
+
+    def _poll(self, timeout):
+        """Read and handle any pending request. Returns True if one was handled."""
+        readable, _, _ = select.select([self.master], [], [], timeout)
+        if not readable:
+            return False
+        try:
+            chunk = os.read(self.master, 1024)
+        except OSError:
+            # No client has the slave open yet
+            time.sleep(timeout or 0.01)
+            return False
+
+        handled = False
+        for unit, parser in self.parsers.items():
+            parser.feed(chunk)
+            for data in parser.frames():
+                request = bytes(data)
+                if self.echo:
+                    self._send(self._request_packet(request, unit))
+                response = self.handle(request, unit)
+                if response is not None:
+                    time.sleep(self.response_delay)
+                    self._respond(response, unit)
+                handled = True
+        return handled
+
+    @staticmethod
+    def _request_packet(data, unit=ECU_ADDRESS):
+        packet = bytes([0x80, unit, TOOL_ADDRESS, len(data)]) + bytes(data)
+        return packet + bytes([sum(packet) & 0xFF])
+
+    def serve_forever(self):
+        self._running = True
+        while self._running:
+            if self._continuous is not None:
+                # Keep streaming until another request arrives
+                if self._poll(self.frame_gap):
+                    continue
+                self._respond(self.read_response(self._continuous, self._continuous_unit),
+                              self._continuous_unit)
+            else:
+                self._poll(0.1)
+
+
+def bench(seconds, **kwargs):
+    """
+    Measure PySSM2 throughput and latency against the simulator.
+
+    Latency is the time from the simulator writing the last byte of a frame to
+    PySSM2.receive_frame() returning it, matched up by the frame counter byte.
+    """
+    import PySSM2
+    from request_planner import plan_requests
+
+    addresses = BENCH_ADDRESSES + [COUNTER_ADDRESS]
+    sim = ECUSimulator(**kwargs)
+    sim.send_log = []
+    port = sim.open()
+    sim.start()
+    ssm2 = PySSM2.PySSM2(port, baudrate=sim.baudrate or 4800, timeout=2)
+    try:
+        ssm2.ecu_init()
+        ssm2.read_single_address_continuously(addresses)
+
+        received = []
+        start = time.monotonic()
+        while time.monotonic() - start < seconds:
+            data = ssm2.receive_frame()
+            received.append((data[-1], time.monotonic()))
+        elapsed = time.monotonic() - start
+        frames = len(received)
+    finally:
+        ssm2.close()
+        sim.stop()
+
+    # The simulator thread may log a send time after we already got the frame, so match
+    # frames to send times afterwards: frame n carries n & 0xFF, take the latest such n
+    # that was sent before it was received
+    send_log = sim.send_log
+    latencies = []
+    for counter, when in received:
+        index = counter + 256 * ((len(send_log) - 1 - counter) // 256)
+        while index >= 0 and send_log[index] > when:
+            index -= 256
+        if index >= 0:
+            latencies.append(when - send_log[index])
+
+    plan = plan_requests(addresses, sim.baudrate or 4800)
+    latencies.sort()
+    print(f"Frames:        {frames} in {elapsed:.1f} s")
+    print(f"Samples/s:     {frames / elapsed:.1f} (planner estimate {plan.samples_per_second:.1f})")
+    if latencies:
+        print(f"Latency mean:  {sum(latencies) / len(latencies) * 1000:.2f} ms")
+        print(f"Latency p95:   {latencies[int(len(latencies) * 0.95)] * 1000:.2f} ms")
+    print(f"Parser:        {ssm2.parser.stats()}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Simulated SSM2 ECU on a pseudo-terminal")
+    parser.add_argument('--link', help="Create a symlink to the pty at this path")
+    parser.add_argument('--baud', type=int, default=4800, help="Simulated baud rate (0 = unpaced)")
+    parser.add_argument('--inter-byte-delay', type=float, default=0.0, help="Extra seconds between bytes")
+    parser.add_argument('--response-delay', type=float, default=0.025, help="Seconds before each reply")
+    parser.add_argument('--frame-gap', type=float, default=0.0, help="Seconds between continuous frames")
+    parser.add_argument('--no-echo', action='store_true', help="Do not echo requests")
+    parser.add_argument('--ecu-id', default=DEFAULT_ECU_ID.hex(), help="ECU ID as 10 hex digits")
+    parser.add_argument('--capabilities', default=DEFAULT_CAPABILITIES.hex(), help="Capability bytes as hex")
+    parser.add_argument('--tcu', action='store_true', help="Also answer as a TCU at 0x18")
+    parser.add_argument('--bench', type=float, metavar='SECONDS', help="Run a PySSM2 benchmark and exit")
+    args = parser.parse_args()
+
+    options = dict(
+        ecu_id=bytes.fromhex(args.ecu_id),
+        capabilities=bytes.fromhex(args.capabilities),
+        baudrate=args.baud,
+        inter_byte_delay=args.inter_byte_delay,
+        response_delay=args.response_delay,
+        frame_gap=args.frame_gap,
+        echo=not args.no_echo,
+        tcu=args.tcu,
+    )
+
+    if args.bench:
+        bench(args.bench, **options)
+    else:
+        simulator = ECUSimulator(**options)
+        print(f"Simulated ECU on {simulator.open(args.link)} ({simulator.port})")
+        print("Press Ctrl+C to stop")
+        try:
+            simulator.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            simulator.stop()
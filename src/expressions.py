@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Safe compiler for logger.xml conversion expressions.
+
+Conversions are arithmetic on the raw value x, e.g. 'x*100/255' or
+'32+9*(x-40)/5', and calculated parameters refer to other parameters by id,
+optionally in a given unit: '(P12*60)/P8', '[P7:psi]-[P24:psi]'.
+
+An expression is parsed with ast, every node is checked against a whitelist
+(numbers, names, + - * / and parentheses; no calls, attributes, subscripts or
+anything else), and the checked tree is compiled once into a plain Python
+function. Results are memoized by expression text, so a conversion shared by
+dozens of parameters is compiled once.
+
+Single-byte values also get a 256-entry lookup table, so decoding is one
+tuple index; entries where the expression fails (1/x at x=0) hold None.
+With NumPy installed, vectorized() applies a conversion to a whole array of
+raw values at once.
+
+Usage:
+    conversion = compile_expression('x*37/255')
+    conversion.function(128)            # 18.57...
+    decode = decoder('x/4', length=2)   # raw bytes -> value
+    decode([0x1F, 0x40])                # 2000.0
+
+Benchmark a conversion:
+    python3 expressions.py 'x*37/255'
+"""
+
+import ast
+import functools
+import re
+import struct
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, only needed for vectorized()
+    np = None
+
+# Node types an expression may contain
+ALLOWED_NODES = (
+    ast.Expression, ast.BinOp, ast.UnaryOp, ast.Constant, ast.Name, ast.Load,
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.USub, ast.UAdd,
+)
+
+# x, or a parameter id such as P12 or E5
+NAME_PATTERN = re.compile(r'^(x|[PE]\d+)$')
+# [P7:psi] - a parameter in a specific unit
+REFERENCE_PATTERN = re.compile(r'\[([PE]\d+):([^\]]+)\]')
+
+
+class ExpressionError(ValueError):
+    """The expression is not a supported conversion."""
+
+
+class CompiledExpression:
+    """
+    A checked and compiled conversion.
+
+    Attributes:
+        text: The original expression
+        names: Argument names of function, in order ('x', or parameter references)
+        references: For each name, (parameter id, unit or None); 'x' maps to (None, None)
+        function: Plain Python function taking one positional argument per name
+    """
+
+    def __init__(self, text, names, references, function):
+        self.text = text
+        self.names = names
+        self.references = references
+        self.function = function
+        self._table = None
+
+    def __repr__(self):
+        return f"CompiledExpression({self.text!r})"
+
+    @property
+    def table(self):
+        """Lookup table of the values for x = 0..255 (None where the expression fails)."""
+        if self._table is None:
+            if self.names != ('x',):
+                raise ExpressionError(f"Lookup tables need a single x argument: {self.text}")
+            function = self.function
+            table = []
+            for raw in range(256):
+                try:
+                    table.append(function(raw))
+                except (ZeroDivisionError, OverflowError):
+                    table.append(None)
+            self._table = tuple(table)
+        return self._table
+
+    def vectorized(self):
+        """
+        Function applying the conversion to NumPy arrays of raw values (one per name).
+        Division by zero gives inf/nan instead of raising.
+        """
+        if np is None:
+            raise ImportError("NumPy is required for vectorized conversions")
+        function = self.function
+
+        def apply(*arrays):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return function(*(np.asarray(array, dtype=np.float64) for array in arrays))
+        return apply
+
+
+def _check(tree, text, references):
+    for node in ast.walk(tree):
+        if not isinstance(node, ALLOWED_NODES):
+            raise ExpressionError(f"{type(node).__name__} is not allowed in {text!r}")
+        if isinstance(node, ast.Constant) and (
+                isinstance(node.value, bool) or not isinstance(node.value, (int, float))):
+            raise ExpressionError(f"Only numbers are allowed in {text!r}")
+        if isinstance(node, ast.Name) and not NAME_PATTERN.match(node.id) and node.id not in references:
+            raise ExpressionError(f"Unknown name {node.id!r} in {text!r}")
+
+
+@functools.lru_cache(maxsize=None)
+def compile_expression(text):
+    """
+    Check and compile a conversion expression. Memoized by text.
+    Raises ExpressionError for anything outside the whitelist.
+    """
+    references = {}
+
+    def replace(match):
+        name = f"{match.group(1)}_{len(references)}"
+        references[name] = (match.group(1), match.group(2))
+        return name
+
+    source = REFERENCE_PATTERN.sub(replace, text.strip())
+    try:
+        tree = ast.parse(source, mode='eval')
+    except SyntaxError as e:
+        raise ExpressionError(f"Invalid expression {text!r}: {e.msg}") from None
+
+    _check(tree, text, references)
+
+    names = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id not in names:
+            names.append(node.id)
+    names.sort(key=lambda name: (name != 'x', name))
+    for name in names:
+        references.setdefault(name, (None, None) if name == 'x' else (name, None))
+
+    # Wrap the checked body in a lambda taking the names as arguments
+    function_tree = ast.Expression(ast.Lambda(
+        args=ast.arguments(posonlyargs=[], args=[ast.arg(arg=name) for name in names], vararg=None,
+                           kwonlyargs=[], kw_defaults=[], kwarg=None, defaults=[]),
+        body=tree.body,
+    ))
+    ast.fix_missing_locations(function_tree)
+    function = eval(compile(function_tree, f'<expression {text}>', 'eval'), {'__builtins__': {}})
+
+    return CompiledExpression(text, tuple(names), {name: references[name] for name in names}, function)
+
+
+def decoder(text, length=1, storagetype=None):
+    """
+    Function turning a parameter's raw response bytes into its value.
+
+    Args:
+        text: Conversion expression in x
+        length: Bytes per value (1, 2 or 4, big-endian)
+        storagetype: 'float' for 4-byte IEEE floats
+    Single-byte integer values decode through the lookup table. Memoized: the
+    same arguments always return the same function object.
+    """
+    return _decoder(text, length, storagetype)
+
+
+@functools.lru_cache(maxsize=None)
+def _decoder(text, length, storagetype):
+    conversion = compile_expression(text)
+    if conversion.names != ('x',):
+        raise ExpressionError(f"Raw conversions take a single x argument: {text}")
+    function = conversion.function
+
+    if storagetype == 'float':
+        unpack = struct.Struct('>f').unpack
+        return lambda raw: function(unpack(bytes(raw))[0])
+    if length == 1:
+        table = conversion.table
+        return lambda raw: table[raw[0]]
+    if length == 2:
+        return lambda raw: function((raw[0] << 8) | raw[1])
+    return lambda raw: function(int.from_bytes(bytes(raw), 'big'))
+
+
+if __name__ == "__main__":
+    import sys
+    import timeit
+
+    if len(sys.argv) != 2:
+        print("Usage: python3 expressions.py '<expression>'")
+        sys.exit(1)
+
+    conversion = compile_expression(sys.argv[1])
+    print(f"Arguments: {', '.join(conversion.names)}")
+    if conversion.names == ('x',):
+        raw = [0x80]
+        decode = decoder(sys.argv[1])
+        function = conversion.function
+        print(f"x=128:     {decode(raw)}")
+        count = 1000000
+        for label, call in (
+            ('function', lambda: function(raw[0])),
+            ('table', lambda: decode(raw)),
+        ):
+            seconds = timeit.timeit(call, number=count)
+            print(f"{label:<10} {seconds / count * 1e9:.0f} ns per value")
+        if np is not None:
+            values = np.random.randint(0, 256, 100000)
+            apply = conversion.vectorized()
+            seconds = timeit.timeit(lambda: apply(values), number=10) / 10
+            print(f"{'numpy':<10} {seconds / len(values) * 1e9:.1f} ns per value")
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+Frame decoder compiled once from the parameter list.
+
+The sample buffer holds the raw bytes of every parameter back to back, in
+parameter order. Instead of walking the parameter dicts for every frame,
+FrameDecoder builds one big-endian struct.Struct for the whole buffer
+('B' per single byte, 'H'/'I' per 16/32-bit value, 'f' for floats, 'Ns' for
+parameters with a custom calculation) and generates a function that unpacks
+it in a single call and converts every field in one tuple expression:
+
+    def decode(buffer):
+        v0, v1, v2, = unpack_from(buffer)
+        return (t0[v0], f1(v1), c2(v2),)
+
+where t0 is the 256-entry lookup table of a single-byte conversion, f1 the
+compiled conversion of a multi-byte value and c2 a custom calculation (given
+the raw bytes, as before). format() applies the parameters' format strings the
+same way; row_formatter() builds it for any list of columns, so sinks format
+whole sample rows at once. Parameters declared with 'expr' (or built by definitions.to_parameter)
+take the table/struct path; any other 'calculation' is called as is.
+
+With NumPy, decode_batch() decodes a whole N x size array of buffers (a capture
+or a log, replayed offline) into one column per parameter from the same
+parameter list: the lookup tables become array indexing, 16/32-bit values are
+assembled with vectorized shifts, and the results match decode() value for value.
+
+Usage:
+    decoder = FrameDecoder(ECU_PARAMETERS)
+    values = decoder.decode(scheduler.values)      # tuple in parameter order
+    raw_data = dict(zip(decoder.names, values))
+    formatted = decoder.format(values)
+    columns = decoder.decode_batch(frames)         # N x decoder.size uint8 array
+
+Benchmark against the per-parameter loop:
+    python3 frame_decoder.py
+"""
+
+import re
+import struct
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, only needed for decode_batch()
+    np = None
+
+from expressions import compile_expression, decoder
+
+
+# Format specs that can be written into the generated f-strings as they are
+FORMAT_SPEC = re.compile(r'^[\w.,%<>=^+\- #]*$')
+
+
+def _length(param):
+    address = param['address']
+    return len(address) if isinstance(address, list) else 1
+
+
+def _field(param, index):
+    """
+    (struct code, conversion expression, namespace entries, converter) of one
+    parameter; converter is the CompiledExpression, or the custom calculation.
+    """
+    length = _length(param)
+    expr = param.get('expr')
+    storagetype = param.get('storagetype')
+    calculation = param.get('calculation')
+    name = f"v{index}"
+
+    # A calculation compiled from 'expr' (decoder() is memoized, so it is the same object)
+    if expr is not None and (calculation is None or calculation is decoder(expr, length, storagetype)):
+        conversion = compile_expression(expr)
+        if storagetype == 'float' and length == 4:
+            return 'f', f"f{index}({name})", {f"f{index}": conversion.function}, conversion
+        if length == 1:
+            return 'B', f"t{index}[{name}]", {f"t{index}": conversion.table}, conversion
+        if length in (2, 4):
+            code = 'H' if length == 2 else 'I'
+            return code, f"f{index}({name})", {f"f{index}": conversion.function}, conversion
+        calculation = decoder(expr, length, storagetype)
+
+    return f"{length}s", f"c{index}({name})", {f"c{index}": calculation}, calculation
+
+
+def _format(spec, name, nan=False):
+    """
+    Expression formatting the value called name, None stays None. With nan,
+    NaN stands for a missing value too and values are doubles: integral ones
+    are written as ints when there is no spec, and integer presentation types
+    (d, x, b...) get int().
+    """
+    missing = f"{name} != {name}" if nan else f"{name} is None"
+    if not spec:
+        return f"None if {missing} else int({name}) if {name}.is_integer() else {name}" if nan else name
+    value = f"int({name})" if nan and spec[-1] in 'bcdoxX' else name
+    if FORMAT_SPEC.match(spec):
+        return f"None if {missing} else f'{{{value}:{spec}}}'"
+    return f"None if {missing} else format({value}, {spec!r})"
+
+
+def row_formatter(formats, nan=False):
+    """
+    Function formatting a row tuple with one format spec per column, generated
+    like decode() (None specs and None values are passed through as they are).
+    nan=True formats rows of doubles read back from a SampleRing, NaN as missing.
+    """
+    names = ''.join(f"v{index}, " for index in range(len(formats)))
+    specs = ''.join(f"{_format(spec, f'v{index}', nan)}, " for index, spec in enumerate(formats))
+    source = (
+        f"def format_row(row):\n"
+        f"    {names}= row\n"
+        f"    return ({specs})\n"
+    ) if formats else (
+        "def format_row(row):\n"
+        "    return ()\n"
+    )
+    scope = {}
+    exec(compile(source, '<row formatter>', 'exec'), scope)
+    return scope['format_row']
+
+
+class FrameDecoder:
+    """
+    Decode a sample buffer into a tuple of parameter values in one pass.
+
+    Attributes:
+        names: Parameter names, in the order of the decoded values
+        size: Bytes per sample buffer
+        source: Generated Python source of decode(), for debugging
+    """
+
+    def __init__(self, parameters):
+        """
+        Args:
+            parameters: ECU_PARAMETERS-style list of dicts ('address', 'name', and
+                        'expr' or 'calculation', optional 'format' and 'storagetype')
+        """
+        self.names = [param['name'] for param in parameters]
+
+        codes = []
+        conversions = []
+        namespace = {}
+        # (struct code, buffer offset, byte count, converter) per parameter, for decode_batch()
+        self._fields = []
+        offset = 0
+        for index, param in enumerate(parameters):
+            code, conversion, entries, converter = _field(param, index)
+            codes.append(code)
+            conversions.append(conversion)
+            namespace.update(entries)
+            self._fields.append((code, offset, _length(param), converter))
+            offset += _length(param)
+
+        self.struct = struct.Struct('>' + ''.join(codes))
+        self.size = self.struct.size
+        namespace['unpack_from'] = self.struct.unpack_from
+
+        # The tables and functions become closure variables of the generated functions
+        arguments = ', '.join(namespace)
+        names = ''.join(f"v{index}, " for index in range(len(parameters)))
+        self.source = (
+            f"def build({arguments}):\n"
+            f"    def decode(buffer):\n"
+            f"        {names}= unpack_from(buffer)\n"
+            f"        return ({''.join(f'{conversion}, ' for conversion in conversions)})\n"
+            f"\n"
+            f"    return decode\n"
+        ) if parameters else (
+            "def build(unpack_from):\n"
+            "    return lambda buffer: ()\n"
+        )
+        scope = {}
+        exec(compile(self.source, '<frame decoder>', 'exec'), scope)
+        self.decode = scope['build'](**namespace)
+        self.format = row_formatter([param.get('format') for param in parameters])
+        self._luts = {}
+
+    def _lut(self, conversion):
+        """The conversion's lookup table as a float64 array, NaN where it fails."""
+        lut = self._luts.get(conversion.text)
+        if lut is None:
+            lut = np.array([np.nan if value is None else value for value in conversion.table], dtype=np.float64)
+            self._luts[conversion.text] = lut
+        return lut
+
+    def decode_batch(self, frames):
+        """
+        Decode many sample buffers at once into one NumPy column per parameter.
+
+        Args:
+            frames: N x size uint8 array (or bytes-like of N whole buffers)
+        Returns a dict of columns by parameter name. Converted values are float64
+        with NaN where the live decoder gives None or raises (division by zero);
+        custom calculations run once per distinct raw value, on the same raw
+        bytes as decode().
+        """
+        if np is None:
+            raise ImportError("NumPy is required for batch decoding")
+        frames = np.asarray(frames, dtype=np.uint8)
+        if frames.ndim == 1:
+            frames = np.frombuffer(frames, dtype=np.uint8).reshape(-1, self.size)
+        if frames.shape[1] != self.size:
+            raise ValueError(f"Frames are {frames.shape[1]} bytes, expected {self.size}")
+
+        columns = {}
+        for name, (code, offset, length, converter) in zip(self.names, self._fields):
+            if code == 'B':
+                columns[name] = self._lut(converter)[frames[:, offset]]
+                continue
+            if code in ('H', 'I'):
+                raw = np.zeros(len(frames), dtype=np.uint64)
+                for index in range(length):
+                    raw = (raw << np.uint64(8)) | frames[:, offset + index]
+            elif code == 'f':
+                raw = np.ascontiguousarray(frames[:, offset:offset + 4]).view('>f4')[:, 0]
+            else:
+                # Custom calculation: once per distinct raw value
+                raw = frames[:, offset:offset + length]
+                if length <= 8:
+                    key = np.zeros(len(frames), dtype=np.uint64)
+                    for index in range(length):
+                        key = (key << np.uint64(8)) | raw[:, index]
+                    _, first, inverse = np.unique(key, return_index=True, return_inverse=True)
+                    unique = raw[first]
+                else:
+                    unique, inverse = np.unique(raw, axis=0, return_inverse=True)
+                columns[name] = np.array([converter(bytes(row)) for row in unique])[inverse.reshape(-1)]
+                continue
+            column = converter.vectorized()(raw)
+            column[~np.isfinite(column)] = np.nan
+            columns[name] = column
+        return columns
+
+
+if __name__ == "__main__":
+    import os
+    import time
+    import timeit
+
+    from derived import DerivedEvaluator, evaluate_batch, where
+
+    # The logger's default parameters
+    parameters = [
+        {'address': 0x1C, 'name': 'Battery Voltage', 'expr': 'x*0.08', 'format': '.1f'},
+        {'address': 0x08, 'name': 'Coolant Temperature', 'expr': 'x-40', 'format': None},
+        {'address': 0x46, 'name': 'Air Fuel Ratio', 'expr': 'x/128*14.7', 'format': '.2f'},
+        {'address': 0x0D, 'name': 'Manifold Absolute Pressure', 'expr': 'x*37/255', 'format': '.2f'},
+        {'address': 0x23, 'name': 'Atmospheric Pressure', 'expr': 'x*37/255', 'format': '.3f'},
+        {'address': 0x10, 'name': 'Vehicle Speed', 'calculation': lambda raw: float(raw[0]), 'format': None},
+        {'address': [0x13, 0x14], 'name': 'Mass Airflow', 'expr': 'x/100', 'format': '.2f'},
+        {'address': [0x0E, 0x0F], 'name': 'Engine Speed', 'expr': 'x/4', 'format': None},
+    ]
+    # A full auto-selected set: 40 more single-byte and 16-bit parameters
+    wide = parameters + [
+        {'address': 0x100 + index if index % 4 else [0x100 + index, 0x200 + index],
+         'name': f"Parameter {index}", 'expr': 'x*100/255' if index % 4 else 'x/4', 'format': '.2f'}
+        for index in range(40)
+    ]
+
+    derived = [
+        {'name': 'Boost Pressure', 'depends': ['Manifold Absolute Pressure', 'Atmospheric Pressure'],
+         'calculation': lambda data: data['Manifold Absolute Pressure'] - data['Atmospheric Pressure']},
+        {'name': 'Engine Load', 'depends': ['Engine Speed', 'Mass Airflow'],
+         'calculation': lambda data: where(
+             data['Engine Speed'] == 0, 0,
+             (data['Mass Airflow'] * 60) / where(data['Engine Speed'] == 0, 1, data['Engine Speed']))},
+    ]
+
+    for params in (parameters, wide):
+        for param in params:
+            if 'calculation' not in param:
+                param['calculation'] = decoder(param['expr'], _length(param))  # as compile_parameters() does
+
+        def interpretive_decode(response):
+            # extract_raw_bytes() as it was
+            raw_data = {}
+            response_index = 0
+            for param in params:
+                if isinstance(param['address'], list):
+                    num_bytes = len(param['address'])
+                    raw_bytes = response[response_index:response_index + num_bytes]
+                    response_index += num_bytes
+                else:
+                    raw_bytes = [response[response_index]]
+                    response_index += 1
+                raw_data[param['name']] = param['calculation'](raw_bytes)
+            return raw_data
+
+        def interpretive(response):
+            # ...followed by the logger's formatting loop
+            raw_data = interpretive_decode(response)
+            logdata = {}
+            for param in params:
+                value = raw_data[param['name']]
+                logdata[param['name']] = f"{value:{param['format']}}" if param['format'] else value
+            return raw_data, logdata
+
+        frame_decoder = FrameDecoder(params)
+        names = frame_decoder.names
+
+        def compiled(response):
+            values = frame_decoder.decode(response)
+            return dict(zip(names, values)), dict(zip(names, frame_decoder.format(values)))
+
+        def compiled_decode(response):
+            return dict(zip(names, frame_decoder.decode(response)))
+
+        buffer = bytearray(os.urandom(frame_decoder.size))
+        assert interpretive(buffer) == compiled(buffer)
+
+        print(f"{len(params)} parameters, {frame_decoder.size} bytes per frame:")
+        count = 20000
+        for label, before, after in (('decode', interpretive_decode, compiled_decode),
+                                     ('decode+format', interpretive, compiled)):
+            times = [min(timeit.repeat(lambda: function(buffer), number=count, repeat=5)) / count * 1e6
+                     for function in (before, after)]
+            print(f"  {label:<14} {times[0]:6.1f} us per frame before, {times[1]:6.1f} us after "
+                  f"({times[0] / times[1]:.1f}x)")
+
+        if np is not None:
+            # Offline: a burst of frames decoded one by one (with the derived parameters) vs as columns
+            frames = np.random.randint(0, 256, (100000, frame_decoder.size), dtype=np.uint8)
+            buffers = [row.tobytes() for row in frames]
+            started = time.perf_counter()
+            live_values = [dict(zip(names, frame_decoder.decode(buffer))) for buffer in buffers]
+            decoded = time.perf_counter()
+            evaluator = DerivedEvaluator(derived)
+            live = [dict(evaluator.evaluate(values)) for values in live_values]
+            finished = time.perf_counter()
+
+            columns = frame_decoder.decode_batch(frames)
+            batch_decoded = time.perf_counter()
+            columns = evaluate_batch(derived, columns)
+            batch_finished = time.perf_counter()
+
+            for index in range(0, len(frames), 997):
+                for name, column in columns.items():
+                    value = live[index][name]
+                    assert (value is None and np.isnan(column[index])) or value == column[index], (name, index)
+            count = len(frames)
+            print(f"  batch decode   {(decoded - started) / count * 1e6:6.1f} us per frame one by one, "
+                  f"{(batch_decoded - finished) / count * 1e6:6.2f} us as columns")
+            print(f"  batch derived  {(finished - decoded) / count * 1e6:6.1f} us per frame one by one, "
+                  f"{(batch_finished - batch_decoded) / count * 1e6:6.2f} us as columns (results match)")
@@ -0,0 +1,186 @@
+"""
+Incremental SSM2 frame parser.
+
+The ECU streams frames back to back in continuous-read mode:
+
+    0x80, destination, source, data size, data..., checksum
+
+Bytes are fed into a fixed buffer as they arrive from the serial port and
+complete frames are yielded as memoryview slices of that buffer, so payloads
+are never copied. A frame with a bad checksum (or a stray byte in front of a
+header) only costs the bytes up to the next 0x80, instead of misaligning every
+frame that follows.
+"""
+
+HEADER_BYTE = 0x80
+HEADER_LENGTH = 4        # 0x80, destination, source, data size
+MAX_FRAME_LENGTH = HEADER_LENGTH + 0xFF + 1
+
+
+class FrameParser:
+    """
+    Streaming SSM2 frame parser with header resynchronisation.
+
+    Usage:
+        parser = FrameParser(destination=0xF0, checksum=ssm2.calculate_checksum)
+        parser.feed(ser.read(ser.in_waiting or 1))
+        for data in parser.frames():
+            ...  # data[0] is the response code (0xE8, 0xE0, 0xFF...)
+
+    Yielded memoryviews point into the parser buffer and are only valid until
+    the next call to feed(). Copy them (bytes(data)) if they need to live longer.
+    """
+
+    def __init__(self, destination=0xF0, checksum=None, data_size=None, buffer_size=4096, source=None):
+        """
+        Args:
+            destination: Only frames addressed to this byte are yielded. Frames for
+                         other destinations (e.g. the K-line echo of our own request,
+                         which is addressed to the ECU) are skipped silently.
+                         None yields every valid frame.
+            source: Only frames sent by this byte are yielded (e.g. 0x10 engine ECU,
+                    0x18 TCU when several control units share the K-line).
+                    None accepts any sender.
+            checksum: Callable taking the frame bytes (without checksum) and
+                      returning the expected checksum byte.
+            data_size: Expected data size byte, if known (continuous reads always
+                       return the same size). A header announcing any other size
+                       is rejected straight away instead of waiting for up to
+                       256 bytes to find out the checksum is wrong.
+            buffer_size: Size of the receive buffer, must hold at least two frames.
+        """
+        if buffer_size < 2 * MAX_FRAME_LENGTH:
+            raise ValueError(f"buffer_size must be at least {2 * MAX_FRAME_LENGTH} bytes")
+
+        self.destination = destination
+        self.source = source
+        self.checksum = checksum or (lambda packet: sum(packet) & 0xFF)
+        self.data_size = data_size
+
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._start = 0  # First unparsed byte
+        self._end = 0    # One past the last received byte
+
+        # Statistics
+        self.good_frames = 0
+        self.bad_frames = 0
+        self.skipped_frames = 0
+        self.discarded_bytes = 0
+
+    def __len__(self):
+        """Number of buffered, not yet parsed bytes."""
+        return self._end - self._start
+
+    def reset(self):
+        """Drop any buffered bytes (e.g. after sending a new request)."""
+        self._start = 0
+        self._end = 0
+
+    def reset_stats(self):
+        self.good_frames = 0
+        self.bad_frames = 0
+        self.skipped_frames = 0
+        self.discarded_bytes = 0
+
+    def stats(self):
+        """Return the frame counters as a dict (for logging)."""
+        return {
+            'good_frames': self.good_frames,
+            'bad_frames': self.bad_frames,
+            'skipped_frames': self.skipped_frames,
+            'discarded_bytes': self.discarded_bytes,
+        }
+
+    def feed(self, data):
+        """
+        Append received bytes to the buffer.
+
+        Invalidates any memoryview previously yielded by frames().
+        """
+        size = len(data)
+        if not size:
+            return
+
+        if self._end + size > len(self._buffer):
+            self._compact()
+            if self._end + size > len(self._buffer):
+                # More unparsed data than we can hold, keep only the newest bytes
+                overflow = self._end + size - len(self._buffer)
+                if overflow >= self._end:
+                    self.discarded_bytes += self._end - self._start
+                    self._start = self._end = 0
+                    data = data[size - len(self._buffer):]
+                    size = len(data)
+                else:
+                    self.discarded_bytes += overflow
+                    self._start = overflow
+                    self._compact()
+
+        self._view[self._end:self._end + size] = data
+        self._end += size
+
+    def _compact(self):
+        """Move unparsed bytes to the front of the buffer (same-size slice copy)."""
+        remaining = self._end - self._start
+        if self._start and remaining:
+            self._buffer[0:remaining] = self._view[self._start:self._end]
+        self._start = 0
+        self._end = remaining
+
+    def _resync(self, start):
+        """Skip to the next header byte at or after start. Returns the new start."""
+        position = self._buffer.find(HEADER_BYTE, start, self._end)
+        if position < 0:
+            position = self._end
+        self.discarded_bytes += position - self._start
+        self._start = position
+        return position
+
+    def frames(self):
+        """
+        Yield the data section (response code + payload) of each complete frame.
+
+        Stops when the buffer holds no more complete frames; call again after the
+        next feed().
+        """
+        buffer = self._buffer
+        view = self._view
+        checksum = self.checksum
+
+        while True:
+            start = self._start
+            if start < self._end and buffer[start] != HEADER_BYTE:
+                start = self._resync(start)
+
+            if self._end - start < HEADER_LENGTH + 1:
+                return
+
+            data_size = buffer[start + 3]
+            if self.data_size is not None and data_size != self.data_size \
+                    and buffer[start + 1] == self.destination:
+                self.bad_frames += 1
+                self._resync(start + 1)
+                continue
+
+            frame_end = start + HEADER_LENGTH + data_size + 1
+            if frame_end > self._end:
+                return
+
+            if checksum(view[start:frame_end - 1]) != buffer[frame_end - 1]:
+                # Corrupt or false header, resync from the next 0x80
+                self.bad_frames += 1
+                self._resync(start + 1)
+                continue
+
+            self._start = frame_end
+
+            if self.destination is not None and buffer[start + 1] != self.destination:
+                self.skipped_frames += 1
+                continue
+            if self.source is not None and buffer[start + 2] != self.source:
+                self.skipped_frames += 1
+                continue
+
+            self.good_frames += 1
+            yield view[start + HEADER_LENGTH:frame_end - 1]
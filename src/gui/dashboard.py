@@ -1,7 +1,8 @@
 """
 pySSM2 Dashboard — aqua/cyan segmented bars, boost arc, peak hold, scanlines.
 
-Reads from a shared `latest_data` dict each frame (populated by the ECU logger).
+Reads the newest values each frame from the sample ring the ECU logger
+publishes in the shared `latest_data` dict.
 All drawing functions and layout are self-contained here.
 """
 
@@ -316,12 +317,12 @@ class Dashboard:
         """Get current value for a gauge from latest_data, default 0."""
         if gauge_name == 'fuel' and self.fuel_avg_count > 0:
             return self.fuel_avg_sum / self.fuel_avg_count
-        cfg = GAUGE_CONFIG[gauge_name]
-        val = self.data.get(cfg['key'], 0)
-        try:
-            return float(val)
-        except (TypeError, ValueError):
-            return 0.0
+        return self._latest(GAUGE_CONFIG[gauge_name]['key'])
+
+    def _latest(self, key):
+        """Newest value of a parameter from the sample ring, 0 while missing."""
+        samples = self.data.get('_samples')
+        return samples.latest(key, 0.0) if samples is not None else 0.0
 
     def _format(self, gauge_name, val):
         """Format a value according to the gauge's decimal places."""
@@ -342,18 +343,8 @@ class Dashboard:
         self.data = latest_data
 
         # Accumulate fuel consumption for journey average (only while moving)
-        speed = latest_data.get('Vehicle Speed', 0)
-        try:
-            speed = float(speed)
-        except (TypeError, ValueError):
-            speed = 0.0
-        if speed > 0:
-            fuel_key = GAUGE_CONFIG['fuel']['key']
-            fuel_val = latest_data.get(fuel_key, 0)
-            try:
-                fuel_val = float(fuel_val)
-            except (TypeError, ValueError):
-                fuel_val = 0.0
+        if self._latest('Vehicle Speed') > 0:
+            fuel_val = self._latest(GAUGE_CONFIG['fuel']['key'])
             if fuel_val > 0:
                 self.fuel_avg_sum += fuel_val
                 self.fuel_avg_count += 1
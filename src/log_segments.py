@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Log files compressed on the fly in independently decodable segments.
+
+A compressed log is the plain log (CSV text or a binary session log) cut into
+segments of a few seconds, each compressed on its own:
+
+    FILE_HEADER         magic, codec name
+    SEGMENT_HEADER      magic, compressed size, uncompressed size, uncompressed offset
+    compressed data     the segment's bytes, gzip / lzma / zstd
+    SEGMENT_HEADER ...
+
+Segments are only cut between whole rows (on the writer's commits), so each one
+decompresses to complete CSV lines or binary records. A power cut loses at most
+the open segment, still in memory, and a reader that finds a torn last segment
+stops before it. Any segment can be read by hopping from header to header,
+without decompressing the ones before.
+
+zstd needs the zstandard package, gzip and lzma are in the standard library.
+
+Usage:
+    logfile = SegmentedWriter(open(path, 'wb'), 'gzip', segment_seconds=5)
+    logfile.write(data)
+    logfile.flush()        # cuts a segment once the open one is old enough
+    logfile.stats()        # compression ratio and CPU time
+
+    for segment in segments(path): ...
+    data = decompress(path)
+
+List a compressed log's segments, or decompress it:
+    python3 log_segments.py 20251024-143022-SubaruLog.csv.ssz [out.csv]
+"""
+
+import gzip
+import io
+import lzma
+import struct
+import time
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional
+    zstandard = None
+
+FILE_MAGIC = b'SSM2SEG1'
+FILE_HEADER = struct.Struct('<8s8s')      # magic, codec name
+SEGMENT_MAGIC = b'SEG1'
+SEGMENT_HEADER = struct.Struct('<4sIIQ')  # magic, compressed size, size, uncompressed offset
+MAX_SEGMENT = 4 << 20                     # Cut a segment at this size even if it is young
+
+
+def _zstd_compress(data):
+    return zstandard.ZstdCompressor(level=3).compress(data)
+
+
+def _zstd_decompress(data):
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+# Codec name -> (compress, decompress)
+CODECS = {
+    'gzip': (lambda data: gzip.compress(data, compresslevel=6), gzip.decompress),
+    'lzma': (lzma.compress, lzma.decompress),
+}
+if zstandard is not None:
+    CODECS['zstd'] = (_zstd_compress, _zstd_decompress)
+
+# What a damaged segment raises when decompressed
+DECOMPRESS_ERRORS = (OSError, EOFError, ValueError, lzma.LZMAError, zlib.error) + (
+    (zstandard.ZstdError,) if zstandard is not None else ())
+
+
+class SegmentedWriter(io.RawIOBase):
+    """
+    Binary file object compressing what is written into segments.
+
+    Writes are buffered in memory; flush() compresses and writes them as one
+    segment once segment_seconds have passed since the segment was opened (or
+    it reached MAX_SEGMENT), close() writes the last one. Wrap it in
+    io.TextIOWrapper for text.
+    """
+
+    def __init__(self, raw, codec='gzip', segment_seconds=5.0):
+        """
+        Args:
+            raw: Binary file to write the compressed log to, closed with this one
+            codec: 'gzip', 'lzma' or 'zstd' (see CODECS)
+            segment_seconds: Shortest segment, in seconds of logging
+        """
+        super().__init__()
+        if codec not in CODECS:
+            raise ValueError(f"Unknown or unavailable compression: {codec}")
+        self.codec = codec
+        self.segment_seconds = segment_seconds
+        self._raw = raw
+        self._compress = CODECS[codec][0]
+        self._pending = []
+        self._pending_size = 0
+        self._opened = time.monotonic()
+
+        # Statistics
+        self.segments = 0
+        self.size = 0             # Uncompressed bytes written out
+        self.compressed_size = 0
+        self.cpu_time = 0.0       # Thread CPU seconds spent compressing
+
+        raw.write(FILE_HEADER.pack(FILE_MAGIC, codec.encode()))
+
+    def writable(self):
+        return True
+
+    def fileno(self):
+        return self._raw.fileno()
+
+    def write(self, data):
+        data = bytes(data)
+        self._pending.append(data)
+        self._pending_size += len(data)
+        return len(data)
+
+    def flush(self):
+        """Cut a segment if the open one is old or big enough."""
+        if self.closed:
+            return
+        if self._pending_size and (self._pending_size >= MAX_SEGMENT or
+                                   time.monotonic() - self._opened >= self.segment_seconds):
+            self._cut()
+
+    def close(self):
+        if not self.closed:
+            if self._pending_size:
+                self._cut()
+            self._raw.close()
+        super().close()
+
+    def _cut(self):
+        data = b''.join(self._pending)
+        started = time.thread_time()
+        compressed = self._compress(data)
+        self.cpu_time += time.thread_time() - started
+        self._raw.write(SEGMENT_HEADER.pack(SEGMENT_MAGIC, len(compressed), len(data), self.size))
+        self._raw.write(compressed)
+        self._raw.flush()
+
+        self.segments += 1
+        self.size += len(data)
+        self.compressed_size += len(compressed)
+        self._pending = []
+        self._pending_size = 0
+        self._opened = time.monotonic()
+
+    def stats(self):
+        """Segments written, compression ratio (uncompressed / compressed) and CPU seconds."""
+        return {
+            'segments': self.segments,
+            'compression_ratio': self.size / self.compressed_size if self.compressed_size else None,
+            'compression_cpu': self.cpu_time,
+        }
+
+
+def is_segmented(path):
+    """True if path is a compressed (segmented) log."""
+    with open(path, 'rb') as logfile:
+        return logfile.read(len(FILE_MAGIC)) == FILE_MAGIC
+
+
+def read_codec(logfile):
+    """Codec name from the file header, leaving logfile at the first segment."""
+    magic, codec = FILE_HEADER.unpack(logfile.read(FILE_HEADER.size))
+    if magic != FILE_MAGIC:
+        raise ValueError(f"{logfile.name} is not a compressed pySSM2 log")
+    return codec.rstrip(b'\0').decode()
+
+
+def segments(path):
+    """
+    Header of every complete segment: dicts with 'position' (of the compressed
+    data in the file), 'compressed_size', 'size' and 'offset' (uncompressed).
+    Stops at a torn or damaged segment.
+    """
+    found = []
+    with open(path, 'rb') as logfile:
+        read_codec(logfile)
+        logfile.seek(0, 2)
+        end = logfile.tell()
+        position = FILE_HEADER.size
+        while position + SEGMENT_HEADER.size <= end:
+            logfile.seek(position)
+            magic, compressed_size, size, offset = SEGMENT_HEADER.unpack(logfile.read(SEGMENT_HEADER.size))
+            position += SEGMENT_HEADER.size
+            if magic != SEGMENT_MAGIC or position + compressed_size > end:
+                break
+            found.append({'position': position, 'compressed_size': compressed_size, 'size': size, 'offset': offset})
+            position += compressed_size
+    return found
+
+
+def read_segment(path, segment, codec=None):
+    """Decompressed bytes of one segment (from segments())."""
+    with open(path, 'rb') as logfile:
+        codec = codec or read_codec(logfile)
+        if codec not in CODECS:
+            raise ValueError(f"{path} needs {codec} support to be read")
+        logfile.seek(segment['position'])
+        return CODECS[codec][1](logfile.read(segment['compressed_size']))
+
+
+def decompress(path, limit=None):
+    """
+    The log's bytes, from all complete segments (or just enough segments for
+    limit bytes). A segment that fails to decompress ends the data.
+    """
+    with open(path, 'rb') as logfile:
+        codec = read_codec(logfile)
+    if codec not in CODECS:
+        raise ValueError(f"{path} needs {codec} support to be read")
+    chunks = []
+    size = 0
+    for segment in segments(path):
+        try:
+            chunks.append(read_segment(path, segment, codec))
+        except DECOMPRESS_ERRORS:
+            break
+        size += len(chunks[-1])
+        if limit is not None and size >= limit:
+            break
+    return b''.join(chunks)
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python3 log_segments.py <compressed log> [output]")
+        sys.exit(1)
+
+    if len(sys.argv) == 3:
+        data = decompress(sys.argv[1])
+        with open(sys.argv[2], 'wb') as output:
+            output.write(data)
+        print(f"{len(data)} bytes written to {sys.argv[2]}")
+        sys.exit(0)
+
+    with open(sys.argv[1], 'rb') as logfile:
+        codec = read_codec(logfile)
+    found = segments(sys.argv[1])
+    size = sum(segment['size'] for segment in found)
+    compressed_size = sum(segment['compressed_size'] for segment in found)
+    print(f"Codec:    {codec}")
+    print(f"Segments: {len(found)}, {size} bytes in {compressed_size} "
+          f"({size / compressed_size if compressed_size else 0:.1f}x)")
+    for index, segment in enumerate(found):
+        print(f"  {index:4d}  offset {segment['offset']:10d}  {segment['size']:8d} -> {segment['compressed_size']:8d} bytes")
@@ -1,9 +1,26 @@
 import asyncio
 import json
 import PySSM2
+from async_transport import AsyncSSM2Transport
+from ecu_cache import ECUInitCache
+from bus_scheduler import BusNode, BusScheduler, ECU_ADDRESS
+from definitions import load_definitions, select_parameters, to_derived, to_parameter
+from derived import DerivedEvaluator, where
+from frame_decoder import FrameDecoder
+from csv_writer import CSVWriter, PARTIAL_SUFFIX, finish_partial
+from binary_log import BinaryLogWriter, describe_channels
+from sample_ring import SampleRing
+from switches import SwitchTable
+from expressions import decoder
+from poll_scheduler import PollScheduler, plan_key
+from request_planner import RequestPlan
+from protocol_trace import ProtocolTrace
+from serial_capture import CaptureRecorder, CaptureReplay, ReplaySerial
+import os
 import time
-import csv
+import signal
 import serial
+import serial.tools.list_ports
 import logging
 from typing import Dict, Any
 
@@ -113,45 +130,53 @@ except ValueError as e:
 # - 'address': ECU memory address (or list of addresses for multi-byte values)
 # - 'name': Human-readable name for logging/display
 # - 'calculation': Function that converts raw byte(s) to final value
+# - 'expr': Alternatively, a logger.xml style conversion in x (e.g. 'x*37/255'),
+#           multi-byte values are big-endian; compiled safely by expressions.py
 # - 'format': Optional format string for output (default: no formatting)
 # - 'unit': Optional unit string for documentation
+# - 'rate': Optional target refresh rate in Hz. Parameters without a rate are
+#           read as fast as the wire allows, the rest are refreshed in the gaps
+#           unless streaming them costs less than interrupting the stream
 # ============================================================================
 
 ECU_PARAMETERS = [
     {
         'address': 0x00001C,
         'name': 'Battery Voltage',
-        'calculation': lambda raw: float(raw[0] * 0.08),
+        'expr': 'x*0.08',
         'format': '.1f',
-        'unit': 'V'
+        'unit': 'V',
+        'rate': 1
     },
     {
         'address': 0x000008,
         'name': 'Coolant Temperature',
-        'calculation': lambda raw: raw[0] - 40,
+        'expr': 'x-40',
         'format': None,
-        'unit': 'C'
+        'unit': 'C',
+        'rate': 0.2
     },
     {
         'address': 0x000046,
         'name': 'Air Fuel Ratio',
-        'calculation': lambda raw: float(raw[0] / 128 * 14.7),
+        'expr': 'x/128*14.7',
         'format': '.2f',
         'unit': 'AFR'
     },
     {
         'address': 0x00000D,
         'name': 'Manifold Absolute Pressure',
-        'calculation': lambda raw: float(raw[0] * 37 / 255),
+        'expr': 'x*37/255',
         'format': '.2f',
         'unit': 'PSI'
     },
     {
         'address': 0x000023,
         'name': 'Atmospheric Pressure',
-        'calculation': lambda raw: float(raw[0] * 37 / 255),
+        'expr': 'x*37/255',
         'format': '.3f',
-        'unit': 'PSI'
+        'unit': 'PSI',
+        'rate': 0.1
     },
     {
         'address': 0x000010,
@@ -163,83 +188,88 @@ ECU_PARAMETERS = [
     {
         'address': [0x000013, 0x000014],  # 16-bit value
         'name': 'Mass Airflow',
-        'calculation': lambda raw: float(((raw[0] << 8) | raw[1]) / 100),
+        'expr': 'x/100',
         'format': '.2f',
         'unit': 'g/s'
     },
     {
         'address': [0x00000E, 0x00000F],  # 16-bit value
         'name': 'Engine Speed',
-        'calculation': lambda raw: float(((raw[0] << 8) | raw[1]) / 4),
+        'expr': 'x/4',
         'format': None,
         'unit': 'RPM'
     },
 ]
 
-# Derived parameters calculated from ECU parameters
+# Transmission control unit parameters, read on the same K-line as the ECU
+# (same fields as ECU_PARAMETERS, addresses are in the TCU's address space).
+# Leave empty to talk to the engine ECU only. Example (check your TCU's
+# logger definition for the address):
+#     {
+#         'address': 0x000010,
+#         'name': 'ATF Temperature',
+#         'calculation': lambda raw: raw[0] - 50,
+#         'format': None,
+#         'unit': 'C',
+#     },
+TCU_PARAMETERS = []
+
+# Switches in the ECU's status bytes ('byte' and 'bit' as in logger.xml <switch>).
+# Every status byte is read once per sample however many of its switches are
+# listed, and they are logged packed into 'Switches' columns ('Switches 2'... once
+# a column's 53 bits are used), the legend is logged at startup. Auto-selection
+# adds every supported switch.
+# Example:
+#     {'name': 'Neutral Position Switch', 'byte': 0x000062, 'bit': 7},
+#     {'name': 'Clutch Switch', 'byte': 0x000121, 'bit': 7},
+SWITCHES = []
+
+
+def compile_parameters(parameters):
+    """Give every parameter declared with an 'expr' its compiled 'calculation'."""
+    for param in parameters:
+        if 'calculation' not in param:
+            length = len(param['address']) if isinstance(param['address'], list) else 1
+            param['calculation'] = decoder(param['expr'], length, param.get('storagetype'))
+    return parameters
+
+
+compile_parameters(ECU_PARAMETERS)
+compile_parameters(TCU_PARAMETERS)
+
+# Derived parameters calculated from ECU parameters (and other derived ones).
+# 'depends' lists the parameters the calculation reads: it is only recomputed
+# when one of them changes, and an error only invalidates this parameter.
 DERIVED_PARAMETERS = [
     {
         'name': 'Boost Pressure',
+        'depends': ['Manifold Absolute Pressure', 'Atmospheric Pressure'],
         'calculation': lambda data: data['Manifold Absolute Pressure'] - data['Atmospheric Pressure'],
         'format': '.1f',
         'unit': 'PSI'
     },
     {
         'name': 'Fuel Consumption',
+        'depends': ['Mass Airflow', 'Air Fuel Ratio', 'Vehicle Speed'],
         'calculation': lambda data: (
-            float((1) * ((data['Mass Airflow'] / data['Air Fuel Ratio']) / 761) * 100)
-            if data['Vehicle Speed'] == 0
-            else float((3600 / data['Vehicle Speed']) * ((data['Mass Airflow'] / data['Air Fuel Ratio']) / 761) * 100)
+            (3600 / where(data['Vehicle Speed'] == 0, 3600, data['Vehicle Speed']))
+            * ((data['Mass Airflow'] / data['Air Fuel Ratio']) / 761) * 100
         ),
         'format': '.1f',
         'unit': 'L/100km'
     },
     {
         'name': 'Engine Load',
-        'calculation': lambda data: (
-            0 if data['Engine Speed'] == 0
-            else (data['Mass Airflow'] * 60) / data['Engine Speed']
+        'depends': ['Engine Speed', 'Mass Airflow'],
+        'calculation': lambda data: where(
+            data['Engine Speed'] == 0, 0,
+            (data['Mass Airflow'] * 60) / where(data['Engine Speed'] == 0, 1, data['Engine Speed'])
         ),
         'format': None,
         'unit': None
     },
 ]
 
-# Helper function to extract raw bytes from response
-def extract_raw_bytes(response, start_index=5):
-    """
-    Extract and parse raw bytes from ECU response based on parameter configuration.
-    Returns dict of parameter names to their calculated (unformatted) values.
-    """
-    raw_data = {}
-    response_index = start_index
-
-    for param in ECU_PARAMETERS:
-        # Extract raw bytes for this parameter
-        if isinstance(param['address'], list):
-            # Multi-byte value
-            num_bytes = len(param['address'])
-            raw_bytes = response[response_index:response_index + num_bytes]
-            response_index += num_bytes
-        else:
-            # Single byte value
-            raw_bytes = [response[response_index]]
-            response_index += 1
-
-        # Calculate value using the parameter's calculation function
-        raw_data[param['name']] = param['calculation'](raw_bytes)
-
-    return raw_data
-
-
-def format_value(value, format_string):
-    """
-    Format a value according to format string, or return as-is if no format specified.
-    """
-    if format_string:
-        return f"{value:{format_string}}"
-    return value
-
 
 def build_address_list():
     """
@@ -255,106 +285,397 @@ def build_address_list():
     return addresses
 
 
-# SSM2 Handler to log data from the ECU
-async def start_ssm2_logger(csv_queue: asyncio.Queue, latest_data: Dict[str, Any]):
+def dump_protocol_trace(trace, reason):
     """
-    Read data from ECU and publish to both CSV queue and latest_data dict.
-
-    Args:
-        csv_queue: Queue for CSV writer (preserves order, never drops data)
-        latest_data: Shared dict for display (always latest, can skip old data)
+    Dump the protocol trace ring buffer (if tracing is enabled) to a file.
+    Returns the file path, or None if tracing is off or the dump failed.
     """
-    logger.info("Starting SSM2 logger...")
+    if trace is None or not len(trace):
+        return None
+    try:
+        path = trace.dump(config.get_trace_file_path())
+        logger.info(f"Protocol trace dumped ({reason}): {path}")
+        return path
+    except OSError as e:
+        logger.error(f"Failed to dump protocol trace: {e}")
+        return None
+
 
+def load_parameter_definitions():
+    """
+    Load the RomRaider logger.xml definitions through their compiled cache.
+    Returns None (after logging why) if they are not available.
+    """
+    if not os.path.exists(config.DEFINITIONS_FILE):
+        logger.warning(f"Parameter definitions not found: {config.DEFINITIONS_FILE}")
+        return None
     try:
-        # Auto-scan for K-Line adapter (run in executor so display keeps updating)
-        logger.info("Scanning for K-Line adapter...")
-        loop = asyncio.get_event_loop()
-        port = await loop.run_in_executor(
-            None,
-            lambda: PySSM2.PySSM2.scan_for_adapter(
-                baudrate=config.SERIAL_BAUDRATE,
+        started = time.monotonic()
+        definitions = load_definitions(config.DEFINITIONS_FILE, config.DEFINITIONS_CACHE_FILE)
+        logger.info(f"Loaded parameter definitions in {time.monotonic() - started:.2f} s "
+                    f"({len(definitions.parameters)} parameters, {definitions.ecu_count} ECUs)")
+        return definitions
+    except Exception as e:
+        logger.error(f"Failed to load parameter definitions: {e}", exc_info=config.DEBUG_MODE)
+        return None
+
+
+def auto_select_parameters(definitions, ecu_info):
+    """
+    Extend SWITCHES with the switches this ECU supports, ECU_PARAMETERS with
+    the parameters it supports (capability bits and logger.xml), as many as
+    still stream at config.AUTO_SELECT_RATE, and DERIVED_PARAMETERS with the
+    logger.xml calculated parameters they allow.
+    Configured parameters at a standard address the ECU does not support are
+    only reported, derived parameters may depend on them.
+    Returns the added parameters and switches.
+    """
+    supported = definitions.supported(ecu_info['ecu_id'], ecu_info['raw_capability_bytes'])
+    switch_names = {switch['name'] for switch in SWITCHES}
+    switches = [switch for switch in definitions.supported_switches(ecu_info['raw_capability_bytes'])
+                if switch['name'] not in switch_names]
+    SWITCHES.extend(switches)
+
+    supported_addresses = {param['address'] for param in supported}
+    standard_addresses = {param['address'] for param in definitions.parameters if param['address'] is not None}
+    for param in ECU_PARAMETERS:
+        address = param['address'][0] if isinstance(param['address'], list) else param['address']
+        if address in standard_addresses and address not in supported_addresses:
+            logger.warning(f"{param['name']} (0x{address:06X}) is not supported by ECU {ecu_info['ecu_id_hex']}")
+
+    names = {param['name'] for param in ECU_PARAMETERS}
+    status_bytes = sorted({switch['byte'] for switch in SWITCHES})
+    chosen = select_parameters(
+        [param for param in supported if param['name'] not in names],
+        config.AUTO_SELECT_RATE, build_address_list() + status_bytes,
+        config.SERIAL_BAUDRATE, config.SERIAL_RESPONSE_DELAY,
+    )
+    added = [to_parameter(param) for param in chosen]
+    ECU_PARAMETERS.extend(added)
+
+    # Configured parameters stand in for the standard parameter read at the same address
+    by_address = {(param['address'], param['length']): param['id']
+                  for param in definitions.parameters if param['address'] is not None}
+    readable = []
+    for param in ECU_PARAMETERS:
+        addresses = param['address'] if isinstance(param['address'], list) else [param['address']]
+        parameter_id = param.get('id') or by_address.get((addresses[0], len(addresses)))
+        if parameter_id is not None:
+            readable.append(dict(param, id=parameter_id))
+
+    names.update(param['name'] for param in DERIVED_PARAMETERS)
+    for definition in definitions.parameters:
+        if definition['depends'] and definition['name'] not in names:
+            derived = to_derived(definition, readable)
+            if derived is not None:
+                DERIVED_PARAMETERS.append(derived)
+                added.append(derived)
+    return added + switches
+
+
+async def open_ssm2(loop, latest_data: Dict[str, Any]):
+    """
+    Open the replayed capture, or scan for a K-Line adapter and connect to it.
+    Blocks (without blocking the event loop) until an adapter answers.
+    """
+    if config.SERIAL_REPLAY_FILE:
+        # Replay a recorded drive instead of talking to an adapter
+        logger.info(f"Replaying serial capture {config.SERIAL_REPLAY_FILE}")
+        return PySSM2.PySSM2(
+            config.SERIAL_REPLAY_FILE,
+            baudrate=config.SERIAL_BAUDRATE,
+            timeout=config.SERIAL_TIMEOUT,
+            ser=ReplaySerial(
+                config.SERIAL_REPLAY_FILE,
                 timeout=config.SERIAL_TIMEOUT,
-                status=latest_data,
+                realtime=config.SERIAL_REPLAY_REALTIME,
             ),
         )
-        logger.info(f"K-Line adapter found on {port}")
 
-        # Initialize PySSM2
-        logger.info(f"Connecting to ECU on {port} at {config.SERIAL_BAUDRATE} baud")
-        SSM2 = PySSM2.PySSM2(
-            port,
+    # Auto-scan for K-Line adapter (run in executor so display keeps updating)
+    logger.info("Scanning for K-Line adapter...")
+    port = await loop.run_in_executor(
+        None,
+        lambda: PySSM2.PySSM2.scan_for_adapter(
             baudrate=config.SERIAL_BAUDRATE,
-            timeout=config.SERIAL_TIMEOUT
-        )
+            timeout=config.SERIAL_TIMEOUT,
+            scan_interval=config.RECONNECT_POLL_INTERVAL,
+            status=latest_data,
+            extra_ports=[config.SERIAL_PORT],
+            cache_file=config.LAST_ADAPTER_FILE,
+        ),
+    )
+    logger.info(f"K-Line adapter found on {port}")
+
+    # Initialize PySSM2
+    logger.info(f"Connecting to ECU on {port} at {config.SERIAL_BAUDRATE} baud")
+    SSM2 = PySSM2.PySSM2(
+        port,
+        baudrate=config.SERIAL_BAUDRATE,
+        timeout=config.SERIAL_TIMEOUT
+    )
 
-        # Initialize the ECU
-        SSM2.ecu_init()
-        logger.info("ECU initialized successfully")
+    # Record every byte on the wire for offline replay and benchmarking
+    if config.SERIAL_CAPTURE:
+        capture_path = config.get_capture_file_path()
+        SSM2.ser = CaptureRecorder(SSM2.ser, capture_path)
+        logger.info(f"Recording serial capture: {capture_path}")
 
-        # Build address list from configuration
-        addresses = build_address_list()
-        logger.debug(f"Monitoring {len(ECU_PARAMETERS)} ECU parameters")
+    return SSM2
 
-        # Start continuous reading
-        SSM2.read_single_address_continuously(addresses)
 
-        while True:
-            try:
-                # We request the length of our address list and then add 6 for heading and checksum bytes
-                response = SSM2.receive_packet(len(addresses) + 6)
+async def wait_for_adapter(loop, port, latest_data: Dict[str, Any]):
+    """
+    Wait for a lost USB adapter to come back.
 
-                # Parse response once to get raw calculated values
-                raw_data = extract_raw_bytes(response, start_index=5)
+    Polls the device node and the serial port list: returns once the node has
+    gone and reappeared, or a new serial port shows up (the adapter re-enumerated
+    under another name, or a different adapter was plugged in). If the node never
+    disappears (the port errored but the device is still there) it returns after
+    a second so the scan can probe it again.
+    """
+    latest_data['_status'] = {'title': 'RECONNECTING', 'message': f"Adapter {port} lost, waiting..."}
+    list_ports = lambda: {info.device for info in serial.tools.list_ports.comports()}
+    known = await loop.run_in_executor(None, list_ports)
+    seen_gone = False
+    deadline = time.monotonic() + 1.0
+
+    while True:
+        await asyncio.sleep(config.RECONNECT_POLL_INTERVAL)
+        exists = os.path.exists(port)
+        if not exists:
+            seen_gone = True
+        elif seen_gone or time.monotonic() >= deadline:
+            return
+
+        ports = await loop.run_in_executor(None, list_ports)
+        if ports - known:
+            return
+        # Forget removed ports, so a re-enumerated adapter counts as new
+        known = ports
 
-                # Build logdata with formatted values
-                logdata = {'Time': time.time()}
 
-                # Add ECU parameters with formatting
-                for param in ECU_PARAMETERS:
-                    value = raw_data[param['name']]
-                    logdata[param['name']] = format_value(value, param['format'])
+# SSM2 Handler to log data from the ECU
+async def start_ssm2_logger(latest_data: Dict[str, Any]):
+    """
+    Read data from ECU and append it to the sample ring published in latest_data.
 
-                # Calculate and add derived parameters
-                for derived in DERIVED_PARAMETERS:
-                    value = derived['calculation'](raw_data)
-                    logdata[derived['name']] = format_value(value, derived['format'])
+    Runs as a reconnect state machine: connect -> initialize -> stream, and when
+    the adapter is unplugged (serial port lost) wait for it to come back and start
+    over. The display and CSV tasks keep running throughout, and the recovery time
+    is logged and published in latest_data['_link'].
 
-                # Publish to CSV queue (preserves all data in order)
-                if config.ENABLE_CSV_LOGGING:
-                    try:
-                        csv_queue.put_nowait(logdata)
-                    except asyncio.QueueFull:
-                        logger.warning("CSV queue full, dropping oldest data")
-                        # Remove old data and add new
-                        try:
-                            csv_queue.get_nowait()
-                            csv_queue.put_nowait(logdata)
-                        except asyncio.QueueEmpty:
-                            pass
-
-                # Update latest data for display (always latest, no queue)
-                latest_data.clear()
-                latest_data.update(logdata)
-
-            except (TimeoutError, IndexError) as e:
-                logger.error(f"Error reading ECU data: {e}")
-                await asyncio.sleep(1)  # Wait before retrying
-                continue
-            except ZeroDivisionError as e:
-                logger.warning(f"Math error in calculations (likely zero division): {e}")
-                # Continue with next iteration, don't publish invalid data
-                continue
-            except Exception as e:
-                logger.error(f"Unexpected error processing ECU data: {e}", exc_info=config.DEBUG_MODE)
-                await asyncio.sleep(1)
+    Args:
+        latest_data: Shared dict for display and CSV writer: '_samples' holds the
+                     SampleRing of every sample (columns in build_csv_headers()
+                     order), the other keys link and unit status
+    """
+    logger.info("Starting SSM2 logger...")
+    started = time.monotonic()
+    first_sample = True
+    parameters_ready = False
+    samples = None
+
+    # Link statistics, published with every sample
+    link = {'connected': False, 'reconnects': 0, 'last_recovery': None, 'total_downtime': 0.0}
+    lost_at = None
+
+    try:
+        loop = asyncio.get_event_loop()
+        ecu_cache = ECUInitCache(config.ECU_CACHE_FILE)
+
+        # Raw TX/RX trace, dumped on SIGUSR1 or when reading fails.
+        # One ring buffer for the whole run, so a dump shows the traffic before a port loss.
+        trace = None
+        last_trace_dump = 0.0
+        if config.ENABLE_PROTOCOL_TRACE:
+            trace = ProtocolTrace(slots=config.PROTOCOL_TRACE_SLOTS)
+            try:
+                loop.add_signal_handler(signal.SIGUSR1, dump_protocol_trace, trace, "SIGUSR1")
+            except (NotImplementedError, AttributeError):
+                logger.warning("SIGUSR1 not available, protocol trace is only dumped on errors")
+            logger.info(f"Protocol trace enabled ({config.PROTOCOL_TRACE_SLOTS} slots)")
+
+        # Compile (first boot) or map the definitions cache while scanning for the adapter
+        definitions_loading = loop.run_in_executor(None, load_parameter_definitions)
+
+        while True:
+            try:
+                SSM2 = await open_ssm2(loop, latest_data)
+            except serial.SerialException as e:
+                # The port went away again between the scan and opening it
+                logger.error(f"Could not open adapter: {e}")
+                await asyncio.sleep(config.RECONNECT_POLL_INTERVAL)
                 continue
+            SSM2.trace = trace
 
-            await asyncio.sleep(config.LOGGER_SLEEP_INTERVAL)
+            try:
+                # Serial waits happen on the event loop via fd readiness, blocking calls in the executor
+                transport = AsyncSSM2Transport(SSM2, loop)
+
+                # Initialize the ECU, a warm restart only checks the cached ECU ID
+                ecu_info = ecu_cache.last()
+                if ecu_info is not None and await transport.run(SSM2.verify_ecu_id, ecu_info['ecu_id']):
+                    logger.info(f"ECU {ecu_info['ecu_id_hex']} matches the init cache, skipping full init")
+                else:
+                    ecu_info = await transport.run(SSM2.ecu_init)
+                    ecu_cache.save(ecu_info)
+                    logger.info("ECU initialized successfully")
+
+                definitions = await definitions_loading
+                if definitions is not None:
+                    ecu_definitions = definitions.for_ecu(ecu_info['ecu_id'])
+                    logger.info(f"{len(ecu_definitions)} extended parameters defined for ECU {ecu_info['ecu_id_hex']}")
+
+                # Once per run: the CSV columns follow the parameter list
+                if not parameters_ready:
+                    if config.AUTO_SELECT_PARAMETERS and definitions is not None:
+                        added = auto_select_parameters(definitions, ecu_info)
+                        logger.info(f"Auto-selected {len(added)} supported parameters and switches for "
+                                    f"{config.AUTO_SELECT_RATE} samples/s: "
+                                    f"{', '.join(param['name'] for param in added) or 'none'}")
+                    if SWITCHES:
+                        switch_table = SwitchTable(SWITCHES)
+                        ECU_PARAMETERS.extend(switch_table.parameters())
+                        logger.info(f"{len(switch_table)} switches in {len(switch_table.addresses)} "
+                                    f"status bytes, logged in {', '.join(switch_table.columns)}")
+                        for column, legend in switch_table.legend().items():
+                            logger.info(f"{column} column, bit: {'; '.join(legend)}")
+                    parameters_ready = True
+
+                # One ring for the whole run, readers keep their positions across reconnects
+                if samples is None:
+                    samples = SampleRing(build_csv_headers()[1:], config.SAMPLE_BUFFER_ROWS)
+                    latest_data['_samples'] = samples
+                    latest_data['_ecu_id'] = ecu_info['ecu_id_hex']
+
+                logger.debug(f"Monitoring {len(ECU_PARAMETERS)} ECU parameters ({len(build_address_list())} addresses)")
+                key = plan_key(ECU_PARAMETERS, config.SERIAL_BAUDRATE, config.SERIAL_RESPONSE_DELAY)
+                # Decoders compiled from the final parameter lists, one struct unpack per frame
+                ecu_decoder = FrameDecoder(ECU_PARAMETERS)
+                tcu_decoder = FrameDecoder(TCU_PARAMETERS)
+                derived = DerivedEvaluator(DERIVED_PARAMETERS)
+                reported_invalid = set()
+                input_names = ecu_decoder.names + tcu_decoder.names
+                derived_names = [param['name'] for param in DERIVED_PARAMETERS]
+                no_tcu_values = (None,) * len(tcu_decoder.names)
+
+                # Fast channels stream continuously, slow channels are refreshed in the gaps
+                cached_plan = ecu_cache.plan(ecu_info['ecu_id'], key)
+                scheduler = PollScheduler(
+                    ECU_PARAMETERS, config.SERIAL_BAUDRATE, config.SERIAL_RESPONSE_DELAY,
+                    fast_plan=RequestPlan.from_dict(cached_plan, config.SERIAL_BAUDRATE, config.SERIAL_RESPONSE_DELAY)
+                    if cached_plan else None,
+                )
+                ecu_cache.save_plan(ecu_info['ecu_id'], key, scheduler.fast_plan.to_dict())
+
+                # The TCU shares the line, each unit streams in turn for its slice
+                nodes = [BusNode('ECU', ECU_ADDRESS, scheduler, config.ECU_SLICE_TIME, ecu_info)]
+                if TCU_PARAMETERS:
+                    nodes.append(BusNode(
+                        'TCU', config.TCU_ADDRESS,
+                        PollScheduler(TCU_PARAMETERS, config.SERIAL_BAUDRATE, config.SERIAL_RESPONSE_DELAY),
+                        config.TCU_SLICE_TIME,
+                    ))
+                if config.SERIAL_REPLAY_FILE:
+                    # A replay cannot answer new requests, the recorded replies go straight to the buffers
+                    bus = CaptureReplay(nodes, config.SERIAL_REPLAY_FILE, realtime=config.SERIAL_REPLAY_REALTIME)
+                else:
+                    bus = BusScheduler(nodes)
+                await bus.initialize(transport)
+                tcu = nodes[1] if len(nodes) > 1 and nodes[1].enabled else None
+                if first_sample:
+                    for line in bus.describe():
+                        logger.info(line)
+                last_bus_report = time.monotonic()
+                link['connected'] = True
+
+                while True:
+                    try:
+                        # Sample from whichever unit holds the line, the others keep their last values
+                        timestamp, node, values = await bus.next_sample(transport)
+
+                        # Decode the buffers (last-known byte per address in
+                        # build_address_list() order) into calculated values
+                        ecu_values = ecu_decoder.decode(scheduler.values)
+                        tcu_values = tcu_decoder.decode(tcu.scheduler.values) if tcu is not None else no_tcu_values
+
+                        # Recompute the derived parameters whose inputs changed,
+                        # a failing calculation only blanks its own column
+                        values = derived.evaluate(dict(zip(input_names, ecu_values + tcu_values)))
+                        if derived.invalid.keys() != reported_invalid:
+                            for name in derived.invalid.keys() - reported_invalid:
+                                logger.warning(f"Derived parameter {name} invalid: {derived.invalid[name]}")
+                            reported_invalid = set(derived.invalid)
+
+                        # The sample goes into the ring as numbers, in build_csv_headers() order;
+                        # the display and the CSV writer read it from there
+                        samples.append(timestamp, ecu_values + tcu_values + tuple(values[name] for name in derived_names))
+                        latest_data['_ages'] = bus.ages()
+                        latest_data['_link'] = link
+
+                        # Achieved against planned rates, and switching overhead for tuning the slice lengths
+                        if time.monotonic() - last_bus_report >= 60:
+                            for name, stats in bus.stats().items():
+                                message = (f"{name}: {stats['samples_per_second']:.1f} samples/s, "
+                                           f"{stats['planned_rate']:.1f} planned")
+                                if tcu is not None:
+                                    message += f", {stats['switch_overhead'] * 1000:.0f} ms per switch"
+                                logger.info(message)
+                            last_bus_report = time.monotonic()
+
+                        if first_sample:
+                            logger.info(f"Time to first sample: {time.monotonic() - started:.2f} s")
+                            first_sample = False
+                        if lost_at is not None:
+                            recovery = time.monotonic() - lost_at
+                            link['reconnects'] += 1
+                            link['last_recovery'] = recovery
+                            link['total_downtime'] += recovery
+                            logger.info(f"Adapter recovered in {recovery:.2f} s "
+                                        f"({link['reconnects']} reconnect(s), {link['total_downtime']:.1f} s down in total)")
+                            lost_at = None
+
+                    except (TimeoutError, IndexError) as e:
+                        logger.error(f"Error reading ECU data: {e} (frames: {SSM2.parser.stats()})")
+                        # At most one dump a minute while the ECU stays silent
+                        if time.monotonic() - last_trace_dump > 60:
+                            dump_protocol_trace(trace, "read error")
+                            last_trace_dump = time.monotonic()
+                        await asyncio.sleep(1)  # Wait before retrying
+                        continue
+                    except (serial.SerialException, OSError):
+                        # Port lost (or end of a replayed capture), handled below
+                        raise
+                    except ZeroDivisionError as e:
+                        logger.warning(f"Math error in calculations (likely zero division): {e}")
+                        # Continue with next iteration, don't publish invalid data
+                        continue
+                    except Exception as e:
+                        logger.error(f"Unexpected error processing ECU data: {e}", exc_info=config.DEBUG_MODE)
+                        await asyncio.sleep(1)
+                        continue
+
+                    await asyncio.sleep(config.LOGGER_SLEEP_INTERVAL)
+
+            except (serial.SerialException, OSError) as e:
+                if config.SERIAL_REPLAY_FILE:
+                    logger.info(f"Replay finished: {e}")
+                    return
+                if lost_at is None:
+                    lost_at = time.monotonic()
+                link['connected'] = False
+                latest_data['_link'] = link
+                logger.error(f"Serial port {SSM2.port} lost: {e}")
+                dump_protocol_trace(trace, "port lost")
+            finally:
+                try:
+                    SSM2.close()
+                except Exception:
+                    pass
+
+            await wait_for_adapter(loop, SSM2.port, latest_data)
 
-    except serial.SerialException as e:
-        logger.critical(f"Serial port error: {e}")
-        logger.critical(f"Check that {config.SERIAL_PORT} exists and is accessible.")
     except Exception as e:
         logger.critical(f"Fatal error in SSM2 logger: {e}", exc_info=True)
 
@@ -365,62 +686,121 @@ def build_csv_headers():
     """
     headers = ['Time']
     headers.extend([param['name'] for param in ECU_PARAMETERS])
+    headers.extend([param['name'] for param in TCU_PARAMETERS])
     headers.extend([param['name'] for param in DERIVED_PARAMETERS])
     return headers
 
 
+def build_csv_formats():
+    """
+    Format string of every CSV column, in build_csv_headers() order.
+    """
+    formats = [None]
+    formats.extend([param.get('format') for param in ECU_PARAMETERS])
+    formats.extend([param.get('format') for param in TCU_PARAMETERS])
+    formats.extend([param.get('format') for param in DERIVED_PARAMETERS])
+    return formats
+
+
+def recover_partial_logs():
+    """Finish the log files left half-written (.part) by a crash or power cut."""
+    for directory, _, filenames in os.walk(config.LOG_DIRECTORY):
+        for filename in filenames:
+            if filename.endswith(PARTIAL_SUFFIX):
+                try:
+                    logger.info(f"Recovered unfinished log {finish_partial(os.path.join(directory, filename))}")
+                except OSError as e:
+                    logger.warning(f"Could not recover unfinished log {filename}: {e}")
+
+
 # Write the data to the CSV File
-async def write_to_csv(csv_queue: asyncio.Queue):
+async def write_to_csv(latest_data: Dict[str, Any]):
     """
-    Read data from queue and write to CSV file.
-    Queue ensures all data is preserved in correct time order.
+    Write the samples of the sample ring to the CSV file (or binary log, with
+    LOG_FORMAT 'binary').
+    A writer thread formats and commits them in batches, keeping file I/O
+    off the event loop; this task starts it, reports its errors and publishes
+    its statistics in latest_data['_csv']. The writer rotates to a new file by
+    size, age and at midnight (config LOG_ROTATE_*).
 
     Args:
-        csv_queue: Async queue to consume log data from (FIFO order)
+        latest_data: Shared dict the logger publishes its SampleRing in ('_samples')
     """
     if not config.ENABLE_CSV_LOGGING:
         logger.info("CSV logging disabled in configuration")
         return
 
+    # Walking the whole log tree and trimming files would stall the display
+    await asyncio.get_event_loop().run_in_executor(None, recover_partial_logs)
+
     log_file_path = config.get_log_file_path()
     logger.info(f"Starting CSV logger: {log_file_path}")
 
+    writer = None
     try:
-        # Use context manager to ensure file is properly closed
-        with open(log_file_path, 'w', newline='') as logfile:
-            # Build CSV headers from configuration
-            logfileheaders = build_csv_headers()
-
-            lf = csv.DictWriter(logfile, fieldnames=logfileheaders)
-            lf.writeheader()
-
-            last_data = None
-            while True:
-                try:
-                    # Wait for data from queue with timeout
-                    # Queue preserves order (FIFO) so CSV is always chronological
-                    data = await asyncio.wait_for(csv_queue.get(), timeout=1.0)
-
-                    # Only write if data has changed
-                    if data != last_data:
-                        try:
-                            lf.writerow(data)
-                            logfile.flush()  # Ensure data is written immediately
-                            last_data = data
-                        except (ValueError, KeyError) as e:
-                            logger.error(f"Error writing CSV row: {e}")
-
-                except asyncio.TimeoutError:
-                    # No data received, continue waiting
-                    pass
-
-                await asyncio.sleep(config.CSV_WRITER_SLEEP_INTERVAL)
+        # The parameter list is final once the ECU has been identified (auto-selection),
+        # so the file and its headers are created with the first sample
+        while latest_data.get('_samples') is None or not latest_data['_samples'].count:
+            await asyncio.sleep(0.1)
+
+        rotate_bytes = int(config.LOG_ROTATE_SIZE_MB * 1024 * 1024)
+        commit_policy = {
+            'commit_rows': config.CSV_COMMIT_ROWS,
+            'commit_interval': config.CSV_COMMIT_INTERVAL,
+            'fsync_interval': config.CSV_FSYNC_INTERVAL,
+            'compression': None if config.LOG_COMPRESSION == 'none' else config.LOG_COMPRESSION,
+            'segment_seconds': config.LOG_SEGMENT_SECONDS,
+            'path_factory': config.get_log_file_path,
+            'rotate_bytes': rotate_bytes,
+            'rotate_seconds': config.LOG_ROTATE_HOURS * 3600,
+            'rotate_midnight': config.LOG_ROTATE_MIDNIGHT,
+            'preallocate': rotate_bytes if config.LOG_PREALLOCATE else 0,
+        }
+        if config.LOG_FORMAT == 'binary':
+            writer = BinaryLogWriter(
+                log_file_path, describe_channels(ECU_PARAMETERS + TCU_PARAMETERS, DERIVED_PARAMETERS),
+                latest_data['_samples'], ecu_id=latest_data.get('_ecu_id'), **commit_policy,
+            )
+        else:
+            writer = CSVWriter(
+                log_file_path, build_csv_headers(), build_csv_formats(), latest_data['_samples'],
+                **commit_policy,
+            )
+        writer.start()
+
+        dropped = 0
+        files = 1
+        last_report = time.monotonic()
+        while writer.error is None and writer.running:
+            await asyncio.sleep(1)
+            stats = writer.stats()
+            latest_data['_csv'] = stats
+            if stats['dropped'] > dropped:
+                logger.warning(f"CSV writer fell behind, {stats['dropped'] - dropped} samples dropped")
+                dropped = stats['dropped']
+            if stats['files'] > files:
+                logger.info(f"Log rotated, now writing {stats['path']}")
+                files = stats['files']
+            if time.monotonic() - last_report >= 60:
+                logger.info(f"CSV: {stats['rows']} rows in {stats['commits']} commits, "
+                            f"{stats['queue_depth']} samples waiting, "
+                            f"{stats['max_commit_latency'] * 1000:.1f} ms longest commit")
+                if stats.get('compression_ratio'):
+                    logger.info(f"CSV: {stats['compression_ratio']:.1f}x compression in {stats['segments']} "
+                                f"segments, {stats['compression_cpu']:.2f} s CPU")
+                last_report = time.monotonic()
+        logger.error(f"Error writing CSV file {writer.path}: {writer.error or 'writer thread stopped'}",
+                     exc_info=writer.error if config.DEBUG_MODE else None)
 
     except IOError as e:
         logger.error(f"Error opening CSV file {log_file_path}: {e}")
         logger.error(f"CSV logging disabled. Check that {config.LOG_DIRECTORY} exists.")
     except Exception as e:
         logger.error(f"Unexpected error in CSV writer: {e}", exc_info=config.DEBUG_MODE)
+    finally:
+        if writer is not None:
+            # Commits the samples still waiting
+            writer.stop()
 
 
 # Main function to run all services concurrently
@@ -429,17 +809,15 @@ async def main():
     Main entry point - starts all async tasks.
 
     Data flow:
-    - CSV queue: FIFO queue, preserves all data in order for accurate logging
-    - latest_data dict: Shared dict, always has newest data for live display
+    - Sample ring: fixed-size columnar buffer of every sample, the display reads
+      the newest values and the CSV writer all samples in order
+    - latest_data dict: Shared dict publishing the ring and the link status
     """
     logger.info("=" * 70)
     logger.info("pySSM2 Logger Starting")
     logger.info("=" * 70)
 
-    # Create CSV queue (FIFO - preserves order, never drops data unless full)
-    csv_queue = asyncio.Queue(maxsize=1000)
-
-    # Create shared dict for latest data (display always gets newest, skips old)
+    # Create shared dict for the sample ring and status (display always gets newest, skips old)
     latest_data: Dict[str, Any] = {}
 
     # Create tasks for all services
@@ -451,13 +829,13 @@ async def main():
             fullscreen=config.DISPLAY_FULLSCREEN,
             target_fps=config.DISPLAY_FPS,
         ), name="Display"),
-        asyncio.create_task(start_ssm2_logger(csv_queue, latest_data), name="SSM2 Logger"),
-        asyncio.create_task(write_to_csv(csv_queue), name="CSV Writer"),
+        asyncio.create_task(start_ssm2_logger(latest_data), name="SSM2 Logger"),
+        asyncio.create_task(write_to_csv(latest_data), name="CSV Writer"),
     ]
 
     logger.info(f"Started {len(tasks)} services")
     logger.info("Display: pygame dashboard")
-    logger.info("CSV: Queue-based (preserves order)")
+    logger.info(f"CSV: writer thread, commits every {config.CSV_COMMIT_ROWS} samples or {config.CSV_COMMIT_INTERVAL} s")
 
     try:
         # Run all tasks concurrently
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Resumable RAM/ROM dumps over SSM2 0xA0 block reads.
+
+The address range is split into the largest blocks one 0xA0 reply can carry
+(254 bytes). Requests go out back to back: the streaming frame parser hands
+over each reply as soon as its last byte arrives and its checksum is good, so
+no time is lost waiting for read timeouts. The K-line is half duplex and the
+ECU answers one request at a time, so this is as close to pipelining as the
+protocol allows. Blocks that fail (timeout, bad checksum, wrong reply) are
+retried in later passes, and only those.
+
+Data is written through mmap into a sparse file the size of the range. A
+companion '<output>.progress' file keeps one byte per block (1 = done), also
+through mmap, so an interrupted dump (Ctrl+C, lost adapter, flat battery)
+resumes where it stopped when run again with the same arguments. Blocks are
+only marked done in checkpoints, every CHECKPOINT_INTERVAL seconds, once the
+data flush covering them has returned: the kernel may write the progress page
+back before the data pages, and a block marked done too early would resume
+as zeros.
+
+Usage:
+    python3 memory_dump.py --start 0xFF0000 --length 0x8000 ram.bin
+    python3 memory_dump.py --port /dev/ttyUSB0 --start 0 --length 0x80000 rom.bin
+"""
+
+import mmap
+import os
+import struct
+import time
+
+import serial
+
+from request_planner import BITS_PER_BYTE, MAX_A0_BYTES, RESPONSE_DELAY, ReadRequest
+
+PROGRESS_MAGIC = b'SSM2DMP1'
+PROGRESS_HEADER = struct.Struct('<8sIII')   # magic, start address, length, block size
+BLOCK_PENDING = 0
+BLOCK_DONE = 1
+CHECKPOINT_INTERVAL = 2.0   # Seconds between progress checkpoints
+
+
+def split_range(start, length, block_size=MAX_A0_BYTES):
+    """Split an address range into (address, byte count) blocks of at most block_size."""
+    return [(address, min(block_size, start + length - address))
+            for address in range(start, start + length, block_size)]
+
+
+def theoretical_rate(block_size=MAX_A0_BYTES, baudrate=4800, response_delay=RESPONSE_DELAY):
+    """Best-case dump speed in bytes/s: full blocks back to back, no retries."""
+    request = ReadRequest(0xA0, start=0, count=block_size)
+    seconds = (request.request_length + request.response_length) * BITS_PER_BYTE / baudrate + response_delay
+    return block_size / seconds
+
+
+class MemoryDump:
+    """
+    Dump an ECU address range into a file, resuming any earlier partial dump.
+
+    Usage:
+        with MemoryDump('ram.bin', start=0xFF0000, length=0x8000) as dump:
+            dump.run(ssm2)
+        print(dump.missing())
+    """
+
+    def __init__(self, path, start, length, block_size=MAX_A0_BYTES, restart=False):
+        """
+        Args:
+            path: Output file, one byte per address starting at start
+            start: First ECU address (24 bit)
+            length: Number of bytes to dump
+            block_size: Bytes per 0xA0 request (1-254)
+            restart: Discard the progress of an earlier dump instead of resuming
+        """
+        if not 1 <= block_size <= MAX_A0_BYTES:
+            raise ValueError(f"block_size must be 1-{MAX_A0_BYTES}")
+        if length <= 0 or start < 0 or start + length > 0x1000000:
+            raise ValueError("Range must be non-empty and within the 24-bit address space")
+
+        self.path = path
+        self.progress_path = path + '.progress'
+        self.start = start
+        self.length = length
+        self.block_size = block_size
+        self.blocks = split_range(start, length, block_size)
+
+        header = PROGRESS_HEADER.pack(PROGRESS_MAGIC, start, length, block_size)
+        if restart or not self._progress_matches(header):
+            with open(self.progress_path, 'wb') as f:
+                f.write(header)
+                f.truncate(PROGRESS_HEADER.size + len(self.blocks))
+
+        # Sparse output file, blocks are written in place as they arrive
+        self._file = open(path, 'r+b' if os.path.exists(path) else 'w+b')
+        if os.fstat(self._file.fileno()).st_size != length:
+            self._file.truncate(length)
+        self._data = mmap.mmap(self._file.fileno(), length)
+
+        self._progress_file = open(self.progress_path, 'r+b')
+        self._progress = mmap.mmap(self._progress_file.fileno(), PROGRESS_HEADER.size + len(self.blocks))
+
+        # Blocks read since the last checkpoint, not marked done yet
+        self._unflushed = []
+
+        # Statistics for the current run
+        self.bytes_read = 0
+        self.requests = 0
+        self.failures = 0
+        self.elapsed = 0.0
+
+    def _progress_matches(self, header):
+        try:
+            with open(self.progress_path, 'rb') as f:
+                return f.read(PROGRESS_HEADER.size) == header
+        except OSError:
+            return False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def done(self, index):
+        return self._progress[PROGRESS_HEADER.size + index] == BLOCK_DONE
+
+    def pending(self):
+        """Indexes of the blocks not dumped yet."""
+        return [index for index in range(len(self.blocks)) if not self.done(index)]
+
+    def missing(self):
+        """Address ranges not dumped yet, as (address, byte count) with neighbours merged."""
+        ranges = []
+        for index in self.pending():
+            address, count = self.blocks[index]
+            if ranges and ranges[-1][0] + ranges[-1][1] == address:
+                ranges[-1] = (ranges[-1][0], ranges[-1][1] + count)
+            else:
+                ranges.append((address, count))
+        return ranges
+
+    def run(self, ssm2, retries=3, progress=None):
+        """
+        Read every pending block, then retry the failed ones up to retries more passes.
+
+        serial.SerialException (adapter lost) is not retried: progress so far is
+        flushed and the exception propagates, run again to resume.
+
+        Args:
+            ssm2: Initialized PySSM2 connection
+            progress: Optional callable(done_blocks, total_blocks), called after each block
+        Returns True if the whole range has been dumped.
+        """
+        data = self._data
+        total = len(self.blocks)
+        completed = total - len(self.pending())
+        started = time.monotonic()
+        checkpoint = started
+
+        try:
+            for attempt in range(retries + 1):
+                failed = []
+                for index in self.pending():
+                    if time.monotonic() - checkpoint >= CHECKPOINT_INTERVAL:
+                        self.flush()
+                        checkpoint = time.monotonic()
+                    address, count = self.blocks[index]
+                    self.requests += 1
+                    try:
+                        payload = ssm2.read_block(address, count)
+                    except (TimeoutError, ValueError):
+                        self.failures += 1
+                        failed.append(index)
+                        continue
+                    offset = address - self.start
+                    data[offset:offset + count] = payload
+                    self._unflushed.append(index)
+                    self.bytes_read += count
+                    completed += 1
+                    if progress is not None:
+                        progress(completed, total)
+                # Checkpoint before the next pass, pending() reads the progress map
+                self.flush()
+                checkpoint = time.monotonic()
+                if not failed:
+                    break
+        finally:
+            self.elapsed += time.monotonic() - started
+            self.flush()
+
+        return completed == total
+
+    @property
+    def rate(self):
+        """Bytes/s dumped during run()."""
+        return self.bytes_read / self.elapsed if self.elapsed else 0.0
+
+    def flush(self):
+        """Checkpoint: write the data out, then mark the blocks it holds done."""
+        self._data.flush()
+        for index in self._unflushed:
+            self._progress[PROGRESS_HEADER.size + index] = BLOCK_DONE
+        self._unflushed = []
+        self._progress.flush()
+
+    def close(self):
+        if not self._data.closed:
+            self.flush()
+            self._data.close()
+            self._progress.close()
+        self._file.close()
+        self._progress_file.close()
+
+    def remove_progress(self):
+        """Delete the progress file once the dump is complete."""
+        try:
+            os.remove(self.progress_path)
+        except OSError:
+            pass
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    import PySSM2
+
+    parser = argparse.ArgumentParser(description="Dump ECU memory with SSM2 0xA0 block reads")
+    parser.add_argument('output', help="Output file (resumed if a matching .progress file exists)")
+    parser.add_argument('--start', type=lambda value: int(value, 0), required=True, help="First address")
+    parser.add_argument('--length', type=lambda value: int(value, 0), required=True, help="Bytes to dump")
+    parser.add_argument('--port', help="Serial port (default: scan for the adapter)")
+    parser.add_argument('--baud', type=int, default=4800, help="Baud rate")
+    parser.add_argument('--timeout', type=float, default=1.0, help="Seconds to wait for each block")
+    parser.add_argument('--block-size', type=int, default=MAX_A0_BYTES, help="Bytes per request (1-254)")
+    parser.add_argument('--retries', type=int, default=3, help="Extra passes over failed blocks")
+    parser.add_argument('--response-delay', type=float, default=RESPONSE_DELAY,
+                        help="ECU response delay for the theoretical rate")
+    parser.add_argument('--restart', action='store_true', help="Ignore earlier progress and dump everything")
+    args = parser.parse_args()
+
+    port = args.port or PySSM2.PySSM2.scan_for_adapter(baudrate=args.baud, timeout=2)
+    ssm2 = PySSM2.PySSM2(port, baudrate=args.baud, timeout=args.timeout)
+    dump = MemoryDump(args.output, args.start, args.length, args.block_size, restart=args.restart)
+    total = len(dump.blocks)
+    resumed = total - len(dump.pending())
+    if resumed:
+        print(f"Resuming: {resumed}/{total} blocks already dumped")
+
+    def show(done, total):
+        print(f"\r{done}/{total} blocks ({done * 100 // total}%)", end='', flush=True)
+
+    complete = False
+    try:
+        ssm2.ecu_init()
+        complete = dump.run(ssm2, retries=args.retries, progress=show)
+    except KeyboardInterrupt:
+        print("\nInterrupted, run again to resume")
+    except serial.SerialException as e:
+        print(f"\nSerial port error: {e}, run again to resume")
+    finally:
+        print()
+        missing = dump.missing()
+        dump.close()
+        ssm2.close()
+
+    best = theoretical_rate(args.block_size, args.baud, args.response_delay)
+    print(f"Read:        {dump.bytes_read} bytes in {dump.elapsed:.1f} s "
+          f"({dump.requests} requests, {dump.failures} failed)")
+    print(f"Rate:        {dump.rate:.1f} B/s, {dump.rate / best * 100:.0f}% of the "
+          f"{best:.1f} B/s wire maximum ({args.baud / BITS_PER_BYTE:.0f} B/s raw line rate)")
+    if complete:
+        dump.remove_progress()
+        print(f"Complete:    {args.output}")
+    else:
+        for address, count in missing:
+            print(f"Missing:     0x{address:06X}-0x{address + count - 1:06X} ({count} bytes)")
+        sys.exit(1)
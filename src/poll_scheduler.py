@@ -0,0 +1,287 @@
+"""
+Multi-rate polling scheduler for ECU parameters.
+
+Each parameter may declare a target 'rate' in Hz. Parameters without a rate are
+fast channels and are read as often as the wire allows, normally as one
+continuous stream. Slow channels (coolant temperature, atmospheric pressure...)
+are refreshed in the gaps: when one falls due, the continuous stream is
+interrupted for a single one-shot read of every slow channel that is due (plus
+any that are at least half way there, so interruptions are shared) and then
+restarted.
+
+An interruption is not free: stopping the stream, waiting for the line to go
+quiet, the one-shot read and restarting the stream take a few hundred
+milliseconds at 4800 baud, while streaming an address inline only costs one
+byte per frame. A channel with a rate is therefore only split off when that
+is cheaper than streaming it, see split_channels().
+
+A stream frame still on the wire has the same header and command byte as the
+reply to a one-shot read, and the same size whenever as many addresses are
+read. The stream is therefore ended with a short stop request whose reply is
+discarded with the stream's tail, once the line has been quiet for quiet_time,
+and only then is the one-shot read sent.
+
+The logger sees one merged sample stream: a buffer holding the last-known raw
+byte of every address in build_address_list() order, plus the age of each
+channel.
+"""
+
+import time
+
+from request_planner import BITS_PER_BYTE, candidate_plans, plan_requests, ReadRequest, RESPONSE_DELAY
+
+
+class Channel:
+    """A parameter's position in the merged buffer and its refresh state."""
+
+    def __init__(self, param, offset):
+        address = param['address']
+        self.name = param['name']
+        self.addresses = list(address) if isinstance(address, list) else [address]
+        self.offset = offset
+        self.rate = param.get('rate')
+        self.period = 1 / self.rate if self.rate else 0.0
+        self.updated = None  # time.monotonic() of the last refresh
+
+    def age(self, now):
+        return now - self.updated if self.updated is not None else float('inf')
+
+
+def _addresses(channels):
+    return [address for channel in channels for address in channel.addresses]
+
+
+def planned_rate(fast, slow, baudrate=4800, response_delay=RESPONSE_DELAY, quiet_time=None):
+    """
+    Expected fast samples per second when the slow channels interrupt the
+    stream of the fast ones, each at its own rate (interruptions are counted
+    separately, so shared ones make the real rate a little higher).
+    """
+    quiet_time = quiet_time if quiet_time is not None else 2 * response_delay
+    plan = candidate_plans(_addresses(fast), baudrate, response_delay)[0]
+    if plan.continuous:
+        # Stop request and its reply, silence, then the stream request again
+        stop = ReadRequest(0xA8, addresses=plan.addresses[:1])
+        restart = plan.requests[0]
+        switch = ((stop.request_length + stop.response_length + restart.request_length) * BITS_PER_BYTE
+                  / baudrate + quiet_time + 2 * response_delay)
+    else:
+        switch = 0.0
+    busy = sum(
+        channel.rate * (switch + plan_requests(channel.addresses, baudrate, response_delay,
+                                               continuous=False).seconds_per_sample)
+        for channel in slow
+    )
+    return max(0.0, 1 - busy) / plan.seconds_per_sample
+
+
+def split_channels(channels, baudrate=4800, response_delay=RESPONSE_DELAY, quiet_time=None):
+    """
+    Split channels into (fast, slow) lists.
+
+    Channels without a rate are fast. A channel with a rate joins them when
+    streaming it inline gives more fast samples per second than interrupting
+    the stream for it.
+    """
+    fast = [channel for channel in channels if not channel.rate]
+    slow = [channel for channel in channels if channel.rate]
+    if not fast:
+        # Everything has a rate, treat the fastest ones as the stream
+        top = max(channel.rate for channel in slow)
+        fast = [channel for channel in slow if channel.rate == top]
+        slow = [channel for channel in slow if channel.rate != top]
+
+    # Most frequent first, those cost the most to split off
+    for channel in sorted(slow, key=lambda channel: -channel.rate):
+        rest = [other for other in slow if other is not channel]
+        inline = [other for other in channels if other in fast or other is channel]
+        if (planned_rate(inline, rest, baudrate, response_delay, quiet_time)
+                >= planned_rate(fast, slow, baudrate, response_delay, quiet_time)):
+            fast, slow = inline, rest
+    return fast, slow
+
+
+def plan_key(parameters, baudrate=4800, response_delay=RESPONSE_DELAY):
+    """Identifies the fast channel address set, for caching its resolved plan."""
+    fast, _ = split_channels([Channel(param, 0) for param in parameters], baudrate, response_delay)
+    return ' '.join(f"{address:06X}" for address in _addresses(fast))
+
+
+class PollScheduler:
+    """
+    Rotate fast and slow read requests and merge them into one sample stream.
+
+    Usage:
+        scheduler = PollScheduler(ECU_PARAMETERS, baudrate=4800)
+        decoder = FrameDecoder(ECU_PARAMETERS)
+        while True:
+            values = await scheduler.next_sample(transport)
+            raw_values = decoder.decode(values)
+            ages = scheduler.ages()
+    """
+
+    def __init__(self, parameters, baudrate=4800, response_delay=RESPONSE_DELAY, fast_plan=None,
+                 quiet_time=None):
+        """
+        Args:
+            parameters: ECU_PARAMETERS-style list of dicts
+            fast_plan: Optional previously resolved RequestPlan for the fast channels
+                       (e.g. from the ECU init cache). Ignored if it does not cover
+                       exactly the fast channel addresses.
+            quiet_time: Seconds of silence that show the stream has ended
+                        (default twice the response delay)
+        """
+        self.baudrate = baudrate
+        self.response_delay = response_delay
+        self.quiet_time = quiet_time if quiet_time is not None else 2 * response_delay
+
+        self.channels = []
+        offset = 0
+        for param in parameters:
+            channel = Channel(param, offset)
+            self.channels.append(channel)
+            offset += len(channel.addresses)
+
+        # Last-known raw byte of every address, in parameter order
+        self.values = bytearray(offset)
+
+        self.fast, self.slow = split_channels(self.channels, baudrate, response_delay, self.quiet_time)
+
+        fast_addresses = _addresses(self.fast)
+        if fast_plan is not None and fast_plan.addresses == fast_addresses:
+            self.fast_plan = fast_plan
+        else:
+            self.fast_plan = candidate_plans(fast_addresses, baudrate, response_delay)[0]
+        self.planned_rate = planned_rate(self.fast, self.slow, baudrate, response_delay, self.quiet_time)
+        # buffer offset for each byte of the fast plan's assembled values
+        self._fast_offsets = [
+            channel.offset + index
+            for channel in self.fast
+            for index in range(len(channel.addresses))
+        ]
+        self._fast_contiguous = self._fast_offsets == list(
+            range(self._fast_offsets[0], self._fast_offsets[0] + len(self._fast_offsets)))
+
+        # Cheapest command to end the stream with: a one-shot read of one address
+        self._stop_request = ReadRequest(0xA8, addresses=fast_addresses[:1]).data()
+
+        self._primed = False
+        self._streaming = False  # A continuous read may be running on the ECU
+        self._restart = False    # The stream has to be (re)started before reading it
+
+        # Statistics
+        self.fast_samples = 0
+        self.slow_refreshes = 0
+
+    def describe(self):
+        lines = [f"Fast channels ({len(self.fast)}): {self.fast_plan.describe()}",
+                 f"Planned rate with interruptions: {self.planned_rate:.1f} samples/s"]
+        for channel in self.slow:
+            lines.append(f"Slow channel {channel.name}: {channel.rate} Hz")
+        return lines
+
+    def ages(self, now=None):
+        """Seconds since each channel was last read, by parameter name."""
+        now = time.monotonic() if now is None else now
+        return {channel.name: channel.age(now) for channel in self.channels}
+
+    def _due(self, now):
+        """Slow channels that need refreshing, or None if none are overdue yet."""
+        if not any(channel.age(now) >= channel.period for channel in self.slow):
+            return None
+        # Piggyback anything at least half way to due on the same interruption
+        return [channel for channel in self.slow if channel.age(now) >= channel.period / 2]
+
+    async def _end_stream(self, transport, quiet_time=None):
+        """
+        End the continuous stream and wait until the line is quiet, discarding
+        the stream frames in flight and the reply to the stop request.
+        """
+        self._streaming = False
+        transport.send(self._stop_request)
+        await transport.drain(quiet_time or self.quiet_time, transport.timeout)
+
+    async def _read_once(self, transport, channels):
+        """One-shot read of the given channels into the merged buffer."""
+        if self._streaming:
+            await self._end_stream(transport)
+        addresses = [address for channel in channels for address in channel.addresses]
+        plan = plan_requests(addresses, self.baudrate, self.response_delay, continuous=False)
+        frames = [
+            bytes(await transport.request(request.data(), request.response_size))
+            for request in plan.requests
+        ]
+        values = plan.assemble(frames)
+        now = time.monotonic()
+        index = 0
+        for channel in channels:
+            size = len(channel.addresses)
+            self.values[channel.offset:channel.offset + size] = values[index:index + size]
+            channel.updated = now
+            index += size
+        self.slow_refreshes += 1
+
+    async def stop(self, transport, quiet_time=None):
+        """
+        End the continuous stream, if one is running, and wait until the line
+        has been quiet for quiet_time seconds (default self.quiet_time). The ECU
+        has then stopped streaming, so the line is free for another control unit.
+        """
+        if not self._streaming:
+            return
+        await self._end_stream(transport, quiet_time)
+
+    async def next_sample(self, transport):
+        """
+        Read until the next fast sample and return the merged buffer.
+
+        Slow channels that fell due since the previous call are refreshed first.
+        State lives on the scheduler, so after an error (e.g. TimeoutError) the
+        next call simply restarts the stream. The buffer is reused; copy it if it
+        has to outlive the next call.
+        """
+        plan = self.fast_plan
+
+        try:
+            if not self._primed:
+                # Prime the slow channels so the first sample has no missing values
+                if self.slow:
+                    await self._read_once(transport, self.slow)
+                self._primed = True
+            else:
+                due = self._due(time.monotonic())
+                if due:
+                    # Ends the continuous stream, restarted below
+                    await self._read_once(transport, due)
+
+            if plan.continuous:
+                if not self._streaming or self._restart:
+                    transport.start_continuous(plan.requests[0])
+                    self._streaming = True
+                    self._restart = False
+                frames = [await transport.receive_frame()]
+            else:
+                frames = [
+                    bytes(await transport.request(request.data(), request.response_size))
+                    for request in plan.requests
+                ]
+        except Exception:
+            # The ECU may still be streaming: restart the stream, but end it
+            # properly before any one-shot read
+            self._restart = True
+            raise
+
+        values = plan.assemble(frames)
+        offsets = self._fast_offsets
+        if self._fast_contiguous:
+            self.values[offsets[0]:offsets[0] + len(offsets)] = values
+        else:
+            for index, offset in enumerate(offsets):
+                self.values[offset] = values[index]
+
+        now = time.monotonic()
+        for channel in self.fast:
+            channel.updated = now
+        self.fast_samples += 1
+
+        return self.values
@@ -0,0 +1,188 @@
+"""
+Binary protocol trace for PySSM2.
+
+Keeps the last few thousand raw serial reads and writes in a preallocated ring
+buffer, with a monotonic timestamp and direction for each. Recording is a
+struct pack_into and a slice copy, nothing is formatted or printed. When tracing
+is disabled PySSM2.trace is None and the only cost is that check.
+
+The buffer can be dumped to a file on demand (SIGUSR1 in the logger) or on error,
+and decoded offline into the same header / length / checksum breakdown the old
+debug prints showed:
+
+    python3 protocol_trace.py /var/log/subaru/python/2025/October/24/20251024-143022-trace.bin
+"""
+
+import struct
+import time
+
+TX = 0
+RX = 1
+
+FILE_MAGIC = b'SSM2TRC1'
+FILE_HEADER = struct.Struct('<8sddI')    # magic, wall clock, monotonic clock, record count
+RECORD_HEADER = struct.Struct('<dBH')    # monotonic timestamp, direction, length
+SLOT_DATA = 256                          # Longer reads and writes span several slots
+
+
+class ProtocolTrace:
+    """
+    Fixed-size ring buffer of timestamped TX/RX byte chunks.
+
+    Usage:
+        ssm2.trace = ProtocolTrace(slots=2048)
+        ...
+        ssm2.trace.dump('/tmp/trace.bin')
+    """
+
+    def __init__(self, slots=1024):
+        self.slots = slots
+        self.slot_size = RECORD_HEADER.size + SLOT_DATA
+        self._buffer = bytearray(slots * self.slot_size)
+        self._view = memoryview(self._buffer)
+        self._next = 0      # Slot index of the next record
+        self._count = 0     # Number of valid slots
+
+    def __len__(self):
+        return self._count
+
+    def clear(self):
+        self._next = 0
+        self._count = 0
+
+    def record(self, direction, data, timestamp=None):
+        """Store a chunk of bytes written (TX) or read (RX) on the serial port."""
+        if timestamp is None:
+            timestamp = time.monotonic()
+        size = len(data)
+        for start in range(0, size, SLOT_DATA):
+            chunk = data[start:start + SLOT_DATA]
+            offset = self._next * self.slot_size
+            RECORD_HEADER.pack_into(self._buffer, offset, timestamp, direction, len(chunk))
+            offset += RECORD_HEADER.size
+            self._view[offset:offset + len(chunk)] = chunk
+            self._next = (self._next + 1) % self.slots
+            if self._count < self.slots:
+                self._count += 1
+
+    def records(self):
+        """Yield (timestamp, direction, bytes) from oldest to newest."""
+        first = (self._next - self._count) % self.slots
+        for index in range(self._count):
+            offset = ((first + index) % self.slots) * self.slot_size
+            timestamp, direction, length = RECORD_HEADER.unpack_from(self._buffer, offset)
+            offset += RECORD_HEADER.size
+            yield timestamp, direction, bytes(self._view[offset:offset + length])
+
+    def dump(self, path):
+        """Write the buffered records to a trace file, oldest first."""
+        with open(path, 'wb') as tracefile:
+            tracefile.write(FILE_HEADER.pack(FILE_MAGIC, time.time(), time.monotonic(), self._count))
+            for timestamp, direction, data in self.records():
+                tracefile.write(RECORD_HEADER.pack(timestamp, direction, len(data)))
+                tracefile.write(data)
+        return path
+
+
+def read_trace(path):
+    """
+    Read a trace file.
+
+    Returns (records, wall_offset) where records is a list of
+    (timestamp, direction, bytes) and wall_offset converts the monotonic
+    timestamps to time.time() values.
+    """
+    with open(path, 'rb') as tracefile:
+        magic, wall, monotonic, count = FILE_HEADER.unpack(tracefile.read(FILE_HEADER.size))
+        if magic != FILE_MAGIC:
+            raise ValueError(f"{path} is not a pySSM2 trace file")
+        records = []
+        for _ in range(count):
+            timestamp, direction, length = RECORD_HEADER.unpack(tracefile.read(RECORD_HEADER.size))
+            records.append((timestamp, direction, tracefile.read(length)))
+    return records, wall - monotonic
+
+
+def split_packets(stream):
+    """
+    Split a byte stream into SSM2 packets.
+
+    Yields (packet, complete) tuples; bytes that are not part of a packet are
+    yielded on their own with complete=False. A trailing partial packet is
+    yielded with complete=False as well.
+    """
+    index = 0
+    while index < len(stream):
+        if stream[index] != 0x80:
+            end = stream.find(b'\x80', index)
+            end = len(stream) if end < 0 else end
+            yield stream[index:end], False
+            index = end
+            continue
+        if index + 4 > len(stream):
+            yield stream[index:], False
+            return
+        end = index + 4 + stream[index + 3] + 1
+        if end > len(stream):
+            yield stream[index:], False
+            return
+        yield stream[index:end], True
+        index = end
+
+
+def describe_packet(packet):
+    """Header, length and checksum breakdown of one packet, as a list of lines."""
+    datalen = packet[3]
+    data = packet[4:4 + datalen]
+    expected = sum(packet[:4 + datalen]) & 0xFF
+    returned = packet[4 + datalen]
+    return [
+        f"Full Hex String: {' '.join(hex(n) for n in packet)}",
+        f"Start Byte: {hex(packet[0])}",
+        f"Destination Byte: {hex(packet[1])}",
+        f"Source Byte: {hex(packet[2])}",
+        f"Data Size Byte: {hex(datalen)} ({datalen})",
+        f"Data Bytes Hex: {' '.join(hex(n) for n in data)}",
+        f"Data Bytes Int: {list(data)}",
+        f"Expected Checksum: {hex(expected)}",
+        f"Returned Checksum: {hex(returned)}{'' if expected == returned else '  <-- MISMATCH'}",
+    ]
+
+
+def decode(path):
+    """Print a trace file as timestamped packets."""
+    records, wall_offset = read_trace(path)
+    pending = {TX: b'', RX: b''}
+
+    for timestamp, direction, data in records:
+        when = time.strftime('%H:%M:%S', time.localtime(timestamp + wall_offset))
+        fraction = f"{(timestamp + wall_offset) % 1:.3f}"[1:]
+        label = 'TX' if direction == TX else 'RX'
+
+        # Frames can be split across several reads, carry partial packets forward
+        stream = pending[direction] + data
+        pending[direction] = b''
+        for packet, complete in split_packets(stream):
+            if complete:
+                print(f"--- {when}{fraction} {label} packet")
+                for line in describe_packet(packet):
+                    print(f"    {line}")
+            elif packet[:1] == b'\x80':
+                pending[direction] = packet
+            else:
+                print(f"--- {when}{fraction} {label} {len(packet)} stray byte(s): "
+                      f"{' '.join(hex(n) for n in packet)}")
+
+    for direction, packet in pending.items():
+        if packet:
+            label = 'TX' if direction == TX else 'RX'
+            print(f"--- {label} incomplete packet at end of trace: {' '.join(hex(n) for n in packet)}")
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) != 2:
+        print("Usage: python3 protocol_trace.py <trace file>")
+        sys.exit(1)
+    decode(sys.argv[1])
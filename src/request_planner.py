@@ -0,0 +1,313 @@
+"""
+Wire-cost request planner for SSM2 reads.
+
+Given the addresses we want every sample, builds the request sequence that
+spends the fewest bytes on the K-line, choosing between:
+
+- 0xA8 address reads: 3 request bytes + 1 response byte per address
+- 0xA0 block reads: fixed 6 byte request, 1 response byte per byte in the block
+  (covers neighbouring addresses such as 0x0E/0x0F Engine Speed, or a run like
+  0x07-0x10, for much less request overhead)
+
+Cost model (4800 baud, 8N1 = 10 bits per byte):
+- Every packet carries 5 bytes of framing: 0x80, destination, source, size, checksum.
+- The K-line is half duplex and the adapter echoes our request, so a request
+  occupies the line for its full length before the ECU can answer.
+- One-shot requests also pay the ECU response delay (ISO 9141 P2, ~25 ms) per request.
+- Continuous mode (read mode 0x01) sends one request once and the ECU repeats the
+  response, so each sample only costs the response frame. Only one request can be
+  continuous at a time.
+
+Usage:
+    plan = plan_requests(addresses)
+    print(plan.describe())
+    values = plan.assemble(frames)   # one byte per requested address, in order
+
+Run directly to compare plans for a list of addresses:
+    python3 request_planner.py 0x1C 0x08 0x46 0x0D 0x23 0x10 0x13 0x14 0x0E 0x0F
+"""
+
+import struct
+
+BITS_PER_BYTE = 10           # Start bit + 8 data bits + stop bit
+FRAME_OVERHEAD = 5           # 0x80, destination, source, data size, checksum
+RESPONSE_DELAY = 0.025       # Seconds between request and response (ISO 9141 P2 min)
+
+MAX_DATA_SIZE = 0xFF         # Data size is a single byte
+MAX_A8_ADDRESSES = (MAX_DATA_SIZE - 2) // 3        # A8 PP + 3 bytes per address
+MAX_A0_BYTES = MAX_DATA_SIZE - 1                   # Response code + block
+
+
+class ReadRequest:
+    """A single 0xA8 address read or 0xA0 block read."""
+
+    def __init__(self, command, addresses=None, start=None, count=None):
+        self.command = command
+        if command == 0xA0:
+            self.start = start
+            self.count = count
+            self.addresses = list(range(start, start + count))
+        else:
+            self.start = None
+            self.count = len(addresses)
+            self.addresses = list(addresses)
+        # Offset of each address in the response payload (after the response code)
+        self.offsets = {}
+        for index, address in enumerate(self.addresses):
+            self.offsets.setdefault(address, index)
+
+    def data(self, continuous=False):
+        """Command bytes for PySSM2.send_packet()."""
+        mode = 0x01 if continuous else 0x00
+        if self.command == 0xA0:
+            return [0xA0, mode] + list(struct.pack('>I', self.start)[1:]) + [self.count - 1]
+        data = [0xA8, mode]
+        for address in self.addresses:
+            data += list(struct.pack('>I', address)[1:])
+        return data
+
+    @property
+    def request_length(self):
+        """Bytes on the line for the request packet (and its echo)."""
+        return FRAME_OVERHEAD + (6 if self.command == 0xA0 else 2 + 3 * self.count)
+
+    @property
+    def response_size(self):
+        """Data size byte of the response: response code + one byte per address."""
+        return 1 + self.count
+
+    @property
+    def response_length(self):
+        """Bytes on the line for the response packet."""
+        return FRAME_OVERHEAD + self.response_size
+
+    def __repr__(self):
+        if self.command == 0xA0:
+            return f"A0(0x{self.start:06X}, {self.count})"
+        return f"A8({', '.join(f'0x{a:06X}' for a in self.addresses)})"
+
+
+class RequestPlan:
+    """
+    A sequence of read requests covering a list of addresses, with its wire cost.
+    """
+
+    def __init__(self, name, addresses, requests, continuous=False,
+                 baudrate=4800, response_delay=RESPONSE_DELAY):
+        self.name = name
+        self.addresses = list(addresses)
+        self.requests = requests
+        self.continuous = continuous
+        self.baudrate = baudrate
+        self.response_delay = response_delay
+
+        # Where each requested address lives: (request index, offset in frame data)
+        self.layout = []
+        for address in self.addresses:
+            for index, request in enumerate(requests):
+                if address in request.offsets:
+                    self.layout.append((index, 1 + request.offsets[address]))
+                    break
+            else:
+                raise ValueError(f"Address 0x{address:06X} is not covered by the plan")
+
+        # A single request whose response is already in requested order needs no reshuffle
+        self.identity = (
+            len(requests) == 1 and requests[0].addresses == self.addresses
+        )
+
+    @property
+    def bytes_per_sample(self):
+        """Bytes on the line for one complete sample of every address."""
+        if self.continuous:
+            return sum(request.response_length for request in self.requests)
+        return sum(request.request_length + request.response_length for request in self.requests)
+
+    @property
+    def seconds_per_sample(self):
+        seconds = self.bytes_per_sample * BITS_PER_BYTE / self.baudrate
+        if not self.continuous:
+            seconds += self.response_delay * len(self.requests)
+        return seconds
+
+    @property
+    def samples_per_second(self):
+        return 1 / self.seconds_per_sample
+
+    def assemble(self, frames):
+        """
+        Gather one byte per requested address, in requested order.
+
+        Args:
+            frames: Frame data sections (response code first), one per request.
+
+        Returns the frame payload itself (no copy) when the plan is a single request
+        in requested order, otherwise a new bytearray.
+        """
+        if self.identity:
+            return frames[0][1:]
+        values = bytearray(len(self.layout))
+        for index, (request_index, offset) in enumerate(self.layout):
+            values[index] = frames[request_index][offset]
+        return values
+
+    def to_dict(self):
+        """JSON-friendly form, for caching a resolved plan (see ecu_cache.py)."""
+        return {
+            'name': self.name,
+            'addresses': self.addresses,
+            'continuous': self.continuous,
+            'requests': [
+                {'command': request.command, 'start': request.start, 'count': request.count}
+                if request.command == 0xA0 else
+                {'command': request.command, 'addresses': request.addresses}
+                for request in self.requests
+            ],
+        }
+
+    @classmethod
+    def from_dict(cls, plan, baudrate=4800, response_delay=RESPONSE_DELAY):
+        """Rebuild a plan saved with to_dict()."""
+        requests = [
+            ReadRequest(request['command'], addresses=request.get('addresses'),
+                        start=request.get('start'), count=request.get('count'))
+            for request in plan['requests']
+        ]
+        return cls(plan['name'], plan['addresses'], requests, continuous=plan['continuous'],
+                   baudrate=baudrate, response_delay=response_delay)
+
+    def describe(self):
+        return (
+            f"{self.name}: {len(self.requests)} request(s) {self.requests}, "
+            f"{self.bytes_per_sample} bytes/sample, "
+            f"{self.samples_per_second:.1f} samples/s"
+        )
+
+
+def _unique(addresses):
+    """Addresses in first-seen order without duplicates."""
+    seen = set()
+    result = []
+    for address in addresses:
+        if address not in seen:
+            seen.add(address)
+            result.append(address)
+    return result
+
+
+def _chunks(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def _one_shot_requests(addresses, byte_delay):
+    """
+    Cheapest mix of A0 blocks and A8 address lists for one-shot reads.
+
+    Dynamic programming over the sorted addresses: each run of addresses is either
+    covered by one A0 block (whole span, fixed request) or left to the shared A8
+    request (4 bytes per address). byte_delay is the response delay expressed in
+    byte times, so delays and bytes are compared in the same unit.
+    """
+    ordered = _unique(addresses)
+    sorted_addresses = sorted(ordered)
+    count = len(sorted_addresses)
+    a0_fixed = FRAME_OVERHEAD + 6 + FRAME_OVERHEAD + 1 + byte_delay
+    a8_fixed = FRAME_OVERHEAD + 2 + FRAME_OVERHEAD + 1 + byte_delay
+
+    def solve(allow_a8):
+        # best[i] = (cost, choices) for the first i sorted addresses
+        best = [(0.0, [])] + [(float('inf'), None)] * count
+        for end in range(1, count + 1):
+            if allow_a8:
+                cost, choices = best[end - 1]
+                best[end] = (cost + 4, choices + [('A8', end - 1, end)])
+            for start in range(end - 1, -1, -1):
+                span = sorted_addresses[end - 1] - sorted_addresses[start] + 1
+                if span > MAX_A0_BYTES:
+                    break
+                cost, choices = best[start]
+                cost += a0_fixed + span
+                if cost < best[end][0]:
+                    best[end] = (cost, choices + [('A0', start, end)])
+        return best[count]
+
+    candidates = [solve(False)]
+    if count:
+        a8_cost, a8_choices = solve(True)
+        candidates.append((a8_cost + a8_fixed, a8_choices))
+    _, choices = min(candidates, key=lambda candidate: candidate[0])
+
+    requests = []
+    a8_addresses = set()
+    for kind, start, end in choices:
+        if kind == 'A0':
+            first = sorted_addresses[start]
+            requests.append(ReadRequest(0xA0, start=first, count=sorted_addresses[end - 1] - first + 1))
+        else:
+            a8_addresses.add(sorted_addresses[start])
+    # Keep A8 addresses in requested order so a pure A8 plan needs no reshuffle
+    a8_list = [address for address in ordered if address in a8_addresses]
+    for chunk in _chunks(a8_list, MAX_A8_ADDRESSES):
+        requests.append(ReadRequest(0xA8, addresses=chunk))
+    return requests
+
+
+def candidate_plans(addresses, baudrate=4800, response_delay=RESPONSE_DELAY):
+    """Return every applicable plan for the addresses, cheapest first."""
+    ordered = _unique(addresses)
+    plans = []
+    if not ordered:
+        return plans
+
+    byte_delay = response_delay * baudrate / BITS_PER_BYTE
+
+    if len(ordered) <= MAX_A8_ADDRESSES:
+        plans.append(RequestPlan('A8 continuous', addresses, [ReadRequest(0xA8, addresses=ordered)],
+                                 continuous=True, baudrate=baudrate, response_delay=response_delay))
+
+    first, last = min(ordered), max(ordered)
+    if last - first + 1 <= MAX_A0_BYTES:
+        plans.append(RequestPlan('A0 continuous', addresses,
+                                 [ReadRequest(0xA0, start=first, count=last - first + 1)],
+                                 continuous=True, baudrate=baudrate, response_delay=response_delay))
+
+    plans.append(RequestPlan('A8 one-shot', addresses,
+                             [ReadRequest(0xA8, addresses=chunk) for chunk in _chunks(ordered, MAX_A8_ADDRESSES)],
+                             baudrate=baudrate, response_delay=response_delay))
+    mixed = _one_shot_requests(ordered, byte_delay)
+    if repr(mixed) != repr(plans[-1].requests):
+        plans.append(RequestPlan('Mixed one-shot', addresses, mixed,
+                                 baudrate=baudrate, response_delay=response_delay))
+
+    plans.sort(key=lambda plan: plan.seconds_per_sample)
+    return plans
+
+
+def plan_requests(addresses, baudrate=4800, response_delay=RESPONSE_DELAY, continuous=True):
+    """
+    Return the fastest plan for the addresses.
+
+    Args:
+        addresses: ECU addresses, one response byte each, in the order the caller
+                   wants them back from RequestPlan.assemble()
+        continuous: Allow continuous-mode plans. Callers that rotate several
+                    requests (e.g. a multi-rate scheduler) need one-shot plans.
+    """
+    plans = candidate_plans(addresses, baudrate, response_delay)
+    if not continuous:
+        plans = [plan for plan in plans if not plan.continuous]
+    if not plans:
+        raise ValueError("No addresses to read")
+    return plans[0]
+
+
+if __name__ == "__main__":
+    import sys
+
+    requested = [int(arg, 0) for arg in sys.argv[1:]]
+    if not requested:
+        print(__doc__)
+        sys.exit(1)
+
+    for plan in candidate_plans(requested):
+        print(plan.describe())
@@ -0,0 +1,105 @@
+"""
+Columnar ring buffer of logged samples.
+
+Every channel (parameter) is a preallocated array('d') column next to a
+timestamp column, with room for a fixed number of samples. Appending a sample
+writes one double per channel at the next row and allocates nothing, so memory
+stays flat however long the logger runs: 8 bytes per channel per row, about
+3 MB for 60 channels at the default 6000 rows. Missing values (an invalid
+derived parameter, a unit that is not streaming) are stored as NaN.
+
+Readers never take samples out. The display reads the newest value of a
+channel, the CSV writer keeps its own position (a sample sequence number) and
+reads the rows appended since, and analysis code can view a channel's window
+without copying. count is only advanced once a row is complete, and a reader
+that falls more than a buffer behind resumes at the oldest row still held.
+
+Usage:
+    samples = SampleRing(['Engine Speed', 'Boost Pressure'], capacity=6000)
+    samples.append(time.time(), (2000.0, None))
+    samples.latest('Engine Speed')              # 2000.0
+    for row in samples.rows(position):          # (timestamp, value, ...) tuples
+        ...
+    chunks = samples.window('Engine Speed', samples.count - 600)   # memoryviews
+"""
+
+from array import array
+
+NAN = float('nan')
+
+
+class SampleRing:
+    """
+    Fixed-capacity columnar store of the newest samples.
+
+    Attributes:
+        names: Channel names, in column order
+        capacity: Samples held
+        count: Samples appended so far; sample n is stored at row n % capacity
+        times: Timestamp column
+        columns: One array('d') per channel, in names order
+    """
+
+    def __init__(self, names, capacity=6000):
+        self.names = list(names)
+        self.capacity = capacity
+        self.count = 0
+        self.times = array('d', bytes(8 * capacity))
+        self.columns = [array('d', bytes(8 * capacity)) for _ in self.names]
+        self._index = {name: index for index, name in enumerate(self.names)}
+        # Zero-copy slicing for readers
+        self._times_view = memoryview(self.times)
+        self._views = [memoryview(column) for column in self.columns]
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    @property
+    def first(self):
+        """Sequence number of the oldest sample still held."""
+        return max(0, self.count - self.capacity)
+
+    def append(self, timestamp, values):
+        """Store a sample: its timestamp and one value per channel (None when missing)."""
+        row = self.count % self.capacity
+        self.times[row] = timestamp
+        for column, value in zip(self.columns, values):
+            column[row] = NAN if value is None else value
+        self.count += 1
+
+    def latest(self, name, default=None):
+        """Newest value of a channel, or default while it is missing or unknown."""
+        index = self._index.get(name)
+        if index is None or not self.count:
+            return default
+        value = self.columns[index][(self.count - 1) % self.capacity]
+        return default if value != value else value
+
+    def segments(self, start, stop=None):
+        """
+        (first row, end row) ranges holding samples start..stop-1, oldest first:
+        one range, or two where the buffer wraps. start is clamped to first.
+        """
+        stop = self.count if stop is None else min(stop, self.count)
+        start = max(start, self.first)
+        if start >= stop:
+            return []
+        low = start % self.capacity
+        high = low + stop - start
+        if high <= self.capacity:
+            return [(low, high)]
+        return [(low, self.capacity), (0, high - self.capacity)]
+
+    def window(self, name, start, stop=None):
+        """
+        A channel's values for samples start..stop-1, as memoryviews of the
+        column (one per segment), e.g. for numpy.frombuffer(). Pass 'Time' for
+        the timestamps.
+        """
+        view = self._times_view if name == 'Time' else self._views[self._index[name]]
+        return [view[low:high] for low, high in self.segments(start, stop)]
+
+    def rows(self, start, stop=None):
+        """Yield (timestamp, value, ...) tuples of samples start..stop-1, NaN where missing."""
+        for low, high in self.segments(start, stop):
+            yield from zip(self._times_view[low:high], *[view[low:high] for view in self._views])
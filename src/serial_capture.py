@@ -0,0 +1,513 @@
+"""
+Raw serial capture recording and replay.
+
+CaptureRecorder wraps the serial port used by PySSM2 and writes every chunk read
+or written, with a monotonic timestamp, to a compact binary capture file.
+
+ReplaySerial stands in for serial.Serial and plays a capture back, either in real
+time (optionally sped up) or as fast as possible. It serves the ECU init, but a
+replay cannot answer requests it did not record: the logger's interruptions for
+slow channels fall at other times than during the drive. CaptureReplay therefore
+takes over from the bus scheduler and feeds every recorded reply, with the
+request it answers (capture_replies()), straight into the decode buffers. The
+logger, decoders and CSV writer then run against a real drive on a workstation
+with no car attached, with the drive's samples and timestamps, and benchmarks
+become repeatable.
+
+Capture file format (little-endian):
+    header:  8s magic 'SSM2CAP1', d wall clock at start, I baud rate
+    records: d seconds since start, B direction (0 = TX, 1 = RX), H length, data
+
+decode_capture() decodes a capture offline in one go: the replies to the
+continuous read are stacked into an N x payload array for
+FrameDecoder.decode_batch(), with the derived parameters from evaluate_batch().
+
+Summarise a capture, or decode its stream with the logger's parameters:
+    python3 serial_capture.py capture.bin
+    python3 serial_capture.py capture.bin --csv stream.csv
+"""
+
+import asyncio
+import struct
+import time
+
+import serial
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, only needed for decode_capture()
+    np = None
+
+from bus_scheduler import ECU_ADDRESS
+from derived import evaluate_batch
+from frame_decoder import FrameDecoder
+from frame_parser import FrameParser
+from protocol_trace import TX, RX
+
+CAPTURE_MAGIC = b'SSM2CAP1'
+CAPTURE_HEADER = struct.Struct('<8sdI')
+CAPTURE_RECORD = struct.Struct('<dBH')
+MAX_RECORD_DATA = 0xFFFF
+TOOL_ADDRESS = 0xF0
+
+
+class CaptureRecorder:
+    """
+    Serial port wrapper that records all traffic to a capture file.
+
+    Everything other than read() and write() is passed through to the wrapped
+    port, so PySSM2 and the asyncio transport use it unchanged:
+
+        ssm2.ser = CaptureRecorder(ssm2.ser, '/var/log/subaru/capture.bin')
+    """
+
+    def __init__(self, ser, path, flush_interval=1.0):
+        self.ser = ser
+        self.path = path
+        self.flush_interval = flush_interval
+        self._file = open(path, 'wb')
+        self._start = time.monotonic()
+        self._last_flush = self._start
+        self._file.write(CAPTURE_HEADER.pack(CAPTURE_MAGIC, time.time(), getattr(ser, 'baudrate', 0) or 0))
+
+        # Statistics
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def __getattr__(self, name):
+        return getattr(self.ser, name)
+
+    def _record(self, direction, data):
+        now = time.monotonic()
+        for start in range(0, len(data), MAX_RECORD_DATA):
+            chunk = data[start:start + MAX_RECORD_DATA]
+            self._file.write(CAPTURE_RECORD.pack(now - self._start, direction, len(chunk)))
+            self._file.write(chunk)
+        # Bound what a power cut can lose without flushing on every frame
+        if now - self._last_flush >= self.flush_interval:
+            self._file.flush()
+            self._last_flush = now
+
+    def read(self, size=1):
+        data = self.ser.read(size)
+        if data:
+            self._record(RX, data)
+            self.bytes_read += len(data)
+        return data
+
+    def write(self, data):
+        written = self.ser.write(data)
+        self._record(TX, bytes(data))
+        self.bytes_written += len(data)
+        return written
+
+    def close(self):
+        try:
+            self.ser.close()
+        finally:
+            if not self._file.closed:
+                self._file.close()
+
+
+def read_capture(path):
+    """
+    Read a capture file.
+
+    Returns (info, records) where info is a dict with 'start_time' and 'baudrate'
+    and records is a list of (seconds since start, direction, bytes). A record
+    truncated by a power cut ends the list.
+    """
+    with open(path, 'rb') as capturefile:
+        header = capturefile.read(CAPTURE_HEADER.size)
+        if len(header) < CAPTURE_HEADER.size:
+            raise ValueError(f"{path} is not a pySSM2 capture file")
+        magic, start_time, baudrate = CAPTURE_HEADER.unpack(header)
+        if magic != CAPTURE_MAGIC:
+            raise ValueError(f"{path} is not a pySSM2 capture file")
+
+        records = []
+        while True:
+            record = capturefile.read(CAPTURE_RECORD.size)
+            if len(record) < CAPTURE_RECORD.size:
+                break
+            timestamp, direction, length = CAPTURE_RECORD.unpack(record)
+            data = capturefile.read(length)
+            if len(data) < length:
+                break
+            records.append((timestamp, direction, data))
+
+    return {'start_time': start_time, 'baudrate': baudrate}, records
+
+
+def read_addresses(request):
+    """Addresses an 0xA8 address read or 0xA0 block read request asks for, None for other requests."""
+    if len(request) >= 5 and request[0] == 0xA8:
+        return [int.from_bytes(request[index:index + 3], 'big') for index in range(2, len(request) - 2, 3)]
+    if len(request) == 6 and request[0] == 0xA0:
+        start = int.from_bytes(request[2:5], 'big')
+        return list(range(start, start + request[5] + 1))
+    return None
+
+
+def capture_replies(records):
+    """
+    Yield (seconds since start, unit, request, reply) for every reply in the
+    capture records (from read_capture()), request being the data of the last
+    request sent to that unit.
+
+    Replies to a read are only yielded when their size matches the request: a
+    stream frame still arriving after the next request was sent is dropped, as
+    the logger's frame parser dropped it while recording.
+    """
+    requests = {}
+    parsers = {}
+    for timestamp, direction, data in records:
+        if direction == TX:
+            # PySSM2 writes one whole packet at a time
+            position = 0
+            while position + 5 <= len(data):
+                unit, size = data[position + 1], data[position + 3]
+                requests[unit] = bytes(data[position + 4:position + 4 + size])
+                if unit not in parsers:
+                    parsers[unit] = FrameParser(destination=TOOL_ADDRESS, source=unit)
+                position += 5 + size
+            continue
+
+        for unit, parser in parsers.items():
+            parser.feed(data)
+            for reply in parser.frames():
+                request = requests[unit]
+                addresses = read_addresses(request)
+                if addresses is not None and len(reply) != len(addresses) + 1:
+                    continue
+                yield timestamp, unit, request, bytes(reply)
+
+
+
+def _param_addresses(param):
+    address = param['address']
+    return address if isinstance(address, list) else [address]
+
+
+def decode_capture(path, parameters, derived=(), unit=ECU_ADDRESS):
+    """
+    Decode the continuous stream of a capture as NumPy columns.
+
+    The RX stream is split into frames by FrameParser (capture_replies()), and
+    the replies to the unit's continuous read are stacked, in parameter order,
+    into one N x size array for FrameDecoder.decode_batch(). Parameters the
+    stream does not cover (slow channels) are left out, and so are derived
+    parameters reading them or not declaring 'depends'.
+
+    Args:
+        parameters: ECU_PARAMETERS-style list of dicts
+        derived: DERIVED_PARAMETERS-style list of dicts
+        unit: SSM2 address of the control unit
+    Returns (timestamps, columns): seconds since the start of the capture, and
+    one float64 column per decoded parameter by name.
+    """
+    if np is None:
+        raise ImportError("NumPy is required for decoding a capture")
+    _, records = read_capture(path)
+
+    streams = {}
+    for timestamp, reply_unit, request, reply in capture_replies(records):
+        if reply_unit == unit and read_addresses(request) is not None and request[1] == 0x01:
+            streams.setdefault(request, []).append((timestamp, reply))
+    if not streams:
+        raise ValueError(f"{path} has no continuous read from 0x{unit:02X}")
+    # The logger restarts the same stream after every interruption
+    request, replies = max(streams.items(), key=lambda item: len(item[1]))
+
+    addresses = read_addresses(request)
+    covered = [param for param in parameters if set(_param_addresses(param)) <= set(addresses)]
+    # Response column (after the response code) of each buffer byte, in parameter order
+    layout = [1 + addresses.index(address) for param in covered for address in _param_addresses(param)]
+    payloads = np.frombuffer(b''.join(reply for _, reply in replies), dtype=np.uint8)
+    frames = payloads.reshape(len(replies), len(addresses) + 1)[:, layout]
+
+    columns = FrameDecoder(covered).decode_batch(frames)
+    available = set(columns)
+    computable = []
+    for param in derived:
+        if param.get('depends') is not None and set(param['depends']) <= available:
+            computable.append(param)
+            available.add(param['name'])
+    columns = evaluate_batch(computable, columns)
+    return np.array([timestamp for timestamp, _ in replies]), columns
+
+
+class CaptureReplay:
+    """
+    Replay a capture's replies into the PollScheduler buffers of bus nodes.
+
+    Stands in for bus_scheduler.BusScheduler (same methods) when the logger
+    replays a drive: nothing is sent and nothing is waited for. Every recorded
+    reply to a read updates the last-known bytes of the addresses it answers,
+    and once every fast channel of a unit has been refreshed a sample is
+    returned, as PollScheduler.next_sample() returned it during the drive.
+    Timestamps are the drive's. Raises serial.SerialException at the end of
+    the capture, like ReplaySerial.
+
+    Usage:
+        bus = CaptureReplay([BusNode('ECU', ECU_ADDRESS, PollScheduler(ECU_PARAMETERS), ecu_info=ecu_info)],
+                            'capture.bin', realtime=False)
+        await bus.initialize(transport)
+        while True:
+            timestamp, node, values = await bus.next_sample(transport)
+    """
+
+    def __init__(self, nodes, path, realtime=True, speed=1.0):
+        """
+        Args:
+            nodes: BusNode list, as for BusScheduler
+            path: Capture file
+            realtime: Return samples at the recorded pace (times speed), or as fast as possible
+        """
+        info, records = read_capture(path)
+        self.nodes = list(nodes)
+        self.path = path
+        self.realtime = realtime
+        self.speed = speed
+        self.start_time = info['start_time']
+        self._records = records
+        self._replies = capture_replies(records)
+        self._started = time.monotonic()
+
+        # Per unit: buffer offsets of every address, the fast addresses and those refreshed since the last sample
+        self._offsets = {}
+        self._fast = {}
+        self._fresh = {}
+        for node in self.nodes:
+            offsets = {}
+            for channel in node.scheduler.channels:
+                for index, address in enumerate(channel.addresses):
+                    offsets.setdefault(address, []).append(channel.offset + index)
+            self._offsets[node.destination] = offsets
+            self._fast[node.destination] = {address for channel in node.scheduler.fast
+                                            for address in channel.addresses}
+            self._fresh[node.destination] = set()
+
+    def _enabled(self):
+        return [node for node in self.nodes if node.enabled]
+
+    async def initialize(self, transport):
+        """
+        Take the init reply of every node that has no ecu_info yet from the
+        capture. A unit that never answered is disabled. Returns the enabled nodes.
+        """
+        for node in self.nodes:
+            if node.ecu_info is not None:
+                continue
+            for _, unit, request, reply in capture_replies(self._records):
+                if unit == node.destination and request[:1] == b'\xbf' and reply[0] == 0xFF:
+                    node.ecu_info = transport.ssm2.parse_ecu_init(
+                        [0x80, TOOL_ADDRESS, unit, len(reply)] + list(reply))
+                    break
+            else:
+                node.enabled = False
+                print(f"{node.name} (0x{node.destination:02X}) is not in the capture, skipping it")
+
+        enabled = self._enabled()
+        if not enabled:
+            raise TimeoutError("No control unit answered init in the capture.")
+        self._started = time.monotonic()
+        return enabled
+
+    async def next_sample(self, transport):
+        """Return (drive timestamp, node, values) for the next recorded sample of any unit."""
+        nodes = {node.destination: node for node in self._enabled()}
+        for timestamp, unit, request, reply in self._replies:
+            node = nodes.get(unit)
+            addresses = read_addresses(request)
+            if node is None or addresses is None:
+                continue
+
+            if self.realtime:
+                delay = timestamp / self.speed - (time.monotonic() - self._started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            scheduler = node.scheduler
+            values = scheduler.values
+            offsets = self._offsets[unit]
+            for address, value in zip(addresses, reply[1:]):
+                for offset in offsets.get(address, ()):
+                    values[offset] = value
+            answered = set(addresses)
+            now = time.monotonic()
+            for channel in scheduler.channels:
+                if answered.issuperset(channel.addresses):
+                    channel.updated = now
+
+            fresh = self._fresh[unit]
+            fresh |= answered & self._fast[unit]
+            if fresh == self._fast[unit]:
+                fresh.clear()
+                node.samples += 1
+                return self.start_time + timestamp, node, values
+
+        raise serial.SerialException(f"End of capture {self.path}")
+
+    def ages(self, now=None):
+        """Seconds since each channel of every node was last replayed, by parameter name."""
+        now = time.monotonic() if now is None else now
+        ages = {}
+        for node in self.nodes:
+            ages.update(node.scheduler.ages(now))
+        return ages
+
+    def stats(self):
+        """Per-node sample rate, by node name."""
+        elapsed = time.monotonic() - self._started
+        return {node.name: node.stats(elapsed) for node in self.nodes if node.enabled}
+
+    def describe(self):
+        lines = [f"Replaying {self.path} ({'real time' if self.realtime else 'as fast as possible'})"]
+        for node in self.nodes:
+            lines.append(f"{node.name} (0x{node.destination:02X}, {'replayed' if node.enabled else 'disabled'}):")
+            lines.extend(f"  {line}" for line in node.scheduler.describe())
+        return lines
+
+
+class ReplaySerial:
+    """
+    Drop-in replacement for serial.Serial that replays the RX side of a capture.
+
+    Writes are accepted and discarded. Reads follow pyserial semantics (block until
+    size bytes or the timeout), measured on the capture's clock:
+
+    - realtime=True: the capture clock follows the wall clock times speed
+    - realtime=False: the clock jumps straight to the next recorded byte, so a
+      drive replays as fast as the consumer can decode it
+
+    Raises serial.SerialException once the capture is exhausted, which ends the
+    logger the same way a lost port does.
+    """
+
+    def __init__(self, path, timeout=2, realtime=True, speed=1.0):
+        info, records = read_capture(path)
+        self.port = path
+        self.baudrate = info['baudrate']
+        self.start_time = info['start_time']
+        self.timeout = timeout
+        self.realtime = realtime
+        self.speed = speed
+        self.is_open = True
+
+        self._chunks = [(timestamp, data) for timestamp, direction, data in records if direction == RX]
+        self._index = 0     # Next chunk to read
+        self._offset = 0    # Bytes already read from that chunk
+        self._clock = 0.0   # Capture time already consumed
+        self._wall_start = time.monotonic()
+
+        # Statistics
+        self.bytes_read = 0
+
+    @property
+    def duration(self):
+        return self._chunks[-1][0] if self._chunks else 0.0
+
+    def _now(self):
+        if self.realtime:
+            return max(self._clock, (time.monotonic() - self._wall_start) * self.speed)
+        return self._clock
+
+    def _wait_until(self, timestamp):
+        """Real-time mode: sleep until the capture clock reaches timestamp."""
+        if self.realtime:
+            delay = timestamp / self.speed - (time.monotonic() - self._wall_start)
+            if delay > 0:
+                time.sleep(delay)
+
+    @property
+    def in_waiting(self):
+        if self._index >= len(self._chunks):
+            return 0
+        now = self._now()
+        if not self.realtime:
+            # Everything up to the next chunk is "already received"
+            return len(self._chunks[self._index][1]) - self._offset
+        waiting = 0
+        for index in range(self._index, len(self._chunks)):
+            timestamp, data = self._chunks[index]
+            if timestamp > now:
+                break
+            waiting += len(data) - (self._offset if index == self._index else 0)
+        return waiting
+
+    def read(self, size=1):
+        if self._index >= len(self._chunks):
+            raise serial.SerialException(f"End of capture {self.port}")
+
+        start = self._now()
+        deadline = start + self.timeout if self.timeout is not None else float('inf')
+        result = bytearray()
+
+        while len(result) < size and self._index < len(self._chunks):
+            timestamp, data = self._chunks[self._index]
+            if timestamp > deadline:
+                break
+            self._wait_until(timestamp)
+            take = min(size - len(result), len(data) - self._offset)
+            result += data[self._offset:self._offset + take]
+            self._offset += take
+            self._clock = max(self._clock, timestamp)
+            if self._offset >= len(data):
+                self._index += 1
+                self._offset = 0
+
+        if len(result) < size:
+            # pyserial returns what it has once the timeout expires
+            if self._index < len(self._chunks):
+                self._wait_until(deadline)
+                self._clock = max(self._clock, deadline)
+
+        self.bytes_read += len(result)
+        return bytes(result)
+
+    def write(self, data):
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def reset_input_buffer(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) == 4 and sys.argv[2] == '--csv':
+        import csv
+
+        from logger import DERIVED_PARAMETERS, ECU_PARAMETERS
+
+        timestamps, columns = decode_capture(sys.argv[1], ECU_PARAMETERS, DERIVED_PARAMETERS)
+        with open(sys.argv[3], 'w', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(['Time'] + list(columns))
+            for index, timestamp in enumerate(timestamps):
+                writer.writerow([f"{timestamp:.3f}"] + ['' if np.isnan(column[index]) else column[index]
+                                                        for column in columns.values()])
+        print(f"{len(timestamps)} frames, {len(columns)} columns written to {sys.argv[3]}")
+        sys.exit(0)
+
+    if len(sys.argv) != 2:
+        print("Usage: python3 serial_capture.py <capture file> [--csv <output file>]")
+        sys.exit(1)
+
+    info, records = read_capture(sys.argv[1])
+    rx = sum(len(data) for _, direction, data in records if direction == RX)
+    tx = sum(len(data) for _, direction, data in records if direction == TX)
+    duration = records[-1][0] if records else 0.0
+    print(f"Started:   {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(info['start_time']))}")
+    print(f"Baud rate: {info['baudrate']}")
+    print(f"Duration:  {duration:.1f} s")
+    print(f"Records:   {len(records)}")
+    print(f"RX bytes:  {rx} ({rx / duration if duration else 0:.0f} B/s)")
+    print(f"TX bytes:  {tx}")
@@ -0,0 +1,127 @@
+"""
+Table-driven decoding of switches packed into shared status bytes.
+
+Switches (neutral, clutch, brake, idle, A/C...) are single bits of a few
+status bytes (0x61-0x69, 0x121). SwitchTable reads every status byte once per
+sample, however many of its bits are wanted, and turns each byte into its bits
+of one packed int through a precomputed 256-entry table, so a sample's switches
+cost one lookup and OR per byte.
+
+The packed int is logged as a few 'Switches' columns instead of one column per
+switch: the sample ring, the CSV and the binary log hold values as doubles,
+exact to 53 bits, so it is split at status byte boundaries into words of at
+most MAX_WORD_BITS ('Switches', 'Switches 2'...). Bit i of the packed int is
+switch i of SwitchTable.names (see legend()), join() puts the words back
+together and unpack() expands them into named booleans.
+
+Usage:
+    table = SwitchTable([
+        {'name': 'Neutral Position Switch', 'byte': 0x62, 'bit': 7},
+        {'name': 'Clutch Switch', 'byte': 0x121, 'bit': 7},
+    ])
+    ECU_PARAMETERS.extend(table.parameters())   # reads 0x62 and 0x121 once each
+    switches = table.unpack(table.join(raw_data[column] for column in table.columns))
+"""
+
+# Most switch bits in one column, a double holds integers exactly to 53 bits
+MAX_WORD_BITS = 53
+
+
+class SwitchTable:
+    """
+    Switches sharing status bytes, decoded by lookup table into one packed int.
+
+    Attributes:
+        names: Switch names, bit i of the packed int is names[i] (grouped by status byte)
+        addresses: Status byte addresses, in the order pack() expects them
+        columns: Column names of the packed words, see parameters()
+    """
+
+    def __init__(self, switches, name='Switches'):
+        """
+        Args:
+            switches: Dicts with 'name', 'byte' (status byte address) and 'bit' (0-7),
+                      e.g. Definitions.switches. Duplicate names are dropped.
+            name: Name of the first column, the others are numbered ('Switches 2'...)
+        """
+        unique = {}
+        for switch in switches:
+            unique.setdefault(switch['name'], switch)
+        # Each status byte's switches on adjacent bits, so words split between bytes
+        switches = sorted(unique.values(), key=lambda switch: switch['byte'])
+
+        self.names = [switch['name'] for switch in switches]
+        self.addresses = sorted({switch['byte'] for switch in switches})
+
+        # Per status byte: packed-int bits for each of the 256 possible byte values
+        self._tables = []
+        # Per word: (first bit, bit count, first address index, address count)
+        self._words = []
+        next_bit = 0
+        for index, address in enumerate(self.addresses):
+            bits = [(position, switch['bit']) for position, switch in enumerate(switches)
+                    if switch['byte'] == address]
+            self._tables.append(tuple(
+                sum(1 << position for position, bit in bits if raw >> bit & 1)
+                for raw in range(256)
+            ))
+            if not self._words or self._words[-1][1] + len(bits) > MAX_WORD_BITS:
+                self._words.append((next_bit, 0, index, 0))
+            first, count, first_address, address_count = self._words[-1]
+            self._words[-1] = (first, count + len(bits), first_address, address_count + 1)
+            next_bit += len(bits)
+
+        self.columns = [name] + [f"{name} {number}" for number in range(2, len(self._words) + 1)]
+
+    def __len__(self):
+        return len(self.names)
+
+    def pack(self, raw):
+        """Packed switch bits from the status bytes (one per address, in addresses order)."""
+        packed = 0
+        for table, value in zip(self._tables, raw):
+            packed |= table[value]
+        return packed
+
+    def join(self, words):
+        """Packed int from the values of the columns, in columns order."""
+        return sum(int(word) << first for word, (first, _, _, _) in zip(words, self._words))
+
+    def unpack(self, packed):
+        """Named booleans of a packed int."""
+        return {name: bool(packed >> position & 1) for position, name in enumerate(self.names)}
+
+    def legend(self):
+        """'bit: name' of every switch per column, to document the packed columns."""
+        return {
+            column: [f"{position}: {self.names[first + position]}" for position in range(count)]
+            for column, (first, count, _, _) in zip(self.columns, self._words)
+        }
+
+    def parameters(self):
+        """
+        ECU_PARAMETERS-style dicts, one per column, each reading its status
+        bytes once, as a hex bitfield.
+        """
+        parameters = []
+        for column, (first, count, first_address, address_count) in zip(self.columns, self._words):
+            addresses = self.addresses[first_address:first_address + address_count]
+            tables = [tuple(bits >> first for bits in table)
+                      for table in self._tables[first_address:first_address + address_count]]
+            parameters.append({
+                'name': column,
+                'address': addresses if len(addresses) > 1 else addresses[0],
+                'calculation': self._word_packer(tables),
+                'format': f"#0{2 + (count + 3) // 4}x",
+                'unit': 'bits',
+            })
+        return parameters
+
+    @staticmethod
+    def _word_packer(tables):
+        def pack(raw):
+            packed = 0
+            for table, value in zip(tables, raw):
+                packed |= table[value]
+            return packed
+        return pack
@@ -0,0 +1,33 @@
+"""
+Shared fixtures. The modules live flat in src/ (deployed to /etc/pySSM2/), so
+src/ and config/ go on the import path, as run_logger.py does.
+"""
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'src'), os.path.join(ROOT, 'config')]
+
+from ecu_simulator import ECUSimulator  # noqa: E402
+import PySSM2  # noqa: E402
+
+
+@pytest.fixture
+def simulator():
+    """Unpaced ECU simulator serving on a pty."""
+    sim = ECUSimulator(baudrate=0, response_delay=0.0)
+    sim.open()
+    sim.start()
+    yield sim
+    sim.stop()
+
+
+@pytest.fixture
+def ssm2(simulator):
+    """PySSM2 connection to the simulator."""
+    connection = PySSM2.PySSM2(simulator.port, timeout=1)
+    yield connection
+    connection.close()
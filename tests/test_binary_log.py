@@ -0,0 +1,74 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from binary_log import SYNC_INTERVAL, BinaryLogWriter, read_header, read_log
+from sample_ring import SampleRing
+
+CHANNELS = [
+    {'name': 'Time', 'unit': 's', 'format': None, 'dtype': '<f8'},
+    {'name': 'Engine Speed', 'unit': 'RPM', 'format': None, 'dtype': '<f4'},
+    {'name': 'Mass Airflow', 'unit': 'g/s', 'format': '.2f', 'dtype': '<f8'},
+]
+
+
+def write_log(path, count):
+    samples = SampleRing(['Engine Speed', 'Mass Airflow'], capacity=2 * count)
+    writer = BinaryLogWriter(str(path), CHANNELS, samples, ecu_id='0x1b 0x14 0x40 0x5 0x5')
+    writer.start()
+    for index in range(count):
+        samples.append(1000.0 + index, (float(index), index / 100))
+    writer.stop()
+    return read_header(str(path))
+
+
+def record_position(header, sample):
+    """File offset of a sample's record: a sync record opens the file and follows every SYNC_INTERVAL samples."""
+    return header['data_offset'] + (1 + sample + sample // SYNC_INTERVAL) * header['record_size']
+
+
+def test_round_trip(tmp_path):
+    path = tmp_path / 'log.ssm2log'
+    write_log(path, 250)
+    header, records, skipped = read_log(str(path))
+    assert header['ecu_id'] == '0x1b 0x14 0x40 0x5 0x5'
+    assert skipped == 0
+    assert len(records) == 250
+    assert records['Engine Speed'].tolist() == [float(index) for index in range(250)]
+    assert records['Mass Airflow'][123] == 1.23
+
+
+def test_torn_last_record_is_dropped(tmp_path):
+    path = tmp_path / 'log.ssm2log'
+    header = write_log(path, 250)
+    with open(path, 'r+b') as logfile:
+        logfile.truncate(record_position(header, 249) + header['record_size'] // 2)
+    _, records, skipped = read_log(str(path))
+    assert len(records) == 249
+    assert records['Time'][-1] == 1248.0
+
+
+def test_zeroed_block_skips_to_next_sync(tmp_path):
+    path = tmp_path / 'log.ssm2log'
+    header = write_log(path, 250)
+    # A power cut left a zeroed block in the middle of the second sync segment
+    with open(path, 'r+b') as logfile:
+        logfile.seek(record_position(header, 120))
+        logfile.write(bytes(3 * header['record_size']))
+    _, records, skipped = read_log(str(path))
+
+    # Samples 120-199 are dropped up to the sync record, the rest are kept
+    expected = [1000.0 + index for index in range(250) if not 120 <= index < 200]
+    assert records['Time'].tolist() == expected
+    assert skipped == 80
+
+
+def test_garbage_timestamps_are_skipped(tmp_path):
+    path = tmp_path / 'log.ssm2log'
+    header = write_log(path, 150)
+    with open(path, 'r+b') as logfile:
+        logfile.seek(record_position(header, 30))
+        logfile.write(b'\xff' * 8)     # NaN timestamp
+    _, records, skipped = read_log(str(path))
+    assert len(records) == 30 + 50
+    assert skipped == 70
@@ -0,0 +1,35 @@
+import pytest
+
+from expressions import ExpressionError, compile_expression, decoder
+
+
+def test_arithmetic_conversions():
+    assert compile_expression('32+9*(x-40)/5').function(100) == 140
+    assert compile_expression('-x+1').function(3) == -2
+    assert decoder('x/4', length=2)([0x1F, 0x40]) == 2000.0
+
+
+def test_parameter_references():
+    conversion = compile_expression('[P7:psi]-[P24:psi]')
+    values = {('P7', 'psi'): 20.0, ('P24', 'psi'): 14.5}
+    assert conversion.function(*(values[conversion.references[name]] for name in conversion.names)) == 5.5
+
+
+@pytest.mark.parametrize('text', [
+    'x.__class__',
+    'x.real',
+    "__import__('os').system('true')",
+    'abs(x)',
+    '(lambda: 1)()',
+    'x[0]',
+    'x**2',
+    'x if x else 1',
+    "'text'",
+    'True',
+    'y',
+    '[x for x in ()]',
+    '().__class__.__bases__[0].__subclasses__()',
+])
+def test_escapes_are_rejected(text):
+    with pytest.raises(ExpressionError):
+        compile_expression(text)
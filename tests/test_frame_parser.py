@@ -0,0 +1,75 @@
+import os
+
+from ecu_simulator import ECUSimulator, ECU_ADDRESS, TCU_ADDRESS
+from frame_parser import FrameParser
+
+# Frames as the simulator puts them on the line
+reply = ECUSimulator()._frame
+request = ECUSimulator._request_packet
+
+
+def parse(parser, *chunks):
+    frames = []
+    for chunk in chunks:
+        parser.feed(chunk)
+        frames.extend(bytes(data) for data in parser.frames())
+    return frames
+
+
+def test_frame_split_across_reads():
+    parser = FrameParser()
+    frame = reply(b'\xe8\x01\x02')
+    assert parse(parser, *(frame[index:index + 1] for index in range(len(frame)))) == [b'\xe8\x01\x02']
+    assert parser.good_frames == 1
+
+
+def test_resync_after_garbage_and_bad_checksum():
+    parser = FrameParser()
+    corrupt = bytearray(reply(b'\xe8\x11\x22'))
+    corrupt[-1] ^= 0xFF
+    frames = parse(parser, b'\x13\x37\x00', bytes(corrupt), reply(b'\xe8\x33\x44'), reply(b'\xe8\x55\x66'))
+    assert frames == [b'\xe8\x33\x44', b'\xe8\x55\x66']
+    assert parser.bad_frames == 1
+    assert parser.discarded_bytes > 0
+
+
+def test_false_header_in_payload_does_not_misalign():
+    parser = FrameParser()
+    # A torn frame whose size byte swallows the next frames until its checksum fails
+    good = [bytes([0xE8, index, 0x80]) for index in range(20)]
+    frames = parse(parser, b'\x80\xf0\x10\x40\xe8', *(reply(data) for data in good))
+    assert frames == good
+    assert parser.bad_frames == 1
+
+
+def test_echo_and_other_units_are_skipped():
+    parser = FrameParser(destination=0xF0, source=ECU_ADDRESS)
+    frames = parse(parser, request(b'\xa8\x00\x00\x00\x10', ECU_ADDRESS),
+                   reply(b'\xe8\x07', TCU_ADDRESS), reply(b'\xe8\x09', ECU_ADDRESS))
+    assert frames == [b'\xe8\x09']
+    assert parser.skipped_frames == 2
+    assert parser.bad_frames == 0
+
+
+def test_data_size_rejects_other_sizes():
+    parser = FrameParser(data_size=3)
+    frames = parse(parser, reply(b'\xe8\x01\x02\x03\x04'), reply(b'\xe8\x05\x06'))
+    assert frames == [b'\xe8\x05\x06']
+    assert parser.bad_frames == 1
+
+
+def test_stream_resyncs_after_line_noise(simulator, ssm2):
+    simulator.ram[0x1000:0x1002] = b'\x5a\xa5'
+    ssm2.read_single_address_continuously([0x1000, 0x1001])
+    for _ in range(3):
+        assert bytes(ssm2.receive_frame()) == b'\xe8\x5a\xa5'
+
+    # Noise with a false header and a torn frame, interleaved with the stream
+    os.write(simulator.master, b'\x80\xf0\x10\x03\xe8\x5a' + b'\x00\xff\x80\x13' * 8)
+    # The pty buffers a few hundred frames ahead of the noise
+    frames = 0
+    while not ssm2.parser.discarded_bytes and frames < 5000:
+        assert bytes(ssm2.receive_frame()) == b'\xe8\x5a\xa5'
+        frames += 1
+    assert ssm2.parser.discarded_bytes > 0
+    assert [bytes(ssm2.receive_frame()) for _ in range(20)] == [b'\xe8\x5a\xa5'] * 20
@@ -0,0 +1,52 @@
+import os
+
+from log_segments import SEGMENT_HEADER, CODECS, SegmentedWriter, decompress, read_segment, segments
+
+import pytest
+
+CHUNKS = [f"{index},{index * 3},{index / 7:.3f}\n".encode() * 200 for index in range(5)]
+
+
+@pytest.fixture(params=sorted(CODECS))
+def log_path(tmp_path, request):
+    path = str(tmp_path / f'log.{request.param}.ssz')
+    logfile = SegmentedWriter(open(path, 'wb'), request.param, segment_seconds=0)
+    for chunk in CHUNKS:
+        logfile.write(chunk)
+        logfile.flush()     # Cuts one segment per chunk
+    logfile.close()
+    return path
+
+
+def test_round_trip(log_path):
+    found = segments(log_path)
+    assert len(found) == len(CHUNKS)
+    assert [segment['offset'] for segment in found] == [sum(map(len, CHUNKS[:index])) for index in range(len(CHUNKS))]
+    assert decompress(log_path) == b''.join(CHUNKS)
+    # Any segment decodes on its own
+    assert read_segment(log_path, found[3]) == CHUNKS[3]
+
+
+def test_truncated_last_segment_is_dropped(log_path):
+    last = segments(log_path)[-1]
+    with open(log_path, 'r+b') as logfile:
+        logfile.truncate(last['position'] + last['compressed_size'] // 2)
+    assert len(segments(log_path)) == len(CHUNKS) - 1
+    assert decompress(log_path) == b''.join(CHUNKS[:-1])
+
+
+def test_truncated_segment_header_is_dropped(log_path):
+    last = segments(log_path)[-1]
+    with open(log_path, 'r+b') as logfile:
+        logfile.truncate(last['position'] - SEGMENT_HEADER.size + 3)
+    assert decompress(log_path) == b''.join(CHUNKS[:-1])
+
+
+def test_damaged_segment_ends_the_data(log_path):
+    found = segments(log_path)
+    with open(log_path, 'r+b') as logfile:
+        logfile.seek(found[2]['position'])
+        logfile.write(os.urandom(found[2]['compressed_size']))
+    assert decompress(log_path) == b''.join(CHUNKS[:2])
+    # The limit stops reading once enough data is out
+    assert decompress(log_path, limit=1) == CHUNKS[0]
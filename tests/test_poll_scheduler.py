@@ -0,0 +1,39 @@
+from poll_scheduler import Channel, PollScheduler, planned_rate, split_channels
+
+FAST = [
+    {'name': 'Engine Speed', 'address': [0x0E, 0x0F]},
+    {'name': 'Manifold Absolute Pressure', 'address': 0x0D},
+    {'name': 'Vehicle Speed', 'address': 0x10},
+]
+
+
+def names(channels):
+    return [channel.name for channel in channels]
+
+
+def test_frequent_channel_is_streamed_inline():
+    parameters = FAST + [{'name': 'Battery Voltage', 'address': 0x1C, 'rate': 1}]
+    fast, slow = split_channels([Channel(param, 0) for param in parameters])
+    assert names(fast) == [param['name'] for param in parameters]
+    assert slow == []
+
+
+def test_rare_channel_interrupts_the_stream():
+    parameters = FAST + [{'name': 'Atmospheric Pressure', 'address': 0x23, 'rate': 0.1}]
+    fast, slow = split_channels([Channel(param, 0) for param in parameters])
+    assert names(fast) == [param['name'] for param in FAST]
+    assert names(slow) == ['Atmospheric Pressure']
+
+
+def test_split_never_plans_slower_than_streaming_everything():
+    parameters = FAST + [
+        {'name': 'Battery Voltage', 'address': 0x1C, 'rate': 1},
+        {'name': 'Coolant Temperature', 'address': 0x08, 'rate': 0.2},
+        {'name': 'Atmospheric Pressure', 'address': 0x23, 'rate': 0.1},
+    ]
+    scheduler = PollScheduler(parameters)
+    channels = [Channel(param, 0) for param in parameters]
+    assert scheduler.planned_rate >= planned_rate(channels, [])
+    assert scheduler.planned_rate <= planned_rate(channels[:len(FAST)], [])
+    # Inlined channels keep their place in the merged buffer
+    assert scheduler.fast_plan.addresses == [0x0E, 0x0F, 0x0D, 0x10, 0x1C]
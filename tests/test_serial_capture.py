@@ -0,0 +1,131 @@
+import asyncio
+import time
+
+import numpy as np
+import pytest
+import serial
+
+from async_transport import AsyncSSM2Transport
+from bus_scheduler import BusNode, BusScheduler, ECU_ADDRESS
+from derived import DerivedEvaluator, where
+from ecu_simulator import COUNTER_ADDRESS, ECUSimulator
+from frame_decoder import FrameDecoder
+from poll_scheduler import PollScheduler
+from serial_capture import (CAPTURE_HEADER, CAPTURE_MAGIC, CAPTURE_RECORD, CaptureRecorder, CaptureReplay,
+                            decode_capture, ReplaySerial)
+from protocol_trace import RX
+import PySSM2
+
+# The block is too wide to stream inline, so the stream is interrupted for it
+PARAMETERS = [
+    {'name': 'Engine Speed', 'address': [0x0E, 0x0F], 'expr': 'x/4'},
+    {'name': 'Counter', 'address': COUNTER_ADDRESS, 'expr': 'x'},
+    {'name': 'Battery Voltage', 'address': 0x1C, 'expr': 'x*0.08', 'rate': 2},
+    {'name': 'Block', 'address': list(range(0x20, 0x30)), 'calculation': lambda raw: float(raw[3]), 'rate': 2},
+]
+DERIVED = [
+    {'name': 'Counter Per Volt', 'depends': ['Counter', 'Battery Voltage'],
+     'calculation': lambda data: data['Counter'] / where(data['Battery Voltage'] == 0, 1, data['Battery Voltage'])},
+    {'name': 'Block Per Volt', 'depends': ['Block', 'Battery Voltage'],
+     'calculation': lambda data: data['Block'] / data['Battery Voltage']},
+]
+TIMING = {'response_delay': 0.005, 'quiet_time': 0.02}
+
+
+@pytest.fixture
+def paced_simulator():
+    """
+    Simulator paced at 4800 baud. The capture only holds what was read, not which
+    frames the logger consumed, so the line has to be slower than the reader, as
+    on a real car.
+    """
+    sim = ECUSimulator(baudrate=4800, response_delay=0.005)
+    sim.open()
+    sim.start()
+    yield sim
+    sim.stop()
+
+
+@pytest.fixture
+def capture(paced_simulator, tmp_path):
+    """A recorded simulator session: (capture path, merged buffers, ECU info)."""
+    path = str(tmp_path / 'capture.bin')
+    ssm2 = PySSM2.PySSM2(paced_simulator.port, timeout=1)
+    ssm2.ser = CaptureRecorder(ssm2.ser, path)
+
+    async def record():
+        transport = AsyncSSM2Transport(ssm2)
+        ecu_info = await transport.run(ssm2.ecu_init)
+        scheduler = PollScheduler(PARAMETERS, **TIMING)
+        bus = BusScheduler([BusNode('ECU', ECU_ADDRESS, scheduler, ecu_info=ecu_info)])
+        await bus.initialize(transport)
+        recorded = []
+        while scheduler.slow_refreshes < 5:
+            _, _, values = await bus.next_sample(transport)
+            recorded.append(bytes(values))
+        await scheduler.stop(transport)
+        return recorded, ecu_info
+
+    recorded, ecu_info = asyncio.run(record())
+    ssm2.close()
+    return path, recorded, ecu_info
+
+
+def test_record_and_replay(capture):
+    path, recorded, ecu_info = capture
+
+    async def replay():
+        scheduler = PollScheduler(PARAMETERS, **TIMING)
+        bus = CaptureReplay([BusNode('ECU', ECU_ADDRESS, scheduler)], path, realtime=False)
+        transport = AsyncSSM2Transport(PySSM2.PySSM2(path, ser=ReplaySerial(path)))
+        await bus.initialize(transport)
+        assert list(bus.nodes[0].ecu_info['ecu_id']) == list(ecu_info['ecu_id'])
+        replayed = []
+        with pytest.raises(serial.SerialException):
+            while True:
+                _, _, values = await bus.next_sample(transport)
+                replayed.append(bytes(values))
+        return replayed
+
+    replayed = asyncio.run(replay())
+    assert len(replayed) == len(recorded)
+    assert replayed == recorded
+    # Every row has the block from a one-shot read
+    assert all(any(values[4:]) for values in replayed)
+
+
+def test_decode_capture(capture):
+    path, recorded, _ = capture
+    timestamps, columns = decode_capture(path, PARAMETERS, DERIVED)
+
+    # The block is only read one-shot, so it is not in the stream
+    assert list(columns) == ['Engine Speed', 'Counter', 'Battery Voltage', 'Counter Per Volt']
+    assert len(timestamps) == len(recorded)
+    assert np.all(np.diff(timestamps) >= 0)
+    decoder = FrameDecoder(PARAMETERS)
+    evaluator = DerivedEvaluator(DERIVED)
+    for index, values in enumerate(recorded):
+        live = evaluator.evaluate(dict(zip(decoder.names, decoder.decode(values))))
+        for name, column in columns.items():
+            assert column[index] == live[name], (name, index)
+
+
+def test_read_without_fd_respects_timeout(tmp_path):
+    # One chunk now, the next one 10 s later
+    path = str(tmp_path / 'capture.bin')
+    with open(path, 'wb') as capturefile:
+        capturefile.write(CAPTURE_HEADER.pack(CAPTURE_MAGIC, time.time(), 4800))
+        for timestamp, data in ((0.0, b'\x01\x02'), (10.0, b'\x03')):
+            capturefile.write(CAPTURE_RECORD.pack(timestamp, RX, len(data)) + data)
+
+    async def drain():
+        ssm2 = PySSM2.PySSM2(path, ser=ReplaySerial(path, realtime=True))
+        transport = AsyncSSM2Transport(ssm2)
+        assert transport._fd is None
+        started = time.monotonic()
+        discarded = await transport.drain(0.05)
+        return discarded, time.monotonic() - started
+
+    discarded, elapsed = asyncio.run(drain())
+    assert discarded == 2
+    assert elapsed < 1.0